@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+# audio_dsp.py --- whole buffer operations on 16 bit mono PCM
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# The helpers accept an array('h'), a byte string or a memoryview of
+# little endian signed shorts and return an array('h'). NumPy is used when
+# it is installed, then audioop, and the plain Python loops are kept as
+# the last fallback. Call use_backend() to force one of them.
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+SAMPLE_WIDTH = 2
+MAXIMUM = 16384
+
+# blocks scanned by audioop.max() while searching for the first loud sample
+_SCAN_BLOCK = 256
+
+
+def to_bytes(samples):
+    """Return the raw PCM bytes of `samples`, byte strings are passed through"""
+    if isinstance(samples, array):
+        if hasattr(samples, 'tobytes'):
+            return samples.tobytes()
+        return samples.tostring()
+    if isinstance(samples, memoryview):
+        return samples.tobytes()
+    return samples
+
+
+def to_array(samples):
+    """Return `samples` as an array('h')"""
+    if isinstance(samples, array):
+        return samples
+    if numpy is not None and isinstance(samples, numpy.ndarray):
+        samples = samples.astype('<i2').tobytes()
+    a = array('h')
+    if hasattr(a, 'frombytes'):
+        a.frombytes(to_bytes(samples))
+    else:
+        a.fromstring(to_bytes(samples))
+    return a
+
+
+# pure Python
+
+def _py_samples(samples):
+    if isinstance(samples, array):
+        return samples
+    return to_array(samples)
+
+
+def _py_is_silent(samples, threshold):
+    return max(_py_samples(samples)) < threshold
+
+
+def _py_trim(samples, threshold):
+    L = _py_samples(samples)
+    start = 0
+    while start < len(L) and abs(L[start]) <= threshold:
+        start += 1
+    end = len(L)
+    while end > start and abs(L[end - 1]) <= threshold:
+        end -= 1
+    return L[start:end]
+
+
+def _py_normalize(samples, maximum):
+    L = _py_samples(samples)
+    times = float(maximum)/max(abs(i) for i in L)
+    return array('h', [int(i*times) for i in L])
+
+
+def _py_add_silence(samples, nframes):
+    LRtn = array('h', [0]) * nframes
+    LRtn.extend(_py_samples(samples))
+    LRtn.extend(array('h', [0]) * nframes)
+    return LRtn
+
+
+# audioop
+
+def _ao_is_silent(samples, threshold):
+    data = to_bytes(samples)
+    if not data:
+        raise ValueError('is_silent() of an empty buffer')
+    return audioop.minmax(data, SAMPLE_WIDTH)[1] < threshold
+
+
+def _ao_first_loud(data, threshold, reverse):
+    """Sample index of the first (or last) sample louder than `threshold`"""
+    nsamples = len(data) // SAMPLE_WIDTH
+    blocks = range(0, nsamples, _SCAN_BLOCK)
+    if reverse:
+        blocks = reversed(blocks)
+    for b in blocks:
+        block = data[b * SAMPLE_WIDTH:(b + _SCAN_BLOCK) * SAMPLE_WIDTH]
+        if audioop.max(block, SAMPLE_WIDTH) <= threshold:
+            continue
+        indexes = range(len(block) // SAMPLE_WIDTH)
+        if reverse:
+            indexes = reversed(indexes)
+        for i in indexes:
+            if abs(audioop.getsample(block, SAMPLE_WIDTH, i)) > threshold:
+                return b + i
+    return None
+
+
+def _ao_trim(samples, threshold):
+    data = to_bytes(samples)
+    start = _ao_first_loud(data, threshold, False)
+    if start is None:
+        return array('h')
+    end = _ao_first_loud(data, threshold, True) + 1
+    return to_array(data[start * SAMPLE_WIDTH:end * SAMPLE_WIDTH])
+
+
+def _ao_normalize(samples, maximum):
+    data = to_bytes(samples)
+    times = float(maximum)/audioop.max(data, SAMPLE_WIDTH)
+    return to_array(audioop.mul(data, SAMPLE_WIDTH, times))
+
+
+def _ao_add_silence(samples, nframes):
+    pad = b'\x00' * (nframes * SAMPLE_WIDTH)
+    return to_array(pad + to_bytes(samples) + pad)
+
+
+# NumPy
+
+def _np_samples(samples):
+    if isinstance(samples, numpy.ndarray):
+        return samples
+    return numpy.frombuffer(to_bytes(samples), dtype='<i2')
+
+
+def _np_is_silent(samples, threshold):
+    return int(_np_samples(samples).max()) < threshold
+
+
+def _np_trim(samples, threshold):
+    a = _np_samples(samples)
+    loud = numpy.flatnonzero((a > threshold) | (a < -threshold))
+    if not len(loud):
+        return array('h')
+    return to_array(a[loud[0]:loud[-1] + 1])
+
+
+def _np_normalize(samples, maximum):
+    a = _np_samples(samples).astype(numpy.int32)
+    times = float(maximum)/numpy.abs(a).max()
+    return to_array((a * times).astype('<i2'))
+
+
+def _np_add_silence(samples, nframes):
+    pad = numpy.zeros(nframes, dtype='<i2')
+    return to_array(numpy.concatenate((pad, _np_samples(samples), pad)))
+
+
+BACKENDS = {
+    'python': (_py_is_silent, _py_trim, _py_normalize, _py_add_silence),
+    'audioop': (_ao_is_silent, _ao_trim, _ao_normalize, _ao_add_silence),
+    'numpy': (_np_is_silent, _np_trim, _np_normalize, _np_add_silence),
+}
+
+
+def available_backends():
+    """Names of the backends usable in this interpreter, fastest first"""
+    names = []
+    if numpy is not None:
+        names.append('numpy')
+    if audioop is not None:
+        names.append('audioop')
+    names.append('python')
+    return names
+
+
+backend = None
+_is_silent = _trim = _normalize = _add_silence = None
+
+
+def use_backend(name):
+    """Select the implementation used by the module level functions"""
+    global backend, _is_silent, _trim, _normalize, _add_silence
+    if name not in available_backends():
+        raise ValueError('audio_dsp backend %s is not available' % name)
+    backend = name
+    _is_silent, _trim, _normalize, _add_silence = BACKENDS[name]
+
+
+use_backend(available_backends()[0])
+
+
+def is_silent(samples, threshold):
+    "Returns `True` if below the 'silent' threshold"
+    return _is_silent(samples, threshold)
+
+
+def trim(samples, threshold):
+    "Trim the blank spots at the start and end"
+    return _trim(samples, threshold)
+
+
+def normalize(samples, maximum=MAXIMUM):
+    "Average the volume out"
+    return _normalize(samples, maximum)
+
+
+def add_silence(samples, seconds, rate):
+    "Add silence to the start and end of `samples` of length `seconds` (float)"
+    return _add_silence(samples, int(seconds*rate))
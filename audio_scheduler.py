@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+# audio_scheduler.py --- ordered AudioPlayer queue honoring playBehavior
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# AudioPlayer.play directives used to start a thread per stream, so
+# several items could play at once. AudioScheduler keeps one ordered
+# queue and plays its items one after the other on a single thread:
+#
+#   REPLACE_ALL       stop the current item and replace the whole queue
+#   ENQUEUE           append to the end of the queue
+#   REPLACE_ENQUEUED  replace the items after the current one
+#
+# While an item plays, the stream URL of the next one is resolved on the
+# worker pool (playlist lookups and the like), so the next item starts as
+# soon as the current one ends.
+#
+# When the queue holds nothing after the current item, on_idle (the
+# getNextItem request) runs `lead_ms` before the item ends instead of
+# after, so the item it queues is resolved by the time it is needed.
+# The remaining time is polled from the player, streams of unknown
+# length fall back to asking when they end. So does an item whose early
+# request failed or queued nothing.
+#
+# An item whose stream is not resolved within RESOLVE_TIMEOUT is given up
+# and the next one plays, a stalled playlist fetch does not hold up the
+# queue.
+
+import collections
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import workpool
+
+logger = logging.getLogger(__name__)
+
+REPLACE_ALL = 'REPLACE_ALL'
+ENQUEUE = 'ENQUEUE'
+REPLACE_ENQUEUED = 'REPLACE_ENQUEUED'
+
+
+class AudioItem(object):
+    """One stream of an AudioPlayer.play directive or a getNextItem response"""
+
+    def __init__(self, url, stream_id='', offset=0, nav_token='',
+                 report_required=False, progress_report=None):
+        self.url = url
+        self.stream_id = stream_id
+        self.offset = int(offset or 0)
+        self.nav_token = nav_token
+        self.report_required = report_required
+        self.progress_report = progress_report or {}
+        self.resolved = None
+        self.next_requested = False
+        # set once the item played to its end, with the generation it
+        # was taken off the queue in
+        self.ended = False
+        self.generation = None
+
+    @classmethod
+    def from_stream(cls, stream, nav_token=''):
+        return cls(stream['streamUrl'], stream.get('streamId', ''),
+                   stream.get('offsetInMilliseconds', 0), nav_token,
+                   stream.get('progressReportRequired', False),
+                   stream.get('progressReport'))
+
+    def __repr__(self):
+        return '<AudioItem %s %s>' % (self.stream_id, self.url)
+
+
+class AudioScheduler(object):
+    """
+    :param play: play(item, url) plays one item and blocks until it is
+                 over, returning True if it reached its end.
+    :param stop: stop() makes the running play() return.
+    :param resolve: resolve(url) returns the URL to hand to play(), run on
+                    the pool ahead of time. None to play URLs as they are.
+    :param on_idle: on_idle(item) is called on the pool when `item`
+                    ended and nothing else is queued.
+    :param pool: a workpool.WorkerPool, one with two workers by default.
+    :param remaining: remaining() returns the ms left in the current item,
+                      or None while that is unknown.
+    :param lead_ms: how long before the end of an item on_idle is called,
+                    0 to call it after the item ended.
+    :param on_drop: on_drop(item) is called for every item that is
+                    replaced or cleared before it played, so what it holds
+                    can be freed.
+    """
+
+    # seconds between looks at the remaining time of a stream whose
+    # length is not known yet
+    POLL_INTERVAL = 1.0
+    # seconds the scheduler waits for the stream of an item to resolve
+    RESOLVE_TIMEOUT = 20.0
+
+    def __init__(self, play, stop, resolve=None, on_idle=None, pool=None,
+                 remaining=None, lead_ms=0, on_drop=None):
+        self._play = play
+        self._on_drop = on_drop
+        self._stop = stop
+        self._resolve = resolve
+        self._on_idle = on_idle
+        self._remaining = remaining
+        self.lead_ms = lead_ms
+        self._timer = None
+        self.pool = pool or workpool.WorkerPool(2, name='audio')
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._generation = 0
+        # generation the current item was taken off the queue in
+        self._current_generation = 0
+        self.current = None
+        self._thread = threading.Thread(target=self._run, name='audio-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, items, behavior=ENQUEUE):
+        """Queue `items` according to the playBehavior `behavior`"""
+        stop = False
+        dropped = []
+        with self._cond:
+            if behavior == REPLACE_ALL:
+                dropped = list(self._queue)
+                self._queue.clear()
+                self._generation += 1
+                stop = self.current is not None
+            elif behavior == REPLACE_ENQUEUED:
+                dropped = list(self._queue)
+                self._queue.clear()
+            self._queue.extend(items)
+            self._prefetch()
+            self._cond.notify()
+        if stop:
+            self._stop()
+        self._dropped(dropped)
+
+    def clear(self):
+        """Drop the queue and stop the current item"""
+        with self._cond:
+            dropped = list(self._queue)
+            self._queue.clear()
+            self._generation += 1
+            stop = self.current is not None
+        if stop:
+            self._stop()
+        self._dropped(dropped)
+
+    def _dropped(self, items):
+        if not self._on_drop:
+            return
+        for item in items:
+            try:
+                self._on_drop(item)
+            except Exception as e:
+                logger.warning('dropping %r failed: %s' % (item, e))
+
+    def stale(self, item):
+        """
+        True when `item` was replaced or cleared since it was taken off
+        the queue. play() checks it once its player is reachable by
+        stop(), a stop() that came before found nothing to stop.
+        """
+        with self._cond:
+            return item is not self.current or self._current_generation != self._generation
+
+    def playing(self, item):
+        """
+        Tell the scheduler `item` started, which arms the early on_idle
+        call when there is a lead time.
+        """
+        if self.lead_ms and self._remaining and self._on_idle and item.nav_token:
+            self._arm(item, 0)
+
+    def _arm(self, item, delay):
+        with self._cond:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._check_next, (item,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _check_next(self, item):
+        "Timer callback: request the next item once within lead_ms of the end"
+        with self._cond:
+            if self.current is not item or self._queue or item.next_requested:
+                return
+        left = self._remaining()
+        if left is None or left <= 0:
+            self._arm(item, self.POLL_INTERVAL)
+        elif left > self.lead_ms:
+            self._arm(item, min((left - self.lead_ms) / 1000.0, 10 * self.POLL_INTERVAL))
+        else:
+            item.next_requested = True
+            self.pool.submit(self._request_next, item)
+
+    def _request_next(self, item):
+        "The early on_idle call, the end of `item` asks again if it got nothing"
+        try:
+            self._on_idle(item)
+        except Exception as e:
+            logger.warning('next item after %r failed: %s' % (item, e))
+        with self._cond:
+            if self._queue or self.current not in (item, None):
+                return
+            item.next_requested = False
+            # it ended while the request was running, ask now
+            retry = (item.ended and self.current is None and
+                     item.generation == self._generation)
+        if retry:
+            try:
+                self._on_idle(item)
+            except Exception as e:
+                logger.warning('next item after %r failed: %s' % (item, e))
+
+    def queued(self):
+        with self._cond:
+            return list(self._queue)
+
+    def _prefetch(self):
+        "Resolve the item that plays next, with the lock held"
+        if self._resolve and self._queue and self._queue[0].resolved is None:
+            item = self._queue[0]
+            item.resolved = self.pool.submit(self._resolve, item.url)
+
+    def _url(self, item):
+        "URL to play `item` from, None when resolving it timed out"
+        if not self._resolve:
+            return item.url
+        if item.resolved is None:
+            item.resolved = self.pool.submit(self._resolve, item.url)
+        try:
+            return item.resolved.result(self.RESOLVE_TIMEOUT)
+        except queue.Empty:
+            logger.warning('resolving %r timed out' % item)
+            return None
+        except Exception:
+            return item.url
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                item = self.current = self._queue.popleft()
+                generation = self._current_generation = self._generation
+                item.generation = generation
+                self._prefetch()
+            ended = False
+            try:
+                url = self._url(item)
+                with self._cond:
+                    # replaced while its stream was being resolved
+                    skip = generation != self._generation
+                if skip or url is None:
+                    self._dropped([item])
+                else:
+                    ended = self._play(item, url)
+            except Exception as e:
+                logger.warning('playing %r failed: %s' % (item, e))
+            with self._cond:
+                self.current = None
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                item.ended = ended and generation == self._generation
+                idle = item.ended and not self._queue and not item.next_requested
+            if idle and self._on_idle:
+                self.pool.submit(self._on_idle, item)
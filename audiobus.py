@@ -0,0 +1,395 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# audiobus.py --- shared microphone capture for MMDAgent subprocesses
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# One capture daemon owns the input device and writes PCM into a ring
+# buffer in an mmap'ed file (by default in /dev/shm). mmdagent_snowboy.py
+# and mmdagent_alexa.py open readers on that file instead of opening their
+# own PyAudio streams, so the device is never handed back and forth.
+#
+# The file starts with a 64 byte header followed by `capacity` bytes of
+# audio. `written` in the header is the total number of bytes ever written;
+# byte N of the stream lives at data[N % capacity]. Every reader keeps its
+# own absolute offset, so any number of processes can read at their own
+# pace. A reader that falls more than `capacity` bytes behind skips ahead
+# to the oldest audio still in the buffer.
+#
+# The writer also stores its pid and the time of its last write, so a
+# file left behind by a daemon that died is not mistaken for a live bus:
+# configured_path() ignores it and readers stop waiting for it.
+#
+# Usage:
+#
+#   python audiobus.py                       # capture from the default mic
+#   python audiobus.py --wav recording.wav   # replay a file, for testing
+#
+# and start the plugins with MMDAGENT_AUDIOBUS pointing at the same path.
+
+import errno
+import mmap
+import optparse
+import os
+import struct
+import threading
+import time
+import wave
+
+DEFAULT_PATH = '/dev/shm/mmdagent_audiobus'
+MAGIC = b'MMDABUS2'
+# magic, rate, channels, sample width, capacity, written, writer pid,
+# time of the last write
+HEADER = struct.Struct('<8sIIIQQId')
+HEADER_SIZE = 64
+WRITTEN_OFFSET = struct.calcsize('<8sIIIQ')
+WRITTEN = struct.Struct('<Q')
+HEARTBEAT_OFFSET = struct.calcsize('<8sIIIQQI')
+HEARTBEAT = struct.Struct('<d')
+# a writer that has not written for this many seconds is gone
+STALE_SECONDS = 2.0
+
+
+class AudioBusError(Exception):
+    pass
+
+
+def configured_path():
+    """
+    Bus file named by $MMDAGENT_AUDIOBUS if a capture daemon created it
+    and is still writing to it
+    """
+    return live_path(os.environ.get('MMDAGENT_AUDIOBUS', ''))
+
+
+def live_path(bus_path):
+    "`bus_path` if a capture daemon is still writing to it, else None"
+    if not bus_path or not os.path.exists(bus_path):
+        return None
+    try:
+        reader = AudioBusReader(bus_path)
+    except (AudioBusError, EnvironmentError, ValueError):
+        return None
+    try:
+        if reader.writer_alive():
+            return bus_path
+        return None
+    finally:
+        reader.close()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: alive but owned by someone else
+        return e.errno == errno.EPERM
+    return True
+
+
+class AudioBus(object):
+    """Writer side of the ring buffer, used by the capture daemon"""
+
+    def __init__(self, path=DEFAULT_PATH, rate=16000, channels=1,
+                 sample_width=2, seconds=10):
+        self.path = path
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.capacity = rate * channels * sample_width * seconds
+        size = HEADER_SIZE + self.capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._written = 0
+        HEADER.pack_into(self._map, 0, MAGIC, rate, channels, sample_width,
+                         self.capacity, 0, os.getpid(), time.time())
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, data):
+        """Append PCM bytes, overwriting the oldest audio when full"""
+        if len(data) > self.capacity:
+            data = data[-self.capacity:]
+        pos = self._written % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self._map[HEADER_SIZE + pos:HEADER_SIZE + pos + first] = data[:first]
+        if first < len(data):
+            rest = len(data) - first
+            self._map[HEADER_SIZE:HEADER_SIZE + rest] = data[first:]
+        # publish only after the bytes are in place
+        self._written += len(data)
+        WRITTEN.pack_into(self._map, WRITTEN_OFFSET, self._written)
+        HEARTBEAT.pack_into(self._map, HEARTBEAT_OFFSET, time.time())
+
+    def close(self, unlink=True):
+        self._map.close()
+        if unlink and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class AudioBusReader(object):
+    """
+    Reader side of the ring buffer.
+
+    :param path: bus file created by AudioBus.
+    :param offset: absolute stream offset to start at, None means the
+                   current end of the stream (only new audio is read).
+    :param float poll_interval: the shortest sleep of read() while waiting
+                                for the writer; it sleeps until the bytes
+                                it waits for are due.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, offset=None, poll_interval=0.01):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            self._map = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if size < HEADER_SIZE:
+            self._map.close()
+            raise AudioBusError('%s is not an audio bus' % path)
+        (magic, self.rate, self.channels, self.sample_width, self.capacity,
+         written, self.writer_pid, _) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self._map.close()
+            raise AudioBusError('%s is not an audio bus' % path)
+        self.frame_bytes = self.channels * self.sample_width
+        self.byte_rate = self.rate * self.frame_bytes
+        self.poll_interval = poll_interval
+        self.overruns = 0
+        self.position = written if offset is None else offset
+
+    @property
+    def written(self):
+        """Total number of bytes the capture daemon has written"""
+        return WRITTEN.unpack_from(self._map, WRITTEN_OFFSET)[0]
+
+    @property
+    def heartbeat(self):
+        """Time of the last write of the capture daemon"""
+        return HEARTBEAT.unpack_from(self._map, HEARTBEAT_OFFSET)[0]
+
+    def writer_alive(self):
+        """True while the capture daemon is running and writing"""
+        return (time.time() - self.heartbeat < STALE_SECONDS and
+                _pid_alive(self.writer_pid))
+
+    def available(self):
+        return self.written - self.position
+
+    def seek(self, offset):
+        """Move to an absolute stream offset, clamped to the buffered audio"""
+        written = self.written
+        offset -= offset % self.frame_bytes
+        self.position = max(written - self.capacity, min(offset, written), 0)
+
+    def ms_to_bytes(self, ms):
+        frames = int(self.rate * ms / 1000)
+        return frames * self.frame_bytes
+
+    def _copy(self, start, nbytes):
+        pos = start % self.capacity
+        first = min(nbytes, self.capacity - pos)
+        data = self._map[HEADER_SIZE + pos:HEADER_SIZE + pos + first]
+        if first < nbytes:
+            data += self._map[HEADER_SIZE:HEADER_SIZE + nbytes - first]
+        return data
+
+    def read_available(self, max_bytes=None):
+        """Return whatever audio is buffered without blocking"""
+        written = self.written
+        if written - self.position > self.capacity:
+            self.overruns += 1
+            self.position = written - self.capacity
+        nbytes = written - self.position
+        if max_bytes is not None:
+            nbytes = min(nbytes, max_bytes)
+        nbytes -= nbytes % self.frame_bytes
+        if nbytes <= 0:
+            return b''
+        data = self._copy(self.position, nbytes)
+        # the writer may have lapped us while we were copying
+        if self.written - self.capacity > self.position:
+            self.overruns += 1
+            self.position = self.written - self.capacity
+            return self.read_available(max_bytes)
+        self.position += nbytes
+        return data
+
+    def read(self, nbytes, timeout=None):
+        """
+        Block until `nbytes` are available and return them. When `timeout`
+        seconds pass first, or the writer is gone, whatever is available
+        is returned.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            missing = nbytes - self.available()
+            if missing <= 0:
+                break
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                break
+            if now - self.heartbeat >= STALE_SECONDS:
+                break
+            # sleep until the missing bytes are due rather than spinning
+            delay = max(self.poll_interval, float(missing) / self.byte_rate)
+            if deadline is not None:
+                delay = min(delay, deadline - now)
+            time.sleep(delay)
+        return self.read_available(nbytes)
+
+    def close(self):
+        self._map.close()
+
+
+class BusInputStream(object):
+    """
+    Blocking reader with the read()/stop_stream()/close() subset of a
+    PyAudio input stream, so recording code can use either. A read
+    returns short, possibly empty, when no audio came for `timeout`
+    seconds or the writer is gone.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, offset=None, timeout=1.0):
+        self.reader = AudioBusReader(path, offset)
+        self.timeout = timeout
+
+    def read(self, num_frames):
+        return self.reader.read(num_frames * self.reader.frame_bytes,
+                                self.timeout)
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        self.reader.close()
+
+
+class WaveFileSource(object):
+    """Feeds a wav file to a bus at real time, looping when `loop` is set"""
+
+    def __init__(self, fname, frames_per_buffer=1024, loop=True, realtime=True):
+        self.fname = fname
+        self.frames_per_buffer = frames_per_buffer
+        self.loop = loop
+        self.realtime = realtime
+        wf = wave.open(fname, 'rb')
+        self.rate = wf.getframerate()
+        self.channels = wf.getnchannels()
+        self.sample_width = wf.getsampwidth()
+        self._data = wf.readframes(wf.getnframes())
+        wf.close()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, bus):
+        step = self.frames_per_buffer * self.channels * self.sample_width
+        period = float(self.frames_per_buffer) / self.rate
+
+        def run():
+            t0 = time.time()
+            n = 0
+            while not self._stop.is_set():
+                for i in range(0, len(self._data), step):
+                    if self._stop.is_set():
+                        return
+                    n += 1
+                    if self.realtime:
+                        delay = t0 + n * period - time.time()
+                        if delay > 0:
+                            time.sleep(delay)
+                    bus.write(self._data[i:i + step])
+                if not self.loop:
+                    return
+
+        self._thread = threading.Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self):
+        while self._thread.is_alive():
+            self._thread.join(0.5)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+class PyAudioSource(object):
+    """Captures from a PortAudio input device into a bus"""
+
+    def __init__(self, rate=16000, channels=1, sample_width=2,
+                 frames_per_buffer=1024, device_index=None):
+        self.rate = rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.frames_per_buffer = frames_per_buffer
+        self.device_index = device_index
+        self._audio = None
+        self._stream = None
+
+    def start(self, bus):
+        import pyaudio
+
+        def audio_callback(in_data, frame_count, time_info, status):
+            bus.write(in_data)
+            return None, pyaudio.paContinue
+
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(
+            input=True,
+            format=self._audio.get_format_from_width(self.sample_width),
+            channels=self.channels,
+            rate=self.rate,
+            frames_per_buffer=self.frames_per_buffer,
+            input_device_index=self.device_index,
+            stream_callback=audio_callback)
+
+    def wait(self):
+        while self._stream.is_active():
+            time.sleep(0.5)
+
+    def stop(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        self._audio.terminate()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--path', default=os.environ.get('MMDAGENT_AUDIOBUS', DEFAULT_PATH))
+    parser.add_option('--seconds', type='int', default=10,
+                      help='length of the ring buffer')
+    parser.add_option('--rate', type='int', default=16000)
+    parser.add_option('--device', type='int', default=None,
+                      help='PortAudio input device index')
+    parser.add_option('--wav', default=None,
+                      help='replay a wav file instead of capturing')
+    parser.add_option('--no-loop', action='store_true')
+    options, args = parser.parse_args()
+
+    if options.wav:
+        source = WaveFileSource(options.wav, loop=not options.no_loop)
+    else:
+        source = PyAudioSource(rate=options.rate, device_index=options.device)
+    bus = AudioBus(options.path, source.rate, source.channels,
+                   source.sample_width, options.seconds)
+    source.start(bus)
+    try:
+        source.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.stop()
+        bus.close()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# avs_http.py --- pooled keep-alive HTTP session for AVS calls
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Every request to the Alexa Voice Service goes through one AVSSession so
+# TCP and TLS connections are reused between voice turns and playback
+# events. The session is shared by the recognizer, the audio player
+# threads and the token refresh, urllib3's pool does the locking; the
+# latency counters have their own lock.
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class EndpointStats(object):
+    """Latency counters of one endpoint, times are in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, elapsed, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += elapsed
+        self.last = elapsed
+        self.max = max(self.max, elapsed)
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+
+    def as_dict(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'avg_ms': int(1000 * self.total / self.count) if self.count else 0,
+                'min_ms': int(1000 * (self.min or 0)),
+                'max_ms': int(1000 * self.max),
+                'last_ms': int(1000 * self.last)}
+
+
+class AVSSession(object):
+    """
+    Thread-safe keep-alive session.
+
+    :param base_url: prefix of relative endpoint paths.
+    :param pool_size: connections kept open per host. When all are busy,
+                      e.g. held by a streamed response nobody finished,
+                      a request opens another one, closed after use,
+                      rather than waiting for one to come back.
+    :param float connect_timeout: seconds to establish a connection.
+    :param float read_timeout: seconds to wait for the next response byte.
+    """
+
+    def __init__(self, base_url, pool_size=4, connect_timeout=5,
+                 read_timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size,
+                              pool_block=False)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _url(self, endpoint):
+        if endpoint.startswith('http://') or endpoint.startswith('https://'):
+            return endpoint
+        return self.base_url + endpoint
+
+    def request(self, method, endpoint, **kwargs):
+        """
+        Send a request to `endpoint`, a path below base_url or an absolute
+        URL. The recorded latency is the time until the response headers
+        arrived, which includes the upload of streamed request bodies.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        url = self._url(endpoint)
+        key = url.split('?')[0]
+        start = time.time()
+        try:
+            r = self._session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(key, time.time() - start, True)
+            raise
+        self._record(key, time.time() - start, r.status_code >= 400)
+        return r
+
+    def post(self, endpoint, **kwargs):
+        return self.request('POST', endpoint, **kwargs)
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def _record(self, key, elapsed, error):
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats()
+            stats.add(elapsed, error)
+
+    def stats(self):
+        """Latency counters by endpoint URL"""
+        with self._lock:
+            return dict((key, s.as_dict()) for key, s in self._stats.items())
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+# avs_multipart.py --- multipart helpers for the Alexa Voice Service
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+import json
+import random
+
+RECOGNIZE_AUDIO_TYPE = 'audio/L16; rate=16000; channels=1'
+
+
+def new_boundary():
+    """Return a random multipart boundary string"""
+    return '----MMDAgentAlexa%016x' % random.getrandbits(64)
+
+
+def recognize_content_type(boundary):
+    """Content-Type header value of a recognize request using `boundary`"""
+    return 'multipart/form-data; boundary=%s' % boundary
+
+
+def _part_header(boundary, name, content_type):
+    return ('--%s\r\n'
+            'Content-Disposition: form-data; name="file"; filename="%s"\r\n'
+            'Content-Type: %s\r\n'
+            '\r\n' % (boundary, name, content_type)).encode('utf-8')
+
+
+def recognize_body(boundary, metadata, chunks):
+    """
+    Generate the body of a speechrecognizer request piece by piece.
+
+    The JSON `metadata` part is sent first, then each item of `chunks` is
+    yielded as soon as the iterable produces it, so the request can be
+    uploaded with chunked transfer encoding while audio is still being
+    captured. The closing boundary is yielded once `chunks` is exhausted.
+
+    :param str boundary: multipart boundary, see `new_boundary()`
+    :param dict metadata: the request part of the recognize call
+    :param chunks: iterable of raw L16 PCM byte strings
+    """
+    yield _part_header(boundary, 'request', 'application/json; charset=UTF-8')
+    yield json.dumps(metadata).encode('utf-8')
+    yield b'\r\n'
+    yield _part_header(boundary, 'audio', RECOGNIZE_AUDIO_TYPE)
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield ('\r\n--%s--\r\n' % boundary).encode('utf-8')
+
+
+def boundary_from_content_type(content_type):
+    """Return the boundary parameter of a multipart Content-Type header"""
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.lower() == 'boundary':
+            return value.strip('"')
+    raise ValueError('no boundary in %r' % content_type)
+
+
+class MultipartParser(object):
+    """
+    Incremental multipart parser for AVS responses.
+
+    Feed it the body in chunks of any size; feed() returns a list of
+    events as soon as they can be decided:
+
+      ('begin', headers)  a part starts, headers is a dict with lower case keys
+      ('data', bytes)     the next piece of the current part's body
+      ('end', None)       the current part is complete
+
+    Part bodies are never accumulated, only the tail that could still be
+    the start of a boundary is held back.
+    """
+
+    PREAMBLE, HEADERS, BODY, EPILOGUE = range(4)
+
+    def __init__(self, boundary):
+        if not isinstance(boundary, bytes):
+            boundary = boundary.encode('ascii')
+        self._first = b'--' + boundary
+        self._delimiter = b'\r\n--' + boundary
+        self._buf = bytearray()
+        self._state = self.PREAMBLE
+
+    @property
+    def done(self):
+        return self._state == self.EPILOGUE
+
+    def feed(self, data):
+        self._buf.extend(data)
+        events = []
+        while True:
+            if self._state == self.PREAMBLE:
+                i = self._buf.find(self._first)
+                if i < 0:
+                    # keep what could be the start of the first boundary
+                    del self._buf[:max(0, len(self._buf) - len(self._first))]
+                    break
+                j = self._buf.find(b'\r\n', i)
+                if j < 0:
+                    break
+                del self._buf[:j + 2]
+                self._state = self.HEADERS
+            elif self._state == self.HEADERS:
+                i = self._buf.find(b'\r\n\r\n')
+                if i < 0:
+                    if self._buf.startswith(b'\r\n'):
+                        i = -2  # a part without headers
+                    else:
+                        break
+                headers = {}
+                for line in bytes(self._buf[:max(i, 0)]).decode('latin-1').split('\r\n'):
+                    key, _, value = line.partition(':')
+                    if key:
+                        headers[key.strip().lower()] = value.strip()
+                del self._buf[:i + 4]
+                events.append(('begin', headers))
+                self._state = self.BODY
+            elif self._state == self.BODY:
+                i = self._buf.find(self._delimiter)
+                if i < 0:
+                    safe = len(self._buf) - len(self._delimiter) + 1
+                    if safe > 0:
+                        events.append(('data', bytes(self._buf[:safe])))
+                        del self._buf[:safe]
+                    break
+                if i > 0:
+                    events.append(('data', bytes(self._buf[:i])))
+                    del self._buf[:i]
+                # the buffer now starts with the delimiter, wait until it
+                # is known whether it closes the body or starts a new part
+                after = len(self._delimiter)
+                if len(self._buf) < after + 2:
+                    break
+                if self._buf[after:after + 2] == b'--':
+                    events.append(('end', None))
+                    self._state = self.EPILOGUE
+                    del self._buf[:]
+                    break
+                j = self._buf.find(b'\r\n', after)
+                if j < 0:
+                    break
+                events.append(('end', None))
+                del self._buf[:j + 2]
+                self._state = self.HEADERS
+            else:
+                del self._buf[:]
+                break
+        return events
+
+
+def iter_multipart(chunks, boundary):
+    """Generate MultipartParser events for the body given as `chunks`"""
+    parser = MultipartParser(boundary)
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            yield event
+        if parser.done:
+            break
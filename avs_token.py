@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+# avs_token.py --- in-process access token cache with background refresh
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# TokenManager keeps the Login with Amazon access token in memory and a
+# background thread refreshes it `margin` seconds before it expires, so a
+# voice turn never waits for api.amazon.com. Concurrent callers that do
+# find the token missing share a single refresh request. A memcached
+# client can be given as a shared tier: tokens refreshed by another
+# process are picked up from it, and fresh tokens are stored in it.
+#
+# The shared value is "token|expiry" under its own key; the bare token
+# is also stored under `legacy_key`, where older clients look for the
+# bearer token.
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenManager(object):
+    """
+    :param refresh: callable returning (access_token, expires_in_seconds),
+                    raising on failure.
+    :param memcache: optional memcache.Client used as a shared tier.
+    :param key: memcached key of the token and its expiry time.
+    :param legacy_key: memcached key of the bare token, None to not store it.
+    :param margin: seconds before expiry at which the token is refreshed.
+    :param retry: seconds between background retries after a failure,
+                  doubled up to `max_retry`.
+    """
+
+    def __init__(self, refresh, memcache=None, key='access_token_v2',
+                 margin=300, retry=5, max_retry=120, legacy_key='access_token'):
+        self._refresh = refresh
+        self._mc = memcache
+        self._key = key
+        self._legacy_key = legacy_key
+        self.margin = margin
+        self.retry = retry
+        self.max_retry = max_retry
+        self._token = None
+        self._expires = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._refreshing = False
+        self._error = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.refreshes = 0
+
+    def _valid(self, now=None):
+        now = time.time() if now is None else now
+        return self._token is not None and now < self._expires
+
+    def _due(self, now=None):
+        now = time.time() if now is None else now
+        return self._token is None or now >= self._expires - self.margin
+
+    # memcached is only talked to without the lock held, a slow server
+    # must not hold up callers that find the token in memory
+
+    def _from_shared(self):
+        """
+        Adopt a token another process put in memcached if it outlives
+        ours, returns whether one was adopted
+        """
+        if self._mc is None:
+            return False
+        try:
+            value = self._mc.get(self._key)
+        except Exception as e:
+            logger.info('memcached get failed: %s' % e)
+            return False
+        if not value or '|' not in value:
+            return False
+        token, expires = value.rsplit('|', 1)
+        with self._lock:
+            if float(expires) <= self._expires:
+                return False
+            self._token, self._expires = token, float(expires)
+            return True
+
+    def _to_shared(self, token, expires):
+        if self._mc is None:
+            return
+        ttl = int(expires - time.time())
+        try:
+            self._mc.set(self._key, '%s|%f' % (token, expires), ttl)
+            if self._legacy_key:
+                self._mc.set(self._legacy_key, token, ttl)
+        except Exception as e:
+            logger.info('memcached set failed: %s' % e)
+
+    def refresh(self):
+        """
+        Refresh now unless another thread already is, in which case wait
+        for its result. Returns the token or raises TokenError.
+        """
+        with self._cond:
+            if self._refreshing:
+                while self._refreshing:
+                    self._cond.wait()
+                if self._valid():
+                    return self._token
+                raise TokenError(self._error or 'token refresh failed')
+            self._refreshing = True
+        token = expires = None
+        error = None
+        try:
+            token, expires_in = self._refresh()
+            expires = time.time() + float(expires_in)
+        except Exception as e:
+            error = e
+            logger.warning('access token refresh failed: %s' % e)
+        with self._cond:
+            self._refreshing = False
+            if error is None:
+                self._token, self._expires = token, expires
+                self._error = None
+                self.refreshes += 1
+            else:
+                self._error = error
+            self._cond.notify_all()
+        self._wakeup.set()
+        if error is not None:
+            raise TokenError(error)
+        self._to_shared(token, expires)
+        return token
+
+    def get(self):
+        """Return a valid access token, refreshing only if there is none"""
+        with self._lock:
+            if self._valid():
+                if self._due():
+                    # let the background thread renew it, this one still works
+                    self._wakeup.set()
+                return self._token
+        if self._from_shared():
+            with self._lock:
+                if self._valid():
+                    return self._token
+        return self.refresh()
+
+    def start(self):
+        """Start the background refresh thread, which fetches a token right away"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _run(self):
+        delay = self.retry
+        while not self._stop.is_set():
+            with self._lock:
+                due = self._due()
+            if due and self._from_shared():
+                with self._lock:
+                    due = self._due()
+            with self._lock:
+                wait = max(0, self._expires - self.margin - time.time())
+            if due:
+                try:
+                    self.refresh()
+                    delay = self.retry
+                    continue
+                except TokenError:
+                    wait = delay
+                    delay = min(delay * 2, self.max_retry)
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
@@ -0,0 +1,98 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_audiobus.py --- several processes reading one audio bus
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Replays a wav file into an audiobus.AudioBus at real time and starts a
+# few reader processes that consume it at different paces. Every reader
+# checks that it got exactly the bytes that were written, and reports
+# how long opening the bus took and how far behind the writer it ran.
+#
+#   python bench/bench_audiobus.py --readers 3 --seconds 5
+
+import hashlib
+import multiprocessing
+import optparse
+import os
+import random
+import sys
+import tempfile
+import time
+import wave
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import audiobus
+
+RATE = 16000
+
+
+def noise_wav(fname, seconds):
+    rnd = random.Random(0)
+    wf = wave.open(fname, 'wb')
+    wf.setnchannels(1)
+    wf.setsampwidth(2)
+    wf.setframerate(RATE)
+    wf.writeframes(bytearray(rnd.getrandbits(8) for i in range(RATE * 2 * seconds)))
+    wf.close()
+
+
+def reader(path, nbytes, chunk_frames, results):
+    t0 = time.time()
+    r = audiobus.AudioBusReader(path, offset=0)
+    opened = time.time() - t0
+    h = hashlib.md5()
+    lag = 0
+    got = 0
+    while got < nbytes:
+        data = r.read(min(chunk_frames * r.frame_bytes, nbytes - got), timeout=2)
+        if not data:
+            break
+        lag = max(lag, r.available())
+        got += len(data)
+        h.update(data)
+    results.put((chunk_frames, opened, got, h.hexdigest(), lag, r.overruns))
+    r.close()
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--readers', type='int', default=3)
+    parser.add_option('--seconds', type='int', default=5)
+    options, args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    wav = os.path.join(tmpdir, 'noise.wav')
+    noise_wav(wav, options.seconds)
+    wf = wave.open(wav, 'rb')
+    expected = hashlib.md5(wf.readframes(wf.getnframes())).hexdigest()
+    nbytes = wf.getnframes() * 2
+    wf.close()
+
+    path = os.path.join(tmpdir, 'bus')
+    source = audiobus.WaveFileSource(wav, loop=False)
+    bus = audiobus.AudioBus(path, RATE, seconds=options.seconds + 1)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=reader,
+                                     args=(path, nbytes, 160 * (2 ** i), results))
+             for i in range(options.readers)]
+    for p in procs:
+        p.start()
+    source.start(bus)
+    source.wait()
+    for p in procs:
+        p.join()
+    bus.close()
+
+    print('%d s of audio through the bus, %d readers' % (options.seconds, options.readers))
+    print('%-12s %10s %10s %9s %8s' % ('chunk', 'open', 'max lag', 'overruns', 'intact'))
+    for i in range(options.readers):
+        chunk, opened, got, digest, lag, overruns = results.get()
+        print('%-12s %8.3fms %8.1fms %9d %8s' % (
+            '%d frames' % chunk, opened * 1000, lag * 1000.0 / (RATE * 2),
+            overruns, got == nbytes and digest == expected))
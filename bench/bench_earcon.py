@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_earcon.py --- wake-to-ding latency of the earcon engine
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Plays resources/ding.wav through earcon.EarconPlayer --plays times and
+# prints the distribution of the time from play() until the first ding
+# samples are handed to the output stream, plus the output latency
+# PortAudio reports for the device. With --simulate the output stream is
+# replaced by a clock driven stand-in so it runs without a sound card.
+# --decode also decodes the file on every play, the way the plugins used
+# to open it on every use. --keep-open keeps the stream open throughout,
+# otherwise it is opened for the first play and closed --linger seconds
+# after the last; --gap waits between plays, a gap longer than --linger
+# opens the stream for every play.
+#
+#   python bench/bench_earcon.py --simulate --plays 200
+#   python bench/bench_earcon.py --simulate --plays 20 --gap 1.5
+#   python bench/bench_earcon.py --device 2 --frames 64
+
+import optparse
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import earcon
+
+DING = os.path.join(TOP_DIR, 'resources/ding.wav')
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--plays', type='int', default=100)
+    parser.add_option('--frames', type='int', default=earcon.FRAMES_PER_BUFFER,
+                      help='frames per output buffer')
+    parser.add_option('--device', type='int', default=None)
+    parser.add_option('--simulate', action='store_true', default=False)
+    parser.add_option('--decode', action='store_true', default=False,
+                      help='decode the wav file again before every play')
+    parser.add_option('--keep-open', action='store_true', default=False)
+    parser.add_option('--linger', type='float', default=earcon.LINGER)
+    parser.add_option('--gap', type='float', default=0,
+                      help='seconds between plays')
+    options, args = parser.parse_args()
+
+    player = earcon.EarconPlayer((DING,), device_index=options.device,
+                                 frames_per_buffer=options.frames,
+                                 simulate=options.simulate,
+                                 keep_open=options.keep_open,
+                                 linger=options.linger)
+    decode = []
+    for n in range(options.plays):
+        if options.decode:
+            t0 = time.time()
+            player.load(DING)
+            decode.append(time.time() - t0)
+        player.play(DING).wait(5)
+        time.sleep(options.gap)
+    player.close()
+
+    report = player.latency_report()
+    print('buffer %d frames (%.1fms)' % (
+        options.frames, 1000.0 * options.frames / earcon.RATE))
+    print('%-8s %10s %10s %10s %10s' % ('plays', 'min', 'median', 'p95', 'max'))
+    print('%-8d %8.2fms %8.2fms %8.2fms %8.2fms' % (
+        report['count'], report['min_ms'], report['median_ms'],
+        report['p95_ms'], report['max_ms']))
+    if decode:
+        print('decode per play: avg %.2fms' % (1000 * sum(decode) / len(decode)))
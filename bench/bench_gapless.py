@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_gapless.py --- inter-track gap with and without getNextItem prefetch
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Plays a playlist served by the getNextItem route of the local fake AVS
+# server through audio_scheduler.AudioScheduler. Playback is simulated:
+# every item "plays" for --track-ms and the remaining time is taken from
+# the clock, so no audio device or VLC is needed. The fake server answers
+# getNextItem after --think-ms, and resolving a stream URL takes
+# --resolve-ms. Two modes:
+#
+#   end       getNextItem after the item ended plus the fixed 0.5 s
+#             sleep, the way alexa_getnextitem used to work
+#   prefetch  getNextItem --lead-ms before the item ends
+#
+# and the gap between the end of an item and the start of the next one
+# is printed.
+#
+#   python bench/bench_gapless.py --mode end --items 6
+#   python bench/bench_gapless.py --mode prefetch --lead-ms 2000 --items 6
+
+import json
+import optparse
+import os
+import sys
+import threading
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import audio_scheduler
+import avs_http
+import avs_multipart
+from fake_avs import FakeAVSServer
+
+GET_NEXT_ITEM = '/v1/avs/audioplayer/getNextItem'
+
+
+class SimulatedPlayer(object):
+    """Plays every item for a fixed time and records when it did"""
+
+    def __init__(self, track_ms, items):
+        self.track_ms = track_ms
+        self.items = items
+        self.scheduler = None
+        self.plays = []
+        self.started = None
+        self._stop = threading.Event()
+        self.finished = threading.Event()
+
+    def play(self, item, url):
+        self._stop.clear()
+        self.started = time.time()
+        self.scheduler.playing(item)
+        stopped = self._stop.wait(self.track_ms / 1000.0)
+        self.plays.append((item.stream_id, self.started, time.time()))
+        self.started = None
+        if len(self.plays) >= self.items:
+            self.finished.set()
+        return not stopped
+
+    def stop(self):
+        self._stop.set()
+
+    def remaining(self):
+        started = self.started
+        if started is None:
+            return None
+        return self.track_ms - 1000 * (time.time() - started)
+
+
+def fetch_next(session, player, sleep):
+    def on_idle(item):
+        if sleep:
+            time.sleep(sleep)
+        body = {"messageHeader": {},
+                "messageBody": {"navigationToken": item.nav_token}}
+        r = session.post(GET_NEXT_ITEM, data=json.dumps(body), stream=True,
+                         headers={'content-type': 'application/json; charset=UTF-8'})
+        if r.status_code != 200:
+            r.close()
+            return
+        boundary = avs_multipart.boundary_from_content_type(r.headers['content-type'])
+        data = []
+        for event, value in avs_multipart.iter_multipart(r.iter_content(4096), boundary):
+            if event == 'data':
+                data.append(value)
+        j = json.loads(b''.join(data).decode('utf-8'))['messageBody']
+        items = [audio_scheduler.AudioItem.from_stream(stream, j['navigationToken'])
+                 for stream in j['audioItem']['streams']]
+        player.scheduler.submit(items, audio_scheduler.ENQUEUE)
+    return on_idle
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--mode', choices=['end', 'prefetch'], default='prefetch')
+    parser.add_option('--items', type='int', default=5)
+    parser.add_option('--track-ms', type='int', default=3000)
+    parser.add_option('--lead-ms', type='int', default=2000)
+    parser.add_option('--think-ms', type='int', default=150,
+                      help='getNextItem response time of the fake server')
+    parser.add_option('--resolve-ms', type='int', default=100,
+                      help='time to resolve a stream URL')
+    options, args = parser.parse_args()
+
+    server = FakeAVSServer(think_ms=options.think_ms,
+                           playlist_length=options.items).start()
+    session = avs_http.AVSSession(server.url)
+    player = SimulatedPlayer(options.track_ms, options.items)
+
+    def resolve(url):
+        time.sleep(options.resolve_ms / 1000.0)
+        return url
+
+    lead = options.lead_ms if options.mode == 'prefetch' else 0
+    sleep = 0.5 if options.mode == 'end' else 0
+    scheduler = audio_scheduler.AudioScheduler(
+        player.play, player.stop, resolve, fetch_next(session, player, sleep),
+        remaining=player.remaining, lead_ms=lead)
+    player.scheduler = scheduler
+
+    first = audio_scheduler.AudioItem('%s/stream/0' % server.url, 'stream-0',
+                                      nav_token='item-0')
+    scheduler.submit([first], audio_scheduler.REPLACE_ALL)
+    player.finished.wait(options.items * (options.track_ms / 1000.0 + 5))
+
+    print('%-10s %10s' % ('item', 'gap'))
+    gaps = []
+    for previous, following in zip(player.plays, player.plays[1:]):
+        gap = 1000 * (following[1] - previous[2])
+        gaps.append(gap)
+        print('%-10s %8.1fms' % (following[0], gap))
+    if gaps:
+        print('%s lead %dms: avg gap %.1fms, max %.1fms over %d transitions' % (
+            options.mode, lead, sum(gaps) / len(gaps), max(gaps), len(gaps)))
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_hotword_latency.py --- replay harness for hotword detection latency
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Replays audio at real time into a bytering.ByteRing from a thread
+# that behaves like the PortAudio callback, --frames frames at a time,
+# and runs a detector on it two ways:
+#
+#   poll    the loop HotwordDetector had: get() whatever is buffered,
+#           sleep --sleep-ms when nothing is
+#   event   hotword_loop.DetectionLoop, woken by the callback, one
+#           FRAME_MS frame at a time
+#
+# The latency of a detection is the time from the callback delivering
+# the audio that completed the hotword to the detector reporting it. The
+# distribution is printed with how often the detector thread woke up.
+#
+# Without --model the audio is low noise with a --keyword-ms tone every
+# --interval seconds, and a stand-in detector fires once per tone when it
+# has heard --keyword-ms of it. With --model and --wav the real
+# SnowboyDetect runs on the file, looped, and the hotword is taken to
+# end with the audio it fired on.
+#
+#   python bench/bench_hotword_latency.py --seconds 20 --frames 2048
+#   python bench/bench_hotword_latency.py --wav alexa.wav --model snowboy.umdl
+
+import audioop
+import bisect
+import math
+import optparse
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import wave
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import bytering
+import hotword_loop
+
+RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+def synthetic_audio(seconds, interval, keyword_ms, seed=0):
+    "Noise with a loud tone somewhere in every `interval` seconds"
+    rnd = random.Random(seed)
+    samples = [int(rnd.gauss(0, 150)) for _ in range(int(seconds * RATE))]
+    tone = int(RATE * keyword_ms / 1000) * 2
+    step = int(RATE * interval)
+    for start in range(0, len(samples) - step, step):
+        at = start + rnd.randrange(step - tone)
+        for i in range(tone):
+            samples[at + i] = int(8000 * math.sin(2 * math.pi * 1000 * i / RATE))
+    return struct.pack('<%dh' % len(samples), *samples)
+
+
+def wav_audio(fname, seconds):
+    wf = wave.open(fname, 'rb')
+    assert wf.getframerate() == RATE and wf.getsampwidth() == SAMPLE_WIDTH
+    data = wf.readframes(wf.getnframes())
+    if wf.getnchannels() == 2:
+        data = audioop.tomono(data, SAMPLE_WIDTH, 0.5, 0.5)
+    wf.close()
+    need = int(seconds * RATE) * SAMPLE_WIDTH
+    return (data * (need // len(data) + 1))[:need]
+
+
+class ToneDetector(object):
+    """
+    Stand-in for SnowboyDetect: fires when `keyword_ms` of loud audio
+    have been heard, checking 10 ms at a time. `point` is the stream
+    offset where it fired.
+    """
+
+    def __init__(self, keyword_ms, threshold=2000):
+        self.step = RATE // 100 * SAMPLE_WIDTH
+        self.need = keyword_ms // 10
+        self.threshold = threshold
+        self.loud = 0
+        self.offset = 0
+        self.point = None
+        self._carry = b''
+
+    def Reset(self):
+        self.loud = 0
+        self._carry = b''
+
+    def RunDetection(self, data):
+        data = self._carry + data
+        ans = -2
+        end = len(data) - len(data) % self.step
+        for i in range(0, end, self.step):
+            if audioop.rms(data[i:i + self.step], SAMPLE_WIDTH) > self.threshold:
+                self.loud += 1
+                ans = max(ans, 0)
+                if self.loud == self.need:
+                    ans = 1
+                    self.point = self.offset + i + self.step
+            else:
+                self.loud = 0
+        # offset is where the carried over bytes start
+        self._carry = data[end:]
+        self.offset += end
+        return ans
+
+
+class Replay(object):
+    """Feeds audio into a ring at real time, recording when each byte came"""
+
+    def __init__(self, ring, audio, frames):
+        self.ring = ring
+        self.audio = audio
+        self.chunk = frames * SAMPLE_WIDTH
+        self.offsets = []
+        self.times = []
+        self.finished = threading.Event()
+
+    def start(self):
+        t = threading.Thread(target=self._run)
+        t.daemon = True
+        t.start()
+
+    def _run(self):
+        t0 = time.time()
+        for i, start in enumerate(range(0, len(self.audio), self.chunk)):
+            due = t0 + float(start + self.chunk) / (RATE * SAMPLE_WIDTH)
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            data = self.audio[start:start + self.chunk]
+            self.times.append(time.time())
+            self.offsets.append(start + len(data))
+            self.ring.extend(data)
+        self.finished.set()
+
+    def delivered(self, offset):
+        "When the byte before `offset` was handed over"
+        i = bisect.bisect_left(self.offsets, offset)
+        return self.times[min(i, len(self.times) - 1)]
+
+
+class Counting(object):
+    """ByteRing wrapper counting the reads that had to block"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.blocked = 0
+
+    def read(self, nbytes, timeout=None):
+        if self.ring.available() < nbytes:
+            self.blocked += 1
+        return self.ring.read(nbytes, timeout)
+
+    def wakeup(self):
+        self.ring.wakeup()
+
+
+def run_poll(ring, detect, replay, sleep_time):
+    wakeups = 0
+    while not replay.finished.is_set():
+        data = ring.get()
+        if len(data) == 0:
+            time.sleep(sleep_time)
+            wakeups += 1
+            continue
+        detect(data)
+    return wakeups
+
+
+def run_event(ring, detect, replay):
+    source = Counting(ring)
+    loop = hotword_loop.DetectionLoop(source, detect,
+                                      hotword_loop.frame_bytes(RATE))
+    watcher = threading.Thread(target=lambda: (replay.finished.wait(), loop.stop()))
+    watcher.daemon = True
+    watcher.start()
+    while not replay.finished.is_set():
+        loop.run()
+    return source.blocked
+
+
+def measure(mode, audio, make_detector, options):
+    ring = bytering.ByteRing(RATE * SAMPLE_WIDTH * 5)
+    replay = Replay(ring, audio, options.frames)
+    detector = make_detector()
+    latencies = []
+    consumed = [0]
+
+    def detect(data):
+        ans = detector.RunDetection(data)
+        consumed[0] += len(data)
+        if ans > 0:
+            point = getattr(detector, 'point', None) or consumed[0]
+            latencies.append(time.time() - replay.delivered(point))
+        return ans
+
+    replay.start()
+    if mode == 'poll':
+        wakeups = run_poll(ring, detect, replay, options.sleep_ms / 1000.0)
+    else:
+        wakeups = run_event(ring, detect, replay)
+    return latencies, wakeups
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--seconds', type='float', default=15)
+    parser.add_option('--frames', type='int', default=2048,
+                      help='frames per callback buffer')
+    parser.add_option('--sleep-ms', type='float', default=30,
+                      help='sleep of the polling loop')
+    parser.add_option('--interval', type='float', default=1.0)
+    parser.add_option('--keyword-ms', type='int', default=300)
+    parser.add_option('--wav')
+    parser.add_option('--model')
+    parser.add_option('--resource', default=os.path.join(TOP_DIR, 'resources/common.res'))
+    options, args = parser.parse_args()
+
+    if options.model:
+        import snowboydetect
+        audio = wav_audio(options.wav, options.seconds)
+
+        def make_detector():
+            return snowboydetect.SnowboyDetect(resource_filename=options.resource,
+                                               model_str=options.model)
+    else:
+        audio = synthetic_audio(options.seconds, options.interval, options.keyword_ms)
+
+        def make_detector():
+            return ToneDetector(options.keyword_ms)
+
+    print('%-6s %6s %9s %9s %9s %9s %9s %11s' % (
+        'mode', 'count', 'min', 'median', 'p90', 'p99', 'max', 'wakeups/s'))
+    for mode in ('poll', 'event'):
+        latencies, wakeups = measure(mode, audio, make_detector, options)
+        if not latencies:
+            print('%-6s %6d' % (mode, 0))
+            continue
+        print('%-6s %6d %7.1fms %7.1fms %7.1fms %7.1fms %7.1fms %11.1f' % (
+            mode, len(latencies), 1000 * min(latencies),
+            1000 * percentile(latencies, 0.5), 1000 * percentile(latencies, 0.9),
+            1000 * percentile(latencies, 0.99), 1000 * max(latencies),
+            wakeups / options.seconds))
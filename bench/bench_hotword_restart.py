@@ -0,0 +1,90 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_hotword_restart.py --- time from SNOWBOY_START to listening
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# How long mmdagent_snowboy.py takes to be armed again after a
+# detection, --runs times each way:
+#
+#   rebuild   what SNOWBOY_START did before: a new HotwordDetector,
+#             loading the model and opening PyAudio and the stream, then
+#             terminate() once it heard audio
+#   resume    pause() and resume() of one HotwordDetector, which keeps
+#             the model and PyAudio loaded but, without --audio-bus,
+#             reopens the stream so mmdagent_alexa.py can record meanwhile
+#
+# Armed is when the first audio after SNOWBOY_START reached the ring
+# buffer, or right away with --audio-bus, whose capture never stops.
+# Needs the device: snowboydetect, PyAudio and a microphone. Python 2,
+# like the plugin.
+#
+#   python bench/bench_hotword_restart.py --runs 20 --model snowboy.umdl
+
+import optparse
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import mmdagent_snowboy
+
+# seconds to wait for the first audio
+AUDIO_TIMEOUT = 2.0
+
+
+def armed(detector):
+    if detector.bus_reader:
+        return True
+    return detector.ring_buffer.wait(1, AUDIO_TIMEOUT)
+
+
+def run_rebuild(options):
+    times = []
+    for _ in range(options.runs):
+        t0 = time.time()
+        detector = mmdagent_snowboy.HotwordDetector(options.model, sensitivity=0.5,
+                                                    audio_bus=options.audio_bus)
+        if armed(detector):
+            times.append(time.time() - t0)
+        detector.terminate()
+    return times
+
+
+def run_resume(options):
+    times = []
+    detector = mmdagent_snowboy.HotwordDetector(options.model, sensitivity=0.5,
+                                                audio_bus=options.audio_bus)
+    try:
+        for _ in range(options.runs):
+            detector.pause()
+            t0 = time.time()
+            detector.resume()
+            if armed(detector):
+                times.append(time.time() - t0)
+    finally:
+        detector.terminate()
+    return times
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=20)
+    parser.add_option('--model', default=os.path.join(TOP_DIR, 'snowboy.umdl'))
+    parser.add_option('--audio-bus')
+    options, args = parser.parse_args()
+
+    print('%-8s %5s %9s %9s %9s' % ('mode', 'runs', 'min', 'median', 'max'))
+    for name, run in (('rebuild', run_rebuild), ('resume', run_resume)):
+        times = sorted(run(options))
+        if not times:
+            print('%-8s %5d' % (name, 0))
+            continue
+        print('%-8s %5d %7.1fms %7.1fms %7.1fms' % (
+            name, len(times), 1000 * times[0], 1000 * times[len(times) // 2],
+            1000 * times[-1]))
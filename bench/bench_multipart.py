@@ -0,0 +1,121 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_multipart.py --- email vs incremental parsing of AVS responses
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Downloads large synthetic recognize responses from the local fake AVS
+# server and parses them two ways:
+#
+#   email   wait for r.content and run email.message_from_string, the
+#           way process_response used to
+#   stream  avs_multipart.iter_multipart over r.iter_content, the way
+#           process_response does now
+#
+# For each it reports when the JSON directives were available, when the
+# first byte of the speak audio could be handed to the player, the total
+# time and the CPU spent parsing.
+#
+#   python bench/bench_multipart.py --audio-kb 512 --extra-parts 3 --downlink-kbps 4000
+
+import email
+import json
+import optparse
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import requests
+
+import avs_multipart
+from fake_avs import FakeAVSServer
+
+RECOGNIZE = '/v1/avs/speechrecognizer/recognize'
+CHUNK_SIZE = 4096
+
+
+def run_email(url):
+    t0 = time.time()
+    r = requests.post(url + RECOGNIZE, data=b'', stream=True)
+    data = "Content-Type: " + r.headers['content-type'] + '\r\n\r\n' + r.content
+    c0 = time.clock()
+    msg = email.message_from_string(data)
+    for payload in msg.get_payload():
+        if payload.get_content_type() == "application/json":
+            json.loads(payload.get_payload())
+            t_json = time.time()
+        elif payload.get_content_type() == "audio/mpeg":
+            payload.get_payload()
+    cpu = time.clock() - c0
+    t_audio = time.time()
+    return t_json - t0, t_audio - t0, time.time() - t0, cpu
+
+
+def run_stream(url):
+    t0 = time.time()
+    r = requests.post(url + RECOGNIZE, data=b'', stream=True)
+    boundary = avs_multipart.boundary_from_content_type(r.headers['content-type'])
+    t_json = t_audio = None
+    part_type = None
+    part_data = []
+    cpu = 0.0
+    chunks = r.iter_content(CHUNK_SIZE)
+    parser = avs_multipart.MultipartParser(boundary)
+    for chunk in chunks:
+        c0 = time.clock()
+        for event, value in parser.feed(chunk):
+            if event == 'begin':
+                part_type = value.get('content-type', '').split(';')[0]
+                part_data = []
+            elif event == 'data':
+                if part_type == 'audio/mpeg':
+                    if t_audio is None:
+                        t_audio = time.time()
+                else:
+                    part_data.append(value)
+            elif event == 'end' and part_type == 'application/json':
+                json.loads(b''.join(part_data).decode('utf-8'))
+                t_json = time.time()
+        cpu += time.clock() - c0
+    return t_json - t0, t_audio - t0, time.time() - t0, cpu
+
+
+def report(name, samples):
+    cols = zip(*samples)
+    print('%-7s %9.1fms %9.1fms %9.1fms %9.1fms' % tuple(
+        [name] + [sorted(c)[len(c) // 2] * 1000 for c in cols]))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--runs', type='int', default=5)
+    parser.add_option('--audio-kb', type='int', default=256,
+                      help='size of every audio part')
+    parser.add_option('--extra-parts', type='int', default=3,
+                      help='audio parts after the speak audio')
+    parser.add_option('--downlink-kbps', type='int', default=0,
+                      help='simulated download bandwidth, 0 for unlimited')
+    options, args = parser.parse_args()
+
+    server = FakeAVSServer(think_ms=0, audio_bytes=options.audio_kb * 1024,
+                           extra_parts=options.extra_parts,
+                           downlink_bps=options.downlink_kbps * 125).start()
+    results = {'email': [], 'stream': []}
+    for i in range(options.runs):
+        results['email'].append(run_email(server.url))
+        results['stream'].append(run_stream(server.url))
+    server.shutdown()
+
+    print('%d KB speak audio + %d extra parts, downlink %s kbps, median of %d'
+          % (options.audio_kb, options.extra_parts,
+             options.downlink_kbps or 'unlimited', options.runs))
+    print('%-7s %11s %11s %11s %11s' % ('parser', 'json', 'first audio',
+                                        'total', 'parse cpu'))
+    report('email', results['email'])
+    report('stream', results['stream'])
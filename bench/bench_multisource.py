@@ -0,0 +1,113 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_multisource.py --- hotword arbitration across several wav sources
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Writes one wav file per simulated microphone: --keywords tones, each
+# heard by every microphone, loudest on a different one every time and a
+# few ms later on the others. hotword_pool.DetectorPool replays them at
+# real time, one worker process per file with the tone stand-in detector
+# of bench_hotword_latency.py, and the winning detection of every tone
+# is printed: the source expected to win, the one that did, how many
+# sources detected it and how long after the first detection the
+# decision came.
+#
+#   python bench/bench_multisource.py --sources 3 --keywords 6 --window-ms 300
+
+import math
+import optparse
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import hotword_pool
+from bench_hotword_latency import ToneDetector
+
+RATE = hotword_pool.RATE
+KEYWORD_MS = 300
+
+
+class ToneFactory(object):
+
+    def __call__(self):
+        return ToneDetector(KEYWORD_MS)
+
+
+def write_sources(directory, sources, keywords, interval, seed=0):
+    """
+    Write the wav files, return their paths and per keyword the source
+    that hears it loudest
+    """
+    rnd = random.Random(seed)
+    length = int((keywords + 1) * interval * RATE)
+    tone = int(RATE * KEYWORD_MS / 1000) * 2
+    tracks = [[int(rnd.gauss(0, 150)) for _ in range(length)] for _ in range(sources)]
+    loudest = []
+    for k in range(keywords):
+        at = int((k + 0.5) * interval * RATE)
+        winner = k % sources
+        loudest.append(str(winner))
+        for s, samples in enumerate(tracks):
+            amplitude = 8000 if s == winner else rnd.randrange(3500, 6000)
+            delay = 0 if s == winner else rnd.randrange(RATE // 100, RATE // 20)
+            for i in range(tone):
+                samples[at + delay + i] = int(amplitude *
+                                              math.sin(2 * math.pi * 1000 * i / RATE))
+    paths = []
+    for s, samples in enumerate(tracks):
+        path = os.path.join(directory, 'mic%d.wav' % s)
+        wf = wave.open(path, 'wb')
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(struct.pack('<%dh' % len(samples), *samples))
+        wf.close()
+        paths.append(path)
+    return paths, loudest
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--sources', type='int', default=3)
+    parser.add_option('--keywords', type='int', default=6)
+    parser.add_option('--interval', type='float', default=1.5)
+    parser.add_option('--window-ms', type='int', default=300)
+    options, args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        paths, loudest = write_sources(tmp, options.sources, options.keywords,
+                                       options.interval)
+        pool = hotword_pool.DetectorPool(['wav:%s' % p for p in paths], ToneFactory(),
+                                         options.window_ms)
+        start_at = time.time() + 0.5
+        pool.start(start_at)
+        print('%-8s %9s %7s %9s %10s' % ('keyword', 'expected', 'winner',
+                                         'detected', 'decision'))
+        correct = 0
+        events = 0
+        for detection in pool.detections():
+            candidates = pool.arbiter.candidates
+            decision = time.time() - min(c.time for c in candidates)
+            expected = loudest[events] if events < len(loudest) else '-'
+            correct += detection.source == expected
+            print('%-8d %9s %7s %9d %8.1fms' % (events, expected, detection.source,
+                                                len(candidates), 1000 * decision))
+            events += 1
+        pool.stop()
+        print('%d of %d keywords won by the loudest source, %d events, %d echoes dropped' % (
+            correct, len(loudest), events, pool.arbiter.dropped))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_playlists.py --- playlist parser throughput and peak memory
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Builds large and malformed m3u, pls and asx playlists in memory and
+# runs every one through two parsers:
+#
+#   legacy   the parsers tunein.py had before they were made incremental:
+#            the whole body, RawConfigParser for pls and old asx, every
+#            element of new asx kept until the end
+#   stream   tunein's path: tunein.read_playlist on a PlaylistBody,
+#            which pulls the body chunk by chunk while parsing, up to
+#            PLAYLIST_MAX_BYTES, and stops after PLAYLIST_MAX_ENTRIES
+#            entries
+#   full     the same without the entry limit, which measures the
+#            incremental parsers over every byte they are allowed
+#
+# `read` is how much of the body was pulled from the response. Each run
+# is timed in this process and repeated in a new interpreter,
+# which reports the growth of its peak resident set (VmHWM, reset through
+# /proc/self/clear_refs) while decoding and parsing. Throughput is the
+# bytes read over the time taken. Linux only.
+#
+#   python bench/bench_playlists.py --entries 50000
+#   python bench/bench_playlists.py --only pls-large,asx-truncated
+
+import gc
+import optparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+import ConfigParser as configparser
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import tunein
+
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO as StringIO
+
+
+# The parsers as they were, copied from tunein.py
+
+def legacy_parse_m3u(data):
+    for line in data.readlines():
+        if not line.startswith('#') and line.strip():
+            yield line.strip()
+
+
+def legacy_parse_pls(data):
+    try:
+        cp = configparser.RawConfigParser()
+        cp.readfp(data)
+    except configparser.Error:
+        return
+
+    for section in cp.sections():
+        if section.lower() != 'playlist':
+            continue
+        for i in xrange(cp.getint(section, 'numberofentries')):
+            try:
+                if cp.has_option(section, 'length%d' % (i+1)):
+                    if cp.get(section, 'length%d' % (i+1)) == '-1':
+                        yield cp.get(section, 'file%d' % (i+1))
+                else:
+                    yield cp.get(section, 'file%d' % (i+1))
+            except configparser.NoOptionError:
+                return
+
+
+def legacy_parse_old_asx(data):
+    try:
+        cp = configparser.RawConfigParser()
+        cp.readfp(data)
+    except configparser.Error:
+        return
+    for section in cp.sections():
+        if section.lower() != 'reference':
+            continue
+        for option in cp.options(section):
+            if option.lower().startswith('ref'):
+                uri = cp.get(section, option).lower()
+                yield tunein.fix_asf_uri(uri)
+
+
+def legacy_parse_new_asx(data):
+    try:
+        for event, element in tunein.elementtree.iterparse(data):
+            element.tag = element.tag.lower()
+    except tunein.elementtree.ParseError:
+        return
+
+    for ref in element.findall('entry/ref[@href]'):
+        yield tunein.fix_asf_uri(ref.get('href', '').strip())
+
+    for entry in element.findall('entry[@href]'):
+        yield tunein.fix_asf_uri(entry.get('href', '').strip())
+
+
+def legacy_parse_asx(data):
+    if 'asx' in data.getvalue()[0:50].lower():
+        return legacy_parse_new_asx(data)
+    else:
+        return legacy_parse_old_asx(data)
+
+
+LEGACY = {'m3u': legacy_parse_m3u, 'pls': legacy_parse_pls,
+          'asx': legacy_parse_asx}
+STREAM = {'m3u': tunein.parse_m3u, 'pls': tunein.parse_pls,
+          'asx': tunein.parse_asx}
+
+
+# Fixtures, (name, format, body)
+
+def stream_url(i):
+    return 'http://stream%d.example.com:8000/live/%06d.mp3' % (i % 7, i)
+
+
+def make_fixtures(entries):
+    m3u = '#EXTM3U\n' + ''.join('#EXTINF:-1,Station %d\n%s\n' % (i, stream_url(i))
+                                for i in range(entries))
+    pls = ('[playlist]\nNumberOfEntries=%d\n' % entries +
+           ''.join('File%d=%s\nTitle%d=Station %d\nLength%d=-1\n' %
+                   (i + 1, stream_url(i), i + 1, i, i + 1) for i in range(entries)) +
+           'Version=2\n')
+    new_asx = ('<asx version="3.0">\n<title>big</title>\n' +
+               ''.join('<entry><title>Station %d</title><ref href="%s"/></entry>\n' %
+                       (i, stream_url(i)) for i in range(entries)) + '</asx>\n')
+    old_asx = '[Reference]\n' + ''.join('Ref%d=%s\n' % (i + 1, stream_url(i))
+                                        for i in range(entries))
+    garbage = ''.join(chr(32 + (i * 7919) % 95) for i in range(entries * 40))
+    return [
+        ('m3u-large', 'm3u', m3u),
+        ('pls-large', 'pls', pls),
+        ('asx-large', 'asx', new_asx),
+        ('oldasx-large', 'asx', old_asx),
+        # the same, cut off in the middle of an entry
+        ('m3u-truncated', 'm3u', m3u[:len(m3u) // 2 + 17]),
+        ('pls-truncated', 'pls', pls[:len(pls) // 2 + 17]),
+        ('asx-truncated', 'asx', new_asx[:len(new_asx) // 2 + 17]),
+        # NumberOfEntries missing, the legacy parser gives up
+        ('pls-no-count', 'pls', re.sub(r'NumberOfEntries=\d+\n', '', pls)),
+        # an entry is not well formed XML halfway through
+        ('asx-broken', 'asx', new_asx.replace('</entry>', '</entri>', 1000)
+         .replace('</entri>', '</entry>', 999)),
+        # one line as big as the whole playlist ahead of the entries
+        ('m3u-long-line', 'm3u', '#' + 'x' * len(m3u) + '\n' + m3u[:4096]),
+        ('pls-garbage', 'pls', garbage),
+        ('m3u-garbage', 'm3u', garbage),
+    ]
+
+
+class FakeResponse(object):
+    """The iter_content() of a streamed response, counting what was read"""
+
+    def __init__(self, body):
+        self.body = body
+        self.read = 0
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            chunk = self.body[i:i + chunk_size]
+            self.read += len(chunk)
+            yield chunk
+
+
+# bytes of the body the last run read
+last_read = [0]
+
+
+def run_legacy(fmt, body):
+    last_read[0] = len(body)
+    playlist = body.decode('utf-8', 'ignore')
+    return list(LEGACY[fmt](StringIO.StringIO(playlist)))
+
+
+def run_stream(fmt, body, max_entries=tunein.PLAYLIST_MAX_ENTRIES):
+    response = FakeResponse(body)
+    try:
+        return tunein.read_playlist(tunein.PlaylistBody(response), STREAM[fmt],
+                                    max_entries=max_entries)
+    finally:
+        last_read[0] = response.read
+
+
+def run_full(fmt, body):
+    return run_stream(fmt, body, max_entries=None)
+
+
+RUNS = (('legacy', run_legacy), ('stream', run_stream), ('full', run_full))
+
+
+def vm_hwm():
+    "Peak resident set of this process in kB"
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def peak_kb(run, fmt, body):
+    "Growth of the peak resident set while `run` parses `body`, in kB"
+    gc.collect()
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+    before = vm_hwm()
+    try:
+        run(fmt, body)
+    except Exception:
+        pass
+    return vm_hwm() - before
+
+
+def child_peak_kb(name, label, entries):
+    "peak_kb measured in a new interpreter, whose heap has no free pages yet"
+    return int(subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--entries', str(entries),
+         '--child', '%s:%s' % (name, label)]))
+
+
+def timed(run, fmt, body, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.time()
+        try:
+            result = run(fmt, body)
+        except Exception as e:
+            result = e
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--entries', type='int', default=50000,
+                      help='entries of the large playlists')
+    parser.add_option('--repeat', type='int', default=3)
+    parser.add_option('--only', default='',
+                      help='comma separated fixture names')
+    parser.add_option('--child', help=optparse.SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.child:
+        name, label = options.child.split(':')
+        fmt, body = [(f, b.encode('utf-8')) for n, f, b in make_fixtures(options.entries)
+                     if n == name][0]
+        print(peak_kb(dict(RUNS)[label], fmt, body))
+        sys.exit(0)
+
+    only = set(filter(None, options.only.split(',')))
+    print('%-14s %8s %-7s %8s %8s %10s %10s %10s' % (
+        'fixture', 'size', 'parser', 'read', 'entries', 'time', 'MB/s', 'peak'))
+    for name, fmt, body in make_fixtures(options.entries):
+        if only and name not in only:
+            continue
+        body = body.encode('utf-8')
+        for label, run in RUNS:
+            elapsed, result = timed(run, fmt, body, options.repeat)
+            if isinstance(result, Exception):
+                entries = type(result).__name__
+            else:
+                entries = str(len(result))
+            print('%-14s %7dk %-7s %7dk %8s %8.1fms %10.1f %9dk' % (
+                name, len(body) // 1024, label, last_read[0] // 1024, entries, 1000 * elapsed,
+                last_read[0] / (1024.0 * 1024) / max(elapsed, 1e-6),
+                child_peak_kb(name, label, options.entries)))
@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_recognize.py --- time-to-first-byte of file vs streaming recognize
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Replays recording.wav at real time, as if it came from the microphone,
+# and sends it to a local fake AVS recognize endpoint twice:
+#
+#   file    record everything, write a wav file, reopen it and POST it
+#           (what Alexa.record_to_wave + alexa_speech_recognizer do)
+#   stream  upload every chunk as soon as it is read
+#           (what Alexa.alexa_speech_recognizer_stream does)
+#
+# and reports the time from the end of speech (last chunk captured) to
+# the first byte of the response.
+#
+#   python bench/bench_recognize.py --uplink-kbps 256 --runs 5
+
+import json
+import optparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import requests
+
+import avs_multipart
+from fake_avs import FakeAVSServer
+
+CHUNK_SIZE = 1024
+RECOGNIZE = '/v1/avs/speechrecognizer/recognize'
+METADATA = {"messageHeader": {},
+            "messageBody": {"profile": "alexa-close-talk",
+                            "locale": "en-us",
+                            "format": avs_multipart.RECOGNIZE_AUDIO_TYPE}}
+
+
+class Replay(object):
+    """Hands out the frames of a wav file at the pace of a live microphone"""
+
+    def __init__(self, fname, realtime=True):
+        wf = wave.open(fname, 'rb')
+        self.rate = wf.getframerate()
+        self.width = wf.getsampwidth()
+        self.data = wf.readframes(wf.getnframes())
+        wf.close()
+        self.realtime = realtime
+        self.end_of_speech = None
+
+    def chunks(self):
+        step = CHUNK_SIZE * self.width
+        period = float(CHUNK_SIZE) / self.rate
+        t0 = time.time()
+        for n, i in enumerate(range(0, len(self.data), step)):
+            if self.realtime:
+                delay = t0 + (n + 1) * period - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield self.data[i:i + step]
+        self.end_of_speech = time.time()
+
+
+def run_file(url, replay, tmpdir):
+    data = b''.join(replay.chunks())
+    fname = os.path.join(tmpdir, 'recording.wav')
+    wf = wave.open(fname, 'wb')
+    wf.setnchannels(1)
+    wf.setsampwidth(replay.width)
+    wf.setframerate(replay.rate)
+    wf.writeframes(data)
+    wf.close()
+    with open(fname, 'rb') as inf:
+        files = [
+            ('file', ('request', json.dumps(METADATA), 'application/json; charset=UTF-8')),
+            ('file', ('audio', inf, avs_multipart.RECOGNIZE_AUDIO_TYPE))
+        ]
+        r = requests.post(url + RECOGNIZE, files=files, stream=True)
+    first_byte = time.time()
+    r.content
+    return first_byte - replay.end_of_speech
+
+
+def run_stream(url, replay):
+    boundary = avs_multipart.new_boundary()
+    headers = {'Content-Type': avs_multipart.recognize_content_type(boundary)}
+    body = avs_multipart.recognize_body(boundary, METADATA, replay.chunks())
+    r = requests.post(url + RECOGNIZE, headers=headers, data=body, stream=True)
+    first_byte = time.time()
+    r.content
+    return first_byte - replay.end_of_speech
+
+
+def report(name, samples):
+    samples = sorted(samples)
+    print('%-6s runs=%d min=%.1fms median=%.1fms max=%.1fms' % (
+        name, len(samples), samples[0] * 1000,
+        samples[len(samples) // 2] * 1000, samples[-1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--wav', default=os.path.join(TOP_DIR, 'recording.wav'))
+    parser.add_option('--runs', type='int', default=3)
+    parser.add_option('--uplink-kbps', type='int', default=256,
+                      help='simulated upload bandwidth, 0 for unlimited')
+    parser.add_option('--think-ms', type='int', default=50)
+    parser.add_option('--fast', action='store_true',
+                      help='do not pace the replay at real time')
+    options, args = parser.parse_args()
+
+    server = FakeAVSServer(uplink_bps=options.uplink_kbps * 125,
+                           think_ms=options.think_ms).start()
+    tmpdir = tempfile.mkdtemp()
+    results = {'file': [], 'stream': []}
+    for i in range(options.runs):
+        results['file'].append(
+            run_file(server.url, Replay(options.wav, not options.fast), tmpdir))
+        results['stream'].append(
+            run_stream(server.url, Replay(options.wav, not options.fast)))
+    server.shutdown()
+    print('end of speech -> first response byte, uplink %s kbps, think %d ms'
+          % (options.uplink_kbps or 'unlimited', options.think_ms))
+    report('file', results['file'])
+    report('stream', results['stream'])
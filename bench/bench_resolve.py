@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_resolve.py --- time to audio of TuneIn URLs, first line vs resolver
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Resolves the Tune.ashx URL of --stations stations of the local fake
+# OPML server, whose playlists are nested --nesting levels deep and list
+# --mirrors mirrors of every stream, slowest first. Two ways:
+#
+#   first     fetch the URL, take its first line and parse one level of
+#             playlist, the way Alexa.tuneinplaylist used to, then keep
+#             taking the first entry of nested playlists as a player
+#             would
+#   resolve   TuneIn.resolve_streams: nested levels in parallel, mirrors
+#             probed in parallel and ranked by time to first byte
+#
+# Time to audio is the resolution time plus the time to the first byte of
+# the chosen stream. Each station is resolved once with a cold cache.
+#
+#   python bench/bench_resolve.py --nesting 1 --mirrors 3 --mirror-delay-ms 300
+
+import optparse
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import requests
+
+import tunein
+from fake_opml import FakeOPMLServer
+
+
+def first_line(client, url):
+    lines = requests.get(url).content.split(b'\n')
+    nurl = client.parse_stream_url(lines[0].decode('utf-8'))
+    while nurl and client.parse_stream_url(nurl[0]) != nurl[:1]:
+        nurl = client.parse_stream_url(nurl[0])
+    return nurl[0] if nurl else ''
+
+
+def resolve(client, url):
+    nurl = client.resolve_streams(url)
+    return nurl[0] if nurl else ''
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--stations', type='int', default=6)
+    parser.add_option('--latency-ms', type='int', default=50)
+    parser.add_option('--nesting', type='int', default=1)
+    parser.add_option('--mirrors', type='int', default=3)
+    parser.add_option('--mirror-delay-ms', type='int', default=300)
+    options, args = parser.parse_args()
+
+    server = FakeOPMLServer(stations=max(options.stations, 10),
+                            latency_ms=options.latency_ms,
+                            nesting=options.nesting, mirrors=options.mirrors,
+                            mirror_delay_ms=options.mirror_delay_ms).start()
+    print('%-8s %12s %12s %14s' % ('mode', 'resolve', 'first byte', 'time to audio'))
+    for mode, func in (('first', first_line), ('resolve', resolve)):
+        totals = [0.0, 0.0]
+        for n in range(options.stations):
+            client = tunein.TuneIn(5000, cache=tunein.make_cache(),
+                                   base_uri=server.base_uri)
+            t0 = time.time()
+            stream = func(client, '%s/Tune.ashx?id=s%d' % (server.url, n))
+            totals[0] += time.time() - t0
+            totals[1] += client.probe_stream(stream) or 0
+            client._session.close()
+        resolve_ms, first_ms = [1000 * t / options.stations for t in totals]
+        print('%-8s %10.1fms %10.1fms %12.1fms' % (mode, resolve_ms, first_ms,
+                                                   resolve_ms + first_ms))
+    server.shutdown()
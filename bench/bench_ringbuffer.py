@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_ringbuffer.py --- CPU per second of audio of the hotword ring buffer
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Feeds --seconds of 16 kHz 16-bit PCM through the capture path of
+# HotwordDetector, as fast as it goes in one thread: a PortAudio style
+# callback of --frames frames, and the detector loop reading the buffer
+# every --poll-ms. Two buffers:
+#
+#   deque   the collections.deque RingBuffer mmdagent_snowboy.py had,
+#           with the callback also building chr(0) * len(in_data) of
+#           output for the duplex stream
+#   ring    bytering.ByteRing, callback returning no output
+#
+# and the CPU time (user + system) spent per second of audio. Python 2,
+# like the plugin.
+#
+#   python bench/bench_ringbuffer.py --seconds 600 --frames 2048
+
+import collections
+import optparse
+import os
+import random
+import resource
+import sys
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import bytering
+
+RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+class DequeRingBuffer(object):
+    """The ring buffer as it was, copied from mmdagent_snowboy.py"""
+
+    def __init__(self, size=4096, preroll=0):
+        self._buf = collections.deque(maxlen=size)
+        self._preroll = collections.deque(maxlen=preroll)
+
+    def extend(self, data):
+        self._buf.extend(data)
+
+    def get(self):
+        tmp = ''.join(self._buf)
+        self._buf.clear()
+        self._preroll.extend(tmp)
+        return tmp
+
+    def preroll(self):
+        return ''.join(self._preroll)
+
+
+def deque_callback(ring):
+    def callback(in_data, frame_count, time_info, status):
+        ring.extend(in_data)
+        play_data = chr(0) * len(in_data)
+        return play_data, 0
+    return callback
+
+
+def ring_callback(ring):
+    def callback(in_data, frame_count, time_info, status):
+        ring.extend(in_data)
+        return None, 0
+    return callback
+
+
+BUFFERS = (('deque', DequeRingBuffer, deque_callback),
+           ('ring', bytering.ByteRing, ring_callback))
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(make_ring, make_callback, chunks, poll_ms, frames):
+    ring = make_ring(RATE * 5, RATE * SAMPLE_WIDTH // 2)
+    callback = make_callback(ring)
+    polls = float(frames) * 1000 / RATE / poll_ms
+    due = 0.0
+    received = 0
+    t0 = cpu_time()
+    for chunk in chunks:
+        callback(chunk, frames, None, 0)
+        due += polls
+        while due >= 1:
+            received += len(ring.get())
+            due -= 1
+    received += len(ring.get())
+    ring.preroll()
+    return cpu_time() - t0, received
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--seconds', type='int', default=600)
+    parser.add_option('--frames', type='int', default=2048,
+                      help='frames per callback buffer')
+    parser.add_option('--poll-ms', type='float', default=30,
+                      help='interval of the detector loop')
+    options, args = parser.parse_args()
+
+    rnd = random.Random(0)
+    chunk_bytes = options.frames * SAMPLE_WIDTH
+    # a few distinct buffers, the way PortAudio hands out new ones
+    pool = [bytes(bytearray(rnd.randrange(256) for _ in range(chunk_bytes)))
+            for _ in range(8)]
+    count = options.seconds * RATE // options.frames
+    chunks = [pool[i % len(pool)] for i in range(count)]
+    audio_seconds = count * options.frames / float(RATE)
+
+    print('%-8s %12s %16s %10s' % ('buffer', 'cpu', 'cpu per audio s', 'bytes'))
+    for name, make_ring, make_callback in BUFFERS:
+        cpu, received = run(make_ring, make_callback, chunks,
+                            options.poll_ms, options.frames)
+        print('%-8s %10.1fms %14.2fms %10d' % (name, 1000 * cpu,
+                                               1000 * cpu / audio_seconds, received))
@@ -0,0 +1,108 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_station_index.py --- station searches, Search.ashx vs local index
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Fills a station index by searching the local fake OPML server for
+# every genre, then looks up --queries stations by their full names and
+# by prefixes of them ('smooth ja'). The lookups run three ways:
+#
+#   network  TuneIn.search(query, local=False), every query a request
+#   index    TuneIn.search(query) on the filled index
+#   restart  a new TuneIn loading the same index file, with an empty
+#            lookup cache as after a restart of the alexa plugin
+#
+# and the table shows how many queries found a station, the requests
+# that reached the server and the median and 95th percentile time of a
+# query.
+#
+#   python bench/bench_station_index.py --stations 500 --queries 200
+
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import station_index
+import tunein
+from fake_opml import FakeOPMLServer, GENRES, station_name
+
+
+def make_queries(client, count):
+    names = sorted(station_name(n) for n in range(count * 4)
+                   if 's%d' % n in client._stations)
+    names = random.Random(1).sample(names, min(count, len(names)))
+    queries = []
+    for i, name in enumerate(names):
+        if i % 2:
+            words = name.lower().split()
+            queries.append('%s %s' % (words[0], words[1][:3]))
+        else:
+            queries.append(name)
+    return queries
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def run(client, queries, local=True):
+    times = []
+    found = 0
+    for query in queries:
+        t0 = time.time()
+        results = client.search(query, local)
+        times.append(time.time() - t0)
+        found += bool(results)
+    return found, times
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--stations', type='int', default=500)
+    parser.add_option('--queries', type='int', default=100)
+    parser.add_option('--latency-ms', type='int', default=80)
+    options, args = parser.parse_args()
+
+    server = FakeOPMLServer(stations=options.stations,
+                            latency_ms=options.latency_ms).start()
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'tunein_stations.db')
+    index = station_index.StationIndex(path)
+    client = tunein.TuneIn(5000, index=index, base_uri=server.base_uri)
+    t0 = time.time()
+    for genre in GENRES:
+        client.search(genre, local=False)
+    print('filled %d stations in %.1fms' % (len(index), 1000 * (time.time() - t0)))
+    queries = make_queries(client, options.queries)
+
+    print('%-8s %8s %8s %10s %12s %12s' % ('mode', 'queries', 'found',
+                                           'requests', 'median', 'p95'))
+    try:
+        for mode in ('network', 'index', 'restart'):
+            if mode == 'restart':
+                client._session.close()
+                index.close()
+                index = station_index.StationIndex(path)
+                client = tunein.TuneIn(5000, index=index, base_uri=server.base_uri)
+            del server.requests[:]
+            found, times = run(client, queries, mode != 'network')
+            print('%-8s %8d %8d %10d %10.1fus %10.1fus' % (
+                mode, len(queries), found, len(server.requests),
+                1e6 * percentile(times, 0.5), 1e6 * percentile(times, 0.95)))
+    finally:
+        client._session.close()
+        index.close()
+        server.shutdown()
+        shutil.rmtree(tmp)
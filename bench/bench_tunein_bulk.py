@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_tunein_bulk.py --- serial vs concurrent TuneIn describe and browse
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Describes --stations stations and browses --browse guide ids of the
+# local fake OPML server, first one call after another the way station()
+# and stations() are used, then with describe_many and browse_many at
+# every concurrency of --limits. Each run starts from a new TuneIn with
+# an empty cache and station index, and prints the time taken and the
+# requests that reached the server.
+#
+#   python bench/bench_tunein_bulk.py --stations 30 --limits 1,2,4,6
+
+import optparse
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import tunein
+from fake_opml import FakeOPMLServer
+
+
+def serial(client, ids, guide_ids):
+    for station_id in ids:
+        client.station(station_id)
+    for guide_id in guide_ids:
+        client.stations(guide_id)
+
+
+def bulk(limit):
+    def run(client, ids, guide_ids):
+        client.describe_many(ids, limit)
+        client.browse_many(guide_ids, 'Station', limit)
+    return run
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--stations', type='int', default=30)
+    parser.add_option('--browse', type='int', default=10)
+    parser.add_option('--latency-ms', type='int', default=80)
+    parser.add_option('--limits', default='1,2,4,6')
+    options, args = parser.parse_args()
+
+    server = FakeOPMLServer(stations=max(options.stations, 10),
+                            latency_ms=options.latency_ms).start()
+    ids = ['s%d' % n for n in range(options.stations)]
+    guide_ids = ['c%d' % n for n in range(options.browse)]
+    runs = [('serial', serial)] + [('bulk x%s' % limit, bulk(int(limit)))
+                                   for limit in options.limits.split(',')]
+    print('%-10s %10s %10s %10s' % ('run', 'time', 'requests', 'stations'))
+    try:
+        for name, run in runs:
+            del server.requests[:]
+            client = tunein.TuneIn(5000, base_uri=server.base_uri)
+            t0 = time.time()
+            run(client, ids, guide_ids)
+            elapsed = time.time() - t0
+            client._session.close()
+            print('%-10s %8.1fms %10d %10d' % (name, 1000 * elapsed,
+                                               len(server.requests),
+                                               client.index_stats()['stations']))
+    finally:
+        server.shutdown()
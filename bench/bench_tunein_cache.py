@@ -0,0 +1,70 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_tunein_cache.py --- cold start vs warm restart of TuneIn lookups
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Resolves --stations stations (search, describe, tune and playlist) from
+# the local fake OPML server three times, each with a new TuneIn object
+# as after a restart of the alexa plugin:
+#
+#   cold     empty disk cache
+#   warm     same disk cache file, new process state
+#   memory   memory-only cache, what a restart used to start from
+#
+# and prints the time taken and the requests that reached the server.
+#
+#   python bench/bench_tunein_cache.py --stations 20 --latency-ms 80
+
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import tunein
+from fake_opml import FakeOPMLServer, station_name
+
+
+def resolve_all(client, stations):
+    for n in range(stations):
+        client.search(station_name(n))
+        station = client.station('s%d' % n)
+        for uri in client.tune(station):
+            client.parse_stream_url(uri)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--stations', type='int', default=20)
+    parser.add_option('--latency-ms', type='int', default=80)
+    options, args = parser.parse_args()
+
+    server = FakeOPMLServer(stations=max(options.stations, 10),
+                            latency_ms=options.latency_ms).start()
+    tmp = tempfile.mkdtemp()
+    path = os.path.join(tmp, 'tunein_cache.db')
+    print('%-8s %10s %10s %s' % ('run', 'time', 'requests', 'disk cache'))
+    try:
+        for run, cache_path in (('cold', path), ('warm', path), ('memory', None)):
+            del server.requests[:]
+            client = tunein.TuneIn(5000, cache=tunein.make_cache(cache_path),
+                                   base_uri=server.base_uri)
+            t0 = time.time()
+            resolve_all(client, options.stations)
+            elapsed = time.time() - t0
+            client._session.close()
+            disk = client.cache_stats().get('disk', {})
+            print('%-8s %8.1fms %10d %s' % (run, 1000 * elapsed, len(server.requests),
+                                           '%d entries, %d bytes' % (disk['entries'], disk['bytes'])
+                                           if disk else '-'))
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp)
@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# bench_vad.py --- replay a recording through the endpointers
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Feeds a wav file frame by frame to the amplitude endpointer that
+# Alexa.record used to rely on and to the webrtcvad endpointer with a few
+# silence timeouts, then reports where each one stopped the capture and
+# how much trailing non-speech (end-of-speech latency) it recorded.
+#
+#   python bench/bench_vad.py --wav recording.wav --timeouts 300,600,1000
+#
+# --synthetic replaces the file with 1 s silence, 2 s of voiced sound and
+# 3 s silence, which is handy when recording.wav holds no speech.
+
+import math
+import optparse
+import os
+import random
+import sys
+import time
+import wave
+from array import array
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import audio_dsp
+import vad_endpoint
+
+RATE = 16000
+
+
+def read_wav(fname):
+    wf = wave.open(fname, 'rb')
+    assert wf.getframerate() == RATE and wf.getsampwidth() == 2 \
+        and wf.getnchannels() == 1, '%s is not 16 kHz 16 bit mono' % fname
+    data = wf.readframes(wf.getnframes())
+    wf.close()
+    return data
+
+
+def synthetic():
+    rnd = random.Random(0)
+    L = array('h')
+    for i in range(RATE * 6):
+        t = float(i) / RATE
+        v = rnd.randint(-100, 100)
+        if 1 <= t < 3:
+            # a vowel-ish signal: 140 Hz pitch with a few harmonics
+            v += sum(3000.0 / k * math.sin(2 * math.pi * 140 * k * t)
+                     for k in range(1, 8)) * (0.7 + 0.3 * math.sin(t * 20))
+        L.append(int(v))
+    return audio_dsp.to_bytes(L)
+
+
+def replay(endpointer, data):
+    step = endpointer.frame_bytes
+    t0 = time.time()
+    for i in range(0, len(data) - step + 1, step):
+        if endpointer.feed(data[i:i + step]):
+            break
+    cpu = time.time() - t0
+    stopped_ms = int(endpointer.frames * endpointer.frame_ms)
+    return stopped_ms, cpu
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--wav', default=os.path.join(TOP_DIR, 'recording.wav'))
+    parser.add_option('--synthetic', action='store_true')
+    parser.add_option('--timeouts', default='300,600,1000',
+                      help='comma separated VAD silence timeouts in ms')
+    parser.add_option('--aggressiveness', type='int', default=2)
+    options, args = parser.parse_args()
+
+    data = synthetic() if options.synthetic else read_wav(options.wav)
+    print('%s, %d ms of audio, webrtcvad %s' % (
+        'synthetic' if options.synthetic else options.wav,
+        len(data) * 1000 // (RATE * 2),
+        'available' if vad_endpoint.webrtcvad else 'missing (amplitude fallback)'))
+    print('%-22s %9s %10s %11s %9s' % ('endpointer', 'speech', 'stopped at',
+                                        'eos latency', 'cpu'))
+
+    candidates = [('amplitude 4000/20', vad_endpoint.AmplitudeEndpointer())]
+    for timeout in [int(x) for x in options.timeouts.split(',')]:
+        candidates.append(('vad timeout %dms' % timeout,
+                           vad_endpoint.VadEndpointer(
+                               aggressiveness=options.aggressiveness,
+                               silence_timeout=timeout)))
+    for name, endpointer in candidates:
+        stopped_ms, cpu = replay(endpointer, data)
+        if endpointer.ended:
+            latency = '%dms' % endpointer.trailing_ms
+        else:
+            latency = 'no end'
+        print('%-22s %7dms %8dms %11s %7.1fms' % (
+            name, endpointer.speech_ms, stopped_ms, latency, cpu * 1000))
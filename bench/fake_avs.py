@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# fake_avs.py --- local stand-in for the Alexa Voice Service endpoints
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Serves /v1/avs/speechrecognizer/recognize and
+# /v1/avs/audioplayer/getNextItem on localhost so the request path of
+# mmdagent_alexa.py can be timed without network or credentials.
+# The uplink and downlink bandwidth and the recognition time are simulated,
+# and the server records when the last byte of each request body arrived.
+#
+# Run standalone and point the alexa plugin at it:
+#
+#   python bench/fake_avs.py --port 8765
+#   AVS_URL=http://127.0.0.1:8765 python mmdagent_alexa.py
+
+import json
+import optparse
+import os
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+RESPONSE_BOUNDARY = 'fake-avs-boundary'
+
+
+def speak_response(audio_bytes, cid='speak-0', extra_parts=0):
+    """
+    Return (content_type, body) of a recognize reply with one speak
+    directive, optionally followed by `extra_parts` more audio parts of
+    the same size.
+    """
+    directives = {
+        "messageHeader": {},
+        "messageBody": {
+            "directives": [
+                {
+                    "namespace": "SpeechSynthesizer",
+                    "name": "speak",
+                    "payload": {"audioContent": "cid:%s" % cid,
+                                "contentIdentifier": "fake"}
+                }
+            ]
+        }
+    }
+    body = b''.join([
+        ('--%s\r\n' % RESPONSE_BOUNDARY).encode('ascii'),
+        b'Content-Type: application/json\r\n\r\n',
+        json.dumps(directives).encode('utf-8'),
+        ('\r\n--%s\r\n' % RESPONSE_BOUNDARY).encode('ascii'),
+        ('Content-ID: <%s>\r\n' % cid).encode('ascii'),
+        b'Content-Type: audio/mpeg\r\n\r\n',
+        os.urandom(audio_bytes),
+    ] + [
+        ('\r\n--%s\r\nContent-ID: <extra-%d>\r\n'
+         'Content-Type: audio/mpeg\r\n\r\n' % (RESPONSE_BOUNDARY, i)).encode('ascii')
+        + os.urandom(audio_bytes) for i in range(extra_parts)
+    ] + [
+        ('\r\n--%s--\r\n' % RESPONSE_BOUNDARY).encode('ascii'),
+    ])
+    content_type = ('multipart/related; boundary=%s; type="application/json"'
+                    % RESPONSE_BOUNDARY)
+    return content_type, body
+
+
+def next_item_response(nav_token, stream_url, stream_id):
+    """
+    Return (content_type, body) of a getNextItem reply with one stream
+    and the navigation token of the item after it.
+    """
+    item = {
+        "messageHeader": {},
+        "messageBody": {
+            "navigationToken": nav_token,
+            "audioItem": {
+                "audioItemId": stream_id,
+                "streams": [
+                    {
+                        "streamUrl": stream_url,
+                        "streamId": stream_id,
+                        "offsetInMilliseconds": 0,
+                        "progressReportRequired": False
+                    }
+                ]
+            }
+        }
+    }
+    body = b''.join([
+        ('--%s\r\n' % RESPONSE_BOUNDARY).encode('ascii'),
+        b'Content-Type: application/json\r\n\r\n',
+        json.dumps(item).encode('utf-8'),
+        ('\r\n--%s--\r\n' % RESPONSE_BOUNDARY).encode('ascii'),
+    ])
+    content_type = ('multipart/related; boundary=%s; type="application/json"'
+                    % RESPONSE_BOUNDARY)
+    return content_type, body
+
+
+class FakeAVSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _throttle(self, nbytes, bps=None):
+        bps = self.server.uplink_bps if bps is None else bps
+        if bps:
+            time.sleep(float(nbytes) / bps)
+
+    def read_body(self):
+        """Read a plain or chunked request body at the simulated uplink rate"""
+        data = []
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                data.append(self.rfile.read(size))
+                self.rfile.readline()
+                self._throttle(size)
+        else:
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                chunk = self.rfile.read(min(remaining, 4096))
+                if not chunk:
+                    break
+                data.append(chunk)
+                remaining -= len(chunk)
+                self._throttle(len(chunk))
+        return b''.join(data)
+
+    def send_payload(self, status, content_type=None, body=b''):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        for i in range(0, len(body), 4096):
+            self.wfile.write(body[i:i + 4096])
+            self._throttle(len(body[i:i + 4096]), self.server.downlink_bps)
+
+    def do_POST(self):
+        route = self.path.split('?')[0]
+        body = self.read_body()
+        self.server.requests.append((route, time.time(), len(body)))
+        handler = self.server.routes.get(route)
+        if handler is None:
+            self.send_payload(404)
+            return
+        handler(self, body)
+
+
+def handle_recognize(handler, body):
+    time.sleep(handler.server.think_ms / 1000.0)
+    content_type, payload = speak_response(handler.server.audio_bytes,
+                                           extra_parts=handler.server.extra_parts)
+    handler.send_payload(200, content_type, payload)
+
+
+def handle_getnextitem(handler, body):
+    """
+    Navigation tokens are "item-<n>"; the reply to item-n is item n+1,
+    until `playlist_length` items were served.
+    """
+    time.sleep(handler.server.think_ms / 1000.0)
+    token = json.loads(body.decode('utf-8'))['messageBody']['navigationToken']
+    n = int(token.rsplit('-', 1)[1]) + 1
+    if n >= handler.server.playlist_length:
+        handler.send_payload(204)
+        return
+    content_type, payload = next_item_response(
+        'item-%d' % n, '%s/stream/%d' % (handler.server.url, n), 'stream-%d' % n)
+    handler.send_payload(200, content_type, payload)
+
+
+class FakeAVSServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), uplink_bps=0, think_ms=50,
+                 audio_bytes=16000, verbose=False, downlink_bps=0,
+                 extra_parts=0, playlist_length=10):
+        HTTPServer.__init__(self, address, FakeAVSHandler)
+        self.uplink_bps = uplink_bps
+        self.downlink_bps = downlink_bps
+        self.extra_parts = extra_parts
+        self.think_ms = think_ms
+        self.audio_bytes = audio_bytes
+        self.playlist_length = playlist_length
+        self.verbose = verbose
+        self.requests = []
+        self.routes = {
+            '/v1/avs/speechrecognizer/recognize': handle_recognize,
+            '/v1/avs/audioplayer/getNextItem': handle_getnextitem,
+        }
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8765)
+    parser.add_option('--uplink-kbps', type='int', default=0,
+                      help='simulated upload bandwidth, 0 for unlimited')
+    parser.add_option('--downlink-kbps', type='int', default=0,
+                      help='simulated download bandwidth, 0 for unlimited')
+    parser.add_option('--think-ms', type='int', default=50,
+                      help='simulated recognition time after the last byte')
+    parser.add_option('--audio-bytes', type='int', default=16000,
+                      help='size of the speak audio part in replies')
+    options, args = parser.parse_args()
+    server = FakeAVSServer(('127.0.0.1', options.port),
+                           uplink_bps=options.uplink_kbps * 125,
+                           downlink_bps=options.downlink_kbps * 125,
+                           think_ms=options.think_ms,
+                           audio_bytes=options.audio_bytes,
+                           verbose=True)
+    print('fake AVS listening on %s' % server.url)
+    server.serve_forever()
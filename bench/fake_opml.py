@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# fake_opml.py --- local stand-in for the opml.radiotime.com TuneIn API
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Serves a synthetic station directory in the JSON rendering of the
+# TuneIn OPML API so tunein.TuneIn can be timed without network:
+#
+#   Browse.ashx    ?c=local|music|...   sections of station outlines
+#                  ?id=<guide id>       Featured/Local/Station/Related
+#   Describe.ashx  ?id=s<n>             a Listing section for one station
+#   Search.ashx    ?query=<text>        stations whose name contains it
+#   Tune.ashx      ?id=s<n>             playlist URLs of the station, as
+#                                       text/plain without render=json
+#   /playlist/<n>.m3u|.pls|.asx         playlists pointing at /stream/<n>
+#   /stream/<n>?mirror=<k>              audio/mpeg
+#
+# Every reply is delayed by --latency-ms. With --nesting playlists point
+# at further playlists that many levels deep before the streams, and
+# with --mirrors each playlist lists that many mirrors of the stream,
+# mirror k taking k * --mirror-delay-ms longer to send its first byte.
+# Point TuneIn at it with base_uri='http://127.0.0.1:<port>/%s'.
+#
+#   python bench/fake_opml.py --port 8766 --stations 500
+
+import json
+import optparse
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+GENRES = ('jazz', 'rock', 'news', 'classical', 'talk', 'pop', 'country', 'blues')
+WORDS = ('radio', 'fm', 'public', 'city', 'classic', 'hits', 'smooth', 'live')
+
+
+def station_name(n):
+    return '%s %s %d' % (WORDS[n % len(WORDS)].title(),
+                         GENRES[n % len(GENRES)].title(), 80 + n)
+
+
+class FakeOPMLHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def send_body(self, status, content_type, body):
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, body):
+        self.send_body(200, 'application/json',
+                       json.dumps({'head': {'status': '200'}, 'body': body}))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+        with self.server.lock:
+            self.server.requests.append(url.path)
+        time.sleep(self.server.latency_ms / 1000.0)
+        name = url.path.lstrip('/')
+        server = self.server
+        if name == 'Browse.ashx':
+            self.send_json(server.browse(query))
+        elif name == 'Describe.ashx':
+            self.send_json(server.describe(query.get('id', '')))
+        elif name == 'Search.ashx':
+            self.send_json(server.search(query.get('query', '')))
+        elif name == 'Tune.ashx':
+            streams = server.tune(query.get('id', ''))
+            if query.get('render') == 'json':
+                self.send_json(streams)
+            else:
+                self.send_body(200, 'text/plain; charset=utf-8',
+                               ''.join(s['url'] + '\n' for s in streams))
+        elif name.startswith('playlist/'):
+            n, ext = name[len('playlist/'):].rsplit('.', 1)
+            content_type, body = server.playlist(int(n), ext,
+                                                 int(query.get('level', 0)))
+            self.send_body(200, content_type, body)
+        elif name.startswith('stream/'):
+            mirror = int(query.get('mirror', 0))
+            time.sleep(mirror * server.mirror_delay_ms / 1000.0)
+            self.send_body(200, 'audio/mpeg', b'\xff\xfb' * 512)
+        else:
+            self.send_body(404, 'text/plain', 'not found')
+
+
+class FakeOPMLServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), stations=200, latency_ms=80,
+                 verbose=False, nesting=0, mirrors=1, mirror_delay_ms=100):
+        HTTPServer.__init__(self, address, FakeOPMLHandler)
+        self.stations = stations
+        self.latency_ms = latency_ms
+        self.nesting = nesting
+        self.mirrors = mirrors
+        self.mirror_delay_ms = mirror_delay_ms
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.requests = []
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address[:2]
+
+    def handle_error(self, request, client_address):
+        # stream probes hang up after the first byte
+        if self.verbose:
+            HTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def base_uri(self):
+        return self.url + '/%s'
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def outline(self, n):
+        return {'element': 'outline', 'type': 'audio',
+                'text': station_name(n), 'guide_id': 's%d' % n,
+                'subtext': 'The best %s in town' % GENRES[n % len(GENRES)],
+                'genre_id': 'g%d' % (n % len(GENRES)),
+                'formats': 'mp3', 'item': 'station',
+                'URL': '%s/Tune.ashx?id=s%d' % (self.url, n)}
+
+    def browse(self, query):
+        first = int(query.get('id', 's0').lstrip('rgsc') or 0) % self.stations
+        outlines = [self.outline((first + i) % self.stations) for i in range(10)]
+        return [{'element': 'outline', 'text': section, 'key': section.lower(),
+                 'children': outlines[i::3]}
+                for i, section in enumerate(('Local', 'Featured', 'Stations'))]
+
+    def describe(self, guide_id):
+        n = int(guide_id.lstrip('s') or 0)
+        listing = {'element': 'listing', 'guide_id': guide_id,
+                   'name': station_name(n),
+                   'slogan': 'The best %s in town' % GENRES[n % len(GENRES)],
+                   'genre_name': GENRES[n % len(GENRES)],
+                   'logo': '%s/logo/%d.png' % (self.url, n)}
+        return [{'element': 'outline', 'text': 'Listing', 'key': 'listing',
+                 'children': [listing]}]
+
+    def search(self, text):
+        text = text.lower()
+        return [self.outline(n) for n in range(self.stations)
+                if text in station_name(n).lower()][:50]
+
+    def tune(self, guide_id):
+        n = int(guide_id.lstrip('s') or 0)
+        ext = ('m3u', 'pls', 'asx')[n % 3]
+        return [{'element': 'audio', 'url': '%s/playlist/%d.%s' % (self.url, n, ext),
+                 'media_type': 'mp3', 'bitrate': 128}]
+
+    def playlist(self, n, ext, level=0):
+        if level < self.nesting:
+            entries = ['%s/playlist/%d.%s?level=%d&branch=%d' % (self.url, n, ext, level + 1, k)
+                       for k in range(2)]
+        else:
+            # slowest mirror first, so picking the first entry is the worst case
+            entries = ['%s/stream/%d?mirror=%d' % (self.url, n, k)
+                       for k in reversed(range(self.mirrors))]
+        if ext == 'pls':
+            return 'audio/x-scpls', ('[playlist]\nNumberOfEntries=%d\n' % len(entries) +
+                                     ''.join('File%d=%s\nLength%d=-1\n' % (i + 1, e, i + 1)
+                                             for i, e in enumerate(entries)))
+        if ext == 'asx':
+            return 'video/x-ms-asf', ('<asx version="3.0">' +
+                                      ''.join('<entry><ref href="%s"/></entry>' % e.replace('&', '&amp;')
+                                              for e in entries) + '</asx>')
+        return 'audio/x-mpegurl', '#EXTM3U\n%s\n' % '\n'.join(entries)
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--port', type='int', default=8766)
+    parser.add_option('--stations', type='int', default=200)
+    parser.add_option('--latency-ms', type='int', default=80)
+    parser.add_option('--nesting', type='int', default=0)
+    parser.add_option('--mirrors', type='int', default=1)
+    parser.add_option('--mirror-delay-ms', type='int', default=100)
+    options, args = parser.parse_args()
+    server = FakeOPMLServer(('127.0.0.1', options.port), options.stations,
+                            options.latency_ms, True, options.nesting,
+                            options.mirrors, options.mirror_delay_ms)
+    print('fake OPML listening on %s' % server.url)
+    server.serve_forever()
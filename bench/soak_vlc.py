@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# soak_vlc.py --- RSS over thousands of plays, pooled vs fresh VLC objects
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Plays resources/ding.wav over and over, either through
+# vlc_player.PlayerService (one instance, pooled players, preloaded media)
+# or the way play_audio used to (new instances, media and player on every
+# play, never released), and prints the resident set size and the setup
+# latency every --every plays. Audio goes to VLC's dummy output so the
+# test runs headless and faster than real time is not needed.
+#
+#   python bench/soak_vlc.py --mode pool --plays 5000
+#   python bench/soak_vlc.py --mode fresh --plays 5000
+
+import optparse
+import os
+import sys
+import threading
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOP_DIR)
+
+import vlc
+
+import vlc_player
+
+DING = os.path.join(TOP_DIR, 'resources/ding.wav')
+VLC_ARGS = ('--aout=dummy', '--no-video', '--quiet')
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def on_state(event, player, done):
+    if event.type != vlc.EventType.MediaPlayerPlaying:
+        done.set()
+
+
+def play_pooled(service):
+    done = threading.Event()
+    t0 = time.time()
+    pooled = service.play(DING, 100, on_state, done)
+    setup = time.time() - t0
+    done.wait(5)
+    service.release(pooled)
+    return setup
+
+
+def play_fresh(unused):
+    done = threading.Event()
+    t0 = time.time()
+    i = vlc.Instance(*VLC_ARGS)
+    i = vlc.Instance(*VLC_ARGS)
+    m = i.media_new(DING)
+    p = i.media_player_new()
+    p.set_media(m)
+    em = p.event_manager()
+    for name in ('MediaPlayerEndReached', 'MediaPlayerEncounteredError'):
+        em.event_attach(getattr(vlc.EventType, name),
+                        lambda event: done.set())
+    p.play()
+    setup = time.time() - t0
+    done.wait(5)
+    return setup
+
+
+if __name__ == '__main__':
+    parser = optparse.OptionParser()
+    parser.add_option('--mode', choices=['pool', 'fresh'], default='pool')
+    parser.add_option('--plays', type='int', default=2000)
+    parser.add_option('--every', type='int', default=250)
+    options, args = parser.parse_args()
+
+    if options.mode == 'pool':
+        service = vlc_player.PlayerService(VLC_ARGS, pool_size=2)
+        service.preload(DING)
+        play = play_pooled
+    else:
+        service = None
+        play = play_fresh
+
+    base = rss_kb()
+    setups = []
+    print('%-8s %10s %10s %12s' % ('plays', 'rss', 'growth', 'setup avg'))
+    for n in range(1, options.plays + 1):
+        setups.append(play(service))
+        if n % options.every == 0:
+            rss = rss_kb()
+            print('%-8d %8dkB %8dkB %10.2fms' % (
+                n, rss, rss - base, 1000 * sum(setups) / len(setups)))
+            setups = []
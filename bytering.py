@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+# bytering.py --- preallocated single producer, single consumer byte ring
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# The PortAudio callback of HotwordDetector used to extend a deque with
+# every PCM byte as its own element and the detector joined them back
+# into a string every 30 ms. ByteRing copies each callback buffer into a
+# bytearray allocated once, through a memoryview, and get() copies the
+# unread span out in at most two slices.
+#
+# It has the same layout as the audio bus (audiobus.py), in process:
+# `written` and `read` are absolute byte counts and byte N lives at
+# N % size. The producer only moves `written`, after the bytes are in
+# place, and the consumer only moves `read`, so one thread can extend()
+# while another calls get() without a lock. A consumer that falls more
+# than `capacity` bytes behind skips to the oldest audio kept, and bytes
+# the producer overwrote while they were being copied are dropped.
+#
+# read() blocks the consumer until enough bytes are there. The producer
+# only takes the condition lock to wake a consumer that is waiting.
+
+import threading
+import time
+
+class ByteRing(object):
+    """
+    :param capacity: unread bytes kept before the oldest are dropped.
+    :param preroll: bytes already returned by get() that preroll() can
+                    still return.
+    """
+
+    def __init__(self, capacity=4096, preroll=0):
+        self.capacity = int(capacity)
+        self.preroll_bytes = int(preroll)
+        self._size = self.capacity + self.preroll_bytes
+        self._buf = bytearray(self._size)
+        self._view = memoryview(self._buf)
+        self._written = 0
+        # end of the bytes being written, ahead of _written during extend()
+        self._writing = 0
+        self._read = 0
+        # preroll() returns nothing from before this offset
+        self._floor = 0
+        self._cond = threading.Condition()
+        self._waiting = False
+        self._woken = False
+        self.overruns = 0
+
+    @property
+    def written(self):
+        return self._written
+
+    def available(self):
+        """Unread bytes, at most `capacity`"""
+        return min(self._written - self._read, self.capacity)
+
+    def extend(self, data):
+        """Adds data to the end of buffer, producer side"""
+        n = len(data)
+        if not n:
+            return
+        src = memoryview(data)
+        start = self._written
+        if n > self._size:
+            start += n - self._size
+            src = src[n - self._size:]
+        size = self._size
+        self._writing = self._written + n
+        pos = start % size
+        first = min(len(src), size - pos)
+        self._view[pos:pos + first] = src[:first]
+        if first < len(src):
+            self._view[:len(src) - first] = src[first:]
+        # publish only after the bytes are in place
+        self._written += n
+        if self._waiting:
+            with self._cond:
+                self._cond.notify()
+
+    def _copy(self, start, nbytes):
+        size = self._size
+        pos = start % size
+        first = min(nbytes, size - pos)
+        data = self._view[pos:pos + first].tobytes()
+        if first < nbytes:
+            data += self._view[:nbytes - first].tobytes()
+        return data
+
+    def get(self, max_bytes=None):
+        """
+        Retrieves the unread data, or its first `max_bytes`, consumer
+        side. Returns b'' when there is nothing to read.
+        """
+        written = self._written
+        start = self._read
+        if written - start > self.capacity:
+            self.overruns += 1
+            start = written - self.capacity
+        nbytes = written - start
+        if max_bytes is not None:
+            nbytes = min(nbytes, max_bytes)
+        if nbytes <= 0:
+            return b''
+        data = self._copy(start, nbytes)
+        # the producer may have lapped us while we were copying
+        oldest = self._writing - self._size
+        if oldest > start:
+            self.overruns += 1
+            data = data[oldest - start:]
+            nbytes -= oldest - start
+            start = oldest
+            if nbytes <= 0:
+                self._read = oldest
+                return self.get(max_bytes)
+        self._read = start + nbytes
+        return data
+
+    def wait(self, nbytes, timeout=None):
+        """
+        Block until `nbytes` are unread, consumer side. Returns False when
+        `timeout` seconds pass first or wakeup() is called.
+        """
+        if self.available() >= nbytes:
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._waiting = True
+            try:
+                while self.available() < nbytes:
+                    if self._woken:
+                        self._woken = False
+                        return False
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return False
+                        self._cond.wait(remaining)
+                return True
+            finally:
+                self._waiting = False
+
+    def read(self, nbytes, timeout=None):
+        """
+        Block until `nbytes` are unread and return them, b'' on a timeout
+        or wakeup()
+        """
+        if not self.wait(nbytes, timeout):
+            return b''
+        return self.get(nbytes)
+
+    def wakeup(self):
+        """Make the read() in progress, or the next one, return b''"""
+        with self._cond:
+            self._woken = True
+            self._cond.notify()
+
+    def preroll(self):
+        """Retrieves the most recent audio already returned by get()"""
+        end = self._read
+        start = max(end - self.preroll_bytes, self._written - self._size, self._floor)
+        if end <= start:
+            return b''
+        data = self._copy(start, end - start)
+        oldest = self._writing - self._size
+        if oldest > start:
+            data = data[oldest - start:]
+        return data
+
+    def clear(self):
+        """Drop the unread data and the preroll, consumer side"""
+        self._read = self._floor = self._written
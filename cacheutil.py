@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+# cacheutil.py --- bounded thread-safe LRU cache with per-key TTL
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# LRUCache holds at most `max_entries` values and about `max_bytes` of
+# them (sizes are estimated with approx_size), evicting the least
+# recently used first. Every entry has its own expiry time. Failures can
+# be cached too, with their own shorter TTL, so a dead endpoint is not
+# hit again on every call.
+#
+# cached_method() memoizes a method in a cache stored on the instance:
+#
+#   class TuneIn(object):
+#       def __init__(self):
+#           self._cache = LRUCache()
+#
+#       @cached_method('_cache', failed=lambda value: not value)
+#       def _tunein(self, variant, args):
+#           ...
+#
+# SQLiteCache is a persistent tier with the same interface for values
+# that survive a JSON round trip, and TieredCache puts an LRUCache in
+# front of it so only misses of the memory tier touch the disk.
+
+import functools
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str, bytes)
+
+logger = logging.getLogger(__name__)
+
+
+def approx_size(value):
+    "Rough number of bytes held by a value made of dicts, lists and strings"
+    if value is None:
+        return 0
+    if isinstance(value, string_types):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in value.items()) + 16
+    if isinstance(value, (list, tuple, set)):
+        return sum(approx_size(v) for v in value) + 8
+    return 8
+
+
+class CacheStats(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class LRUCache(object):
+    """
+    :param max_entries: entries kept before the least recently used go.
+    :param max_bytes: estimated size kept before the least recently used
+                      go, 0 for no limit.
+    :param ttl: default seconds an entry is valid.
+    :param negative_ttl: default seconds a cached failure is valid.
+    :param sizeof: function estimating the size of a value.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=4 * 1024 * 1024,
+                 ttl=3600, negative_ttl=60, sizeof=approx_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.counters = CacheStats()
+
+    def lookup(self, key):
+        """
+        Return (found, value, negative). `negative` is True when the
+        cached value is a remembered failure.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.counters.misses += 1
+                return False, None, False
+            value, expires, size, negative = entry
+            if now >= expires:
+                self._bytes -= size
+                self.counters.expirations += 1
+                self.counters.misses += 1
+                return False, None, False
+            # most recently used entries live at the end
+            self._data[key] = entry
+            if negative:
+                self.counters.negative_hits += 1
+            else:
+                self.counters.hits += 1
+            return True, value, negative
+
+    def get(self, key, default=None):
+        found, value, negative = self.lookup(key)
+        return value if found else default
+
+    def put(self, key, value, ttl=None, negative=False):
+        """Store `value` for `ttl` seconds, the cache default if None"""
+        if ttl is None:
+            ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        size = self._sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, time.time() + ttl, size, negative)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._data and (len(self._data) > self.max_entries or
+                              (self.max_bytes and self._bytes > self.max_bytes)):
+            key, entry = self._data.popitem(last=False)
+            self._bytes -= entry[2]
+            self.counters.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and time.time() < entry[1]
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def stats(self):
+        with self._lock:
+            stats = self.counters.as_dict()
+            stats.update(entries=len(self._data), bytes=self._bytes)
+            return stats
+
+
+class SQLiteCache(object):
+    """
+    Persistent cache in an SQLite file. Keys and values are stored as
+    JSON, so tuples come back as lists.
+
+    :param path: database file, created if missing.
+    :param max_entries: entries kept on disk.
+    :param max_bytes: bytes of JSON values kept on disk.
+    :param ttl: default seconds an entry is valid.
+    :param negative_ttl: default seconds a cached failure is valid.
+    :param compact_every: puts between two compactions.
+    """
+
+    def __init__(self, path, max_entries=5000, max_bytes=16 * 1024 * 1024,
+                 ttl=86400, negative_ttl=60, compact_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.counters = CacheStats()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._db.execute('CREATE TABLE IF NOT EXISTS cache ('
+                             'key TEXT PRIMARY KEY, value TEXT, expires REAL, '
+                             'size INTEGER, negative INTEGER, used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS cache_used ON cache (used)')
+            self._db.commit()
+        self.compact()
+
+    def _key(self, key):
+        return json.dumps(key, separators=(',', ':'))
+
+    def lookup_entry(self, key):
+        """Return (found, value, negative, expires)"""
+        k = self._key(key)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute('SELECT value, expires, negative FROM cache '
+                                   'WHERE key = ?', (k,)).fetchone()
+            if row is None or row[1] <= now:
+                self.counters.misses += 1
+                if row is not None:
+                    self.counters.expirations += 1
+                    self._db.execute('DELETE FROM cache WHERE key = ?', (k,))
+                    self._db.commit()
+                return False, None, False, 0
+            self._db.execute('UPDATE cache SET used = ? WHERE key = ?', (now, k))
+            self._db.commit()
+            if row[2]:
+                self.counters.negative_hits += 1
+            else:
+                self.counters.hits += 1
+        return True, json.loads(row[0]), bool(row[2]), row[1]
+
+    def lookup(self, key):
+        found, value, negative, expires = self.lookup_entry(key)
+        return found, value, negative
+
+    def get(self, key, default=None):
+        found, value, negative = self.lookup(key)
+        return value if found else default
+
+    def put(self, key, value, ttl=None, negative=False, expires=None):
+        """Store `value` for `ttl` seconds, or until the time `expires`"""
+        now = time.time()
+        if expires is None:
+            if ttl is None:
+                ttl = self.negative_ttl if negative else self.ttl
+            expires = now + ttl
+        if expires <= now:
+            return
+        try:
+            data = json.dumps(value, separators=(',', ':'))
+        except (TypeError, ValueError) as e:
+            logger.debug('not caching %r on disk: %s' % (key, e))
+            return
+        if self.max_bytes and len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)',
+                             (self._key(key), data, expires, len(data),
+                              int(negative), now))
+            self._db.commit()
+            self._puts += 1
+            compact = self._puts % self.compact_every == 0
+        if compact:
+            self.compact()
+
+    def compact(self, vacuum=False):
+        """
+        Drop expired entries, then the least recently used ones beyond the
+        entry and byte caps. The file is vacuumed when asked to, or when a
+        quarter of its pages are free.
+        """
+        with self._lock:
+            db = self._db
+            removed = db.execute('DELETE FROM cache WHERE expires <= ?',
+                                 (time.time(),)).rowcount
+            self.counters.expirations += max(removed, 0)
+            count, total = db.execute('SELECT COUNT(*), TOTAL(size) FROM cache').fetchone()
+            drop = 0
+            if count > self.max_entries or (self.max_bytes and total > self.max_bytes):
+                for (size,) in db.execute('SELECT size FROM cache ORDER BY used').fetchall():
+                    if (count - drop <= self.max_entries and
+                            (not self.max_bytes or total <= self.max_bytes)):
+                        break
+                    drop += 1
+                    total -= size
+            if drop:
+                db.execute('DELETE FROM cache WHERE key IN '
+                           '(SELECT key FROM cache ORDER BY used LIMIT ?)', (drop,))
+                self.counters.evictions += drop
+            db.commit()
+            pages = db.execute('PRAGMA page_count').fetchone()[0]
+            free = db.execute('PRAGMA freelist_count').fetchone()[0]
+            if vacuum or (pages > 16 and free * 4 > pages):
+                db.execute('VACUUM')
+
+    def invalidate(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE key = ?', (self._key(key),))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM cache')
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    @property
+    def size(self):
+        with self._lock:
+            return int(self._db.execute('SELECT TOTAL(size) FROM cache').fetchone()[0])
+
+    def stats(self):
+        stats = self.counters.as_dict()
+        stats.update(entries=len(self), bytes=self.size)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class TieredCache(object):
+    """
+    An LRUCache in front of a persistent cache such as SQLiteCache.
+    Values found only on disk are copied to memory for the rest of their
+    lifetime, puts go to both tiers.
+    """
+
+    def __init__(self, memory, disk):
+        self.memory = memory
+        self.disk = disk
+
+    def lookup(self, key):
+        found, value, negative = self.memory.lookup(key)
+        if found:
+            return found, value, negative
+        try:
+            found, value, negative, expires = self.disk.lookup_entry(key)
+        except sqlite3.Error as e:
+            logger.warning('disk cache lookup failed: %s' % e)
+            return False, None, False
+        if found:
+            self.memory.put(key, value, expires - time.time(), negative)
+        return found, value, negative
+
+    def get(self, key, default=None):
+        found, value, negative = self.lookup(key)
+        return value if found else default
+
+    def put(self, key, value, ttl=None, negative=False):
+        self.memory.put(key, value, ttl, negative)
+        try:
+            self.disk.put(key, value, ttl, negative)
+        except sqlite3.Error as e:
+            logger.warning('disk cache put failed: %s' % e)
+
+    def invalidate(self, key):
+        self.memory.invalidate(key)
+        self.disk.invalidate(key)
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def __len__(self):
+        return len(self.memory)
+
+    def stats(self):
+        return {'memory': self.memory.stats(), 'disk': self.disk.stats()}
+
+
+def cached_method(attribute, ttl=None, negative_ttl=None, failed=None):
+    """
+    Memoize a method in the LRUCache found in `attribute` of the instance,
+    keyed by the method name and its positional arguments. Results for
+    which `failed(result)` is true are cached with `negative_ttl`; without
+    `failed` every result is cached. Unhashable arguments bypass the cache.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def _memoized(self, *args):
+            cache = getattr(self, attribute)
+            key = (func.__name__,) + args
+            try:
+                found, value, negative = cache.lookup(key)
+            except TypeError:
+                return func(self, *args)
+            if found:
+                return value
+            value = func(self, *args)
+            if failed is not None and failed(value):
+                cache.put(key, value, negative_ttl, negative=True)
+            else:
+                cache.put(key, value, ttl)
+            return value
+        return _memoized
+    return decorator
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+
+# earcon.py --- pre-decoded ding/dong/beep on a PortAudio output stream
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Short notification sounds are decoded once, converted to the format of
+# a single output stream, and kept as PCM in memory. The output stream's
+# callback copies the sound that is currently playing, or silence, into
+# every buffer, and play() only swaps a reference under a lock.
+#
+# By default the stream is opened by play() and closed again `linger`
+# seconds after the last sound ended, so the output device is free for
+# VLC the rest of the time. When both go to a device that can be shared
+# (dmix, pulse), keep_open leaves the stream open from startup and a
+# sound starts within one output buffer (8 ms with the defaults) of the
+# call. Otherwise every sound first waits for PortAudio to open the
+# device, and a sound whose device is busy does not play at all: its
+# Playback is done right away with `error` set.
+#
+# `latency` records, for every play, the time from play() to the buffer
+# holding its first samples plus the latency PortAudio reports for the
+# stream.
+
+import audioop
+import collections
+import logging
+import threading
+import time
+import wave
+
+logger = logging.getLogger(__name__)
+
+RATE = 16000
+SAMPLE_WIDTH = 2
+FRAMES_PER_BUFFER = 128
+# seconds the stream stays open after a sound, unless kept open
+LINGER = 1.0
+
+
+def decode_wave(fname, rate=RATE):
+    """Read a wav file and return its audio as mono 16 bit PCM at `rate`"""
+    wf = wave.open(fname, 'rb')
+    data = wf.readframes(wf.getnframes())
+    width = wf.getsampwidth()
+    channels = wf.getnchannels()
+    source_rate = wf.getframerate()
+    wf.close()
+    if width != SAMPLE_WIDTH:
+        data = audioop.lin2lin(data, width, SAMPLE_WIDTH)
+    if channels == 2:
+        data = audioop.tomono(data, SAMPLE_WIDTH, 0.5, 0.5)
+    if source_rate != rate:
+        data, state = audioop.ratecv(data, SAMPLE_WIDTH, 1, source_rate, rate, None)
+    return data
+
+
+class Playback(object):
+    """
+    Handle of one play() call, wait() blocks until the sound is over.
+    `error` is set when the sound could not be played.
+    """
+
+    def __init__(self, name, pcm):
+        self.name = name
+        self.pcm = memoryview(pcm)
+        self.pos = 0
+        self.requested = time.time()
+        self.started = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def failed(self):
+        return self.error is not None
+
+
+class ClockedOutput(object):
+    """
+    Stand-in for a PortAudio output stream: calls the callback once per
+    buffer period from a thread and discards the audio. Used for tests
+    and benchmarks on machines without a sound card.
+    """
+
+    def __init__(self, callback, rate=RATE, frames_per_buffer=FRAMES_PER_BUFFER):
+        self._callback = callback
+        self._period = float(frames_per_buffer) / rate
+        self._frames = frames_per_buffer
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        t0 = time.time()
+        n = 0
+        while not self._stop.is_set():
+            self._callback(None, self._frames, None, 0)
+            n += 1
+            delay = t0 + n * self._period - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+
+    def get_output_latency(self):
+        return 0.0
+
+    def stop_stream(self):
+        self._stop.set()
+        self._thread.join()
+
+    def close(self):
+        pass
+
+
+class EarconPlayer(object):
+    """
+    :param sounds: wav files to decode at startup, played by file name.
+    :param audio: a pyaudio.PyAudio instance to open the stream on, one
+                  is created when omitted.
+    :param device_index: PortAudio output device, None for the default.
+    :param bool simulate: drive the callback with ClockedOutput instead
+                          of a sound card.
+    :param bool keep_open: open the stream now and keep it open, only
+                           when the device is shared with other players.
+    :param float linger: seconds the stream stays open after a sound
+                         when it is not kept open.
+    """
+
+    def __init__(self, sounds=(), audio=None, device_index=None,
+                 rate=RATE, frames_per_buffer=FRAMES_PER_BUFFER,
+                 simulate=False, keep_open=False, linger=LINGER):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.device_index = device_index
+        self.simulate = simulate
+        self.keep_open = keep_open
+        self.linger = linger
+        self._pcm = {}
+        for fname in sounds:
+            self.load(fname)
+        self._lock = threading.Lock()
+        # held while the stream is opened or closed
+        self._stream_lock = threading.Lock()
+        self._current = None
+        self._plays = 0
+        self._silence = b'\x00' * (frames_per_buffer * SAMPLE_WIDTH)
+        self.latency = collections.deque(maxlen=1000)
+        self._audio = None
+        self._own_audio = False
+        self._stream = None
+        if not simulate:
+            import pyaudio
+            self._continue = pyaudio.paContinue
+            if audio is None:
+                audio = pyaudio.PyAudio()
+                self._own_audio = True
+            self._audio = audio
+        if keep_open:
+            self._open()
+
+    def _open(self):
+        "Open the output stream unless it is, with _stream_lock held"
+        if self._stream is not None:
+            return
+        if self.simulate:
+            self._stream = ClockedOutput(self._callback, self.rate,
+                                         self.frames_per_buffer)
+            return
+        audio = self._audio
+        self._stream = audio.open(
+            output=True,
+            format=audio.get_format_from_width(SAMPLE_WIDTH),
+            channels=1,
+            rate=self.rate,
+            frames_per_buffer=self.frames_per_buffer,
+            output_device_index=self.device_index,
+            stream_callback=self._callback)
+
+    def _close_stream(self):
+        "Close the output stream if it is open, with _stream_lock held"
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+
+    def _close_when_idle(self, playback, plays):
+        playback.wait()
+        time.sleep(self.linger)
+        with self._stream_lock:
+            with self._lock:
+                idle = self._current is None and self._plays == plays
+            if idle:
+                self._close_stream()
+
+    def load(self, fname, name=None):
+        """Decode `fname` once, it is played as play(name or fname)"""
+        self._pcm[name or fname] = decode_wave(fname, self.rate)
+
+    def has(self, name):
+        return name in self._pcm
+
+    def duration_ms(self, name):
+        """Length of a loaded sound in ms"""
+        return 1000 * len(self._pcm[name]) // (SAMPLE_WIDTH * self.rate)
+
+    def play(self, name, volume=100):
+        """
+        Start playing a loaded sound at `volume` percent and return its
+        Playback without waiting for the sound. When the output can not
+        be opened the Playback is done at once and `failed`.
+        """
+        pcm = self._pcm[name]
+        if volume < 100:
+            pcm = audioop.mul(pcm, SAMPLE_WIDTH, max(0, volume) / 100.0)
+        playback = Playback(name, pcm)
+        with self._lock:
+            previous = self._current
+            self._current = playback
+            self._plays += 1
+            plays = self._plays
+        if previous is not None:
+            previous._done.set()
+        if self.keep_open:
+            return playback
+        with self._stream_lock:
+            try:
+                self._open()
+            except IOError as e:
+                # the device is busy, e.g. VLC holds it
+                logger.warning('earcon output unavailable: %s' % e)
+                playback.error = e
+                with self._lock:
+                    if self._current is playback:
+                        self._current = None
+                playback._done.set()
+                return playback
+        closer = threading.Thread(target=self._close_when_idle, args=(playback, plays))
+        closer.daemon = True
+        closer.start()
+        return playback
+
+    def stop(self):
+        with self._lock:
+            previous = self._current
+            self._current = None
+        if previous is not None:
+            previous._done.set()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        nbytes = frame_count * SAMPLE_WIDTH
+        with self._lock:
+            playback = self._current
+            if playback is None:
+                out = None
+            else:
+                start = playback.pos
+                out = playback.pcm[start:start + nbytes].tobytes()
+                playback.pos += len(out)
+                if playback.pos >= len(playback.pcm):
+                    self._current = None
+        if out is None:
+            return self._silence[:nbytes], getattr(self, '_continue', 0)
+        if playback.started is None:
+            playback.started = time.time()
+            self.latency.append(playback.started - playback.requested +
+                                self._stream_latency())
+        if len(out) < nbytes:
+            out += self._silence[:nbytes - len(out)]
+        if playback.pos >= len(playback.pcm):
+            playback._done.set()
+        return out, getattr(self, '_continue', 0)
+
+    def _stream_latency(self):
+        stream = getattr(self, '_stream', None)
+        if stream is None:
+            return 0.0
+        return stream.get_output_latency()
+
+    def latency_report(self):
+        """min/median/p95/max of the recorded play latencies in ms"""
+        samples = sorted(self.latency)
+        if not samples:
+            return {}
+        pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+        return {'count': len(samples), 'min_ms': samples[0] * 1000,
+                'median_ms': pick(0.5), 'p95_ms': pick(0.95),
+                'max_ms': samples[-1] * 1000}
+
+    def close(self):
+        self.stop()
+        with self._stream_lock:
+            self._close_stream()
+        if self._own_audio:
+            self._audio.terminate()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# hotword_loop.py --- feeds fixed size audio frames to a hotword detector
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# HotwordDetector used to poll its ring buffer, sleeping 30 ms whenever
+# it was empty, which delayed detections by up to a sleep and woke the
+# process 33 times a second in silence. DetectionLoop blocks in the
+# read() of its source instead: bytering.ByteRing wakes it as soon as
+# the audio callback has delivered a whole frame, and the frame goes to
+# the detector right away.
+#
+#   loop = DetectionLoop(ring, detector.RunDetection, frame_bytes)
+#   index = loop.run()          # hotword index, None once stopped
+#
+# stop() from another thread makes run() return None.
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# audio handed to the detector at a time
+FRAME_MS = 10
+
+
+def frame_bytes(rate, channels=1, sample_width=2, ms=FRAME_MS):
+    return int(rate * ms / 1000) * channels * sample_width
+
+
+class DetectionLoop(object):
+    """
+    :param source: bytering.ByteRing or audiobus.AudioBusReader, anything
+                   with read(nbytes, timeout) returning at most `nbytes`
+                   and b'' when nothing came.
+    :param detect: function taking a frame and returning what
+                   SnowboyDetect.RunDetection does: -2 silence, -1 error,
+                   0 nothing, the index of the hotword from 1 on.
+    :param frame_bytes: bytes in a frame.
+    :param timeout: seconds a read waits before `interrupt_check` is
+                    called again, None to wait for audio or stop(). A
+                    source that can not be woken needs one.
+    """
+
+    def __init__(self, source, detect, frame_bytes, timeout=None):
+        self.source = source
+        self.detect = detect
+        self.frame_bytes = frame_bytes
+        self.timeout = timeout
+        self._stopped = False
+        self.frames = 0
+        self.wakeups = 0
+
+    def run(self, interrupt_check=lambda: False):
+        """
+        Detect until a hotword is found and return its index. Returns None
+        when stop() is called or `interrupt_check` returns True.
+        """
+        self._stopped = False
+        pending = b''
+        while not self._stopped:
+            data = self.source.read(self.frame_bytes - len(pending), self.timeout)
+            self.wakeups += 1
+            if data:
+                pending += data
+            if len(pending) >= self.frame_bytes:
+                frame, pending = pending[:self.frame_bytes], pending[self.frame_bytes:]
+                self.frames += 1
+                ans = self.detect(frame)
+                if ans == -1:
+                    logger.warning("Error initializing streams or reading audio data")
+                elif ans > 0:
+                    return ans
+            if interrupt_check():
+                break
+        return None
+
+    def stop(self):
+        """Make run() return, from any thread"""
+        self._stopped = True
+        wakeup = getattr(self.source, 'wakeup', None)
+        if wakeup is not None:
+            wakeup()
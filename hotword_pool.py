@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+# hotword_pool.py --- hotword detection on several audio sources at once
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# One worker process per audio source, so every microphone gets its own
+# detector and core. A source is named by a spec:
+#
+#   device:<index>    PyAudio input device
+#   bus:<path>        audio bus written by audiobus.py
+#   wav:<path>        16 kHz mono 16-bit wav file played at real time,
+#                     for testing without microphones
+#
+# Workers report every detection with the energy of the audio leading up
+# to it. Several microphones usually hear the same utterance, so the
+# Arbiter collects the detections arriving within `window_ms` of the
+# first one and keeps the loudest, and detections during the following
+# `window_ms` are dropped as echoes of the same utterance:
+#
+#   pool = DetectorPool(['device:1', 'device:2'], SnowboyFactory('snowboy.umdl'))
+#   pool.start()
+#   for detection in pool.detections():
+#       print(detection.source, detection.score)
+#
+# pause() stops the workers listening and releases the devices while the
+# processes and their models stay loaded; resume() listens again.
+
+import audioop
+import collections
+import logging
+import multiprocessing
+import time
+import wave
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import audiobus
+import bytering
+import hotword_loop
+
+logger = logging.getLogger(__name__)
+
+RATE = 16000
+SAMPLE_WIDTH = 2
+# audio whose energy scores a detection
+SCORE_MS = 500
+# seconds a worker waits for audio before checking whether to stop
+IDLE_CHECK = 0.5
+
+Detection = collections.namedtuple(
+    'Detection', 'source hotword score time offset preroll')
+
+
+class SnowboyFactory(object):
+    """
+    Builds a SnowboyDetect in the worker process; snowboydetect is only
+    imported there.
+    """
+
+    def __init__(self, model, resource=None, sensitivity=None, audio_gain=1):
+        self.model = model
+        self.resource = resource
+        self.sensitivity = sensitivity
+        self.audio_gain = audio_gain
+
+    def __call__(self):
+        import snowboydetect
+        model = self.model
+        if isinstance(model, list):
+            model = ','.join(model)
+        detector = snowboydetect.SnowboyDetect(resource_filename=self.resource,
+                                               model_str=str(model))
+        detector.SetAudioGain(self.audio_gain)
+        if self.sensitivity is not None:
+            detector.SetSensitivity(','.join([str(self.sensitivity)] *
+                                             detector.NumHotwords()))
+        return detector
+
+
+class WaveSource(object):
+    """
+    A wav file read at the pace it was recorded, starting at the time
+    `start_at`. `eof` is set once it is all read.
+    """
+
+    def __init__(self, fname, start_at=None, realtime=True):
+        wf = wave.open(fname, 'rb')
+        try:
+            if (wf.getframerate(), wf.getnchannels(), wf.getsampwidth()) != \
+                    (RATE, 1, SAMPLE_WIDTH):
+                raise ValueError('%s is not 16 kHz mono 16-bit' % fname)
+            self._data = wf.readframes(wf.getnframes())
+        finally:
+            wf.close()
+        self._pos = 0
+        self._start = start_at
+        self.realtime = realtime
+        self.eof = False
+
+    def read(self, nbytes, timeout=None):
+        if self._start is None:
+            self._start = time.time()
+        if self._pos >= len(self._data):
+            self.eof = True
+            return b''
+        data = self._data[self._pos:self._pos + nbytes]
+        if self.realtime:
+            delay = (self._start + float(self._pos + len(data)) /
+                     (RATE * SAMPLE_WIDTH) - time.time())
+            if delay > 0:
+                time.sleep(delay)
+        self._pos += len(data)
+        return data
+
+    def pause(self):
+        pass
+
+    def resume(self):
+        """Skip what was played while paused, like a live microphone"""
+        if self._start is None or not self.realtime:
+            return
+        due = int((time.time() - self._start) * RATE) * SAMPLE_WIDTH
+        self._pos = max(self._pos, min(due, len(self._data)))
+
+    def close(self):
+        pass
+
+
+class DeviceSource(object):
+    """Input-only PyAudio stream of one device into a ByteRing"""
+
+    def __init__(self, device_index, frames_per_buffer=1024):
+        import pyaudio
+        self.ring = bytering.ByteRing(RATE * SAMPLE_WIDTH * 5)
+
+        def audio_callback(in_data, frame_count, time_info, status):
+            self.ring.extend(in_data)
+            return None, pyaudio.paContinue
+
+        self._audio_callback = audio_callback
+        self._device_index = device_index
+        self._frames_per_buffer = frames_per_buffer
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._open()
+
+    def _open(self):
+        import pyaudio
+        return self._audio.open(input=True, format=pyaudio.paInt16,
+                                channels=1, rate=RATE,
+                                input_device_index=self._device_index,
+                                frames_per_buffer=self._frames_per_buffer,
+                                stream_callback=self._audio_callback)
+
+    def read(self, nbytes, timeout=None):
+        return self.ring.read(nbytes, timeout)
+
+    def pause(self):
+        """Close the stream so others can open the device, PyAudio stays"""
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+
+    def resume(self):
+        self.ring.clear()
+        if self._stream is None:
+            self._stream = self._open()
+
+    def close(self):
+        self.pause()
+        self._audio.terminate()
+
+
+def open_source(spec, start_at=None):
+    kind, _, arg = spec.partition(':')
+    if kind == 'wav':
+        return WaveSource(arg, start_at)
+    if kind == 'bus':
+        return audiobus.AudioBusReader(arg)
+    if kind == 'device':
+        return DeviceSource(int(arg) if arg else None)
+    raise ValueError('unknown audio source %r' % spec)
+
+
+class Arbiter(object):
+    """
+    Picks one detection out of those of the sources that heard the same
+    utterance: the highest score among the detections within `window_ms`
+    of the first. The window closes early once all `sources` reported.
+    """
+
+    def __init__(self, window_ms=300, sources=None):
+        self.window = window_ms / 1000.0
+        self.sources = sources
+        self._pending = []
+        self._deadline = None
+        self._quiet_until = 0
+        # the detections the last winner was picked from
+        self.candidates = []
+        self.dropped = 0
+
+    def offer(self, detection):
+        if detection.time < self._quiet_until:
+            self.dropped += 1
+            return
+        if self._deadline is None:
+            self._deadline = detection.time + self.window
+        self._pending.append(detection)
+        if self.sources and len(set(d.source for d in self._pending)) >= self.sources:
+            self._deadline = min(self._deadline, detection.time)
+
+    def timeout(self, now):
+        """Seconds until a decision is due, None when nothing is pending"""
+        if self._deadline is None:
+            return None
+        return max(0, self._deadline - now)
+
+    def decide(self, now):
+        """The winning detection once its window has closed, else None"""
+        if self._deadline is None or now < self._deadline:
+            return None
+        winner = max(self._pending, key=lambda d: d.score)
+        self._quiet_until = self._deadline + self.window
+        self.candidates, self._pending = self._pending, []
+        self._deadline = None
+        return winner
+
+
+def _preroll_reference(source, ring, preroll_ms, preroll_file):
+    "Where the recognizer finds the audio before the detection point"
+    if isinstance(source, audiobus.AudioBusReader):
+        start = source.position - source.ms_to_bytes(preroll_ms)
+        return 'bus:%d' % max(start, 0)
+    if preroll_file and ring.preroll_bytes:
+        with open(preroll_file, 'wb') as f:
+            f.write(ring.preroll())
+        return 'file:%s' % preroll_file
+    return None
+
+
+def _worker(source_id, spec, factory, detections, stop, listening, paused,
+            start_at, preroll_ms, preroll_file):
+    source = open_source(spec, start_at)
+    detector = factory()
+    frame = hotword_loop.frame_bytes(RATE)
+    energy = collections.deque(maxlen=max(1, SCORE_MS // hotword_loop.FRAME_MS))
+    # keeps the audio before the detection point
+    ring = bytering.ByteRing(frame, RATE * SAMPLE_WIDTH * preroll_ms // 1000)
+    offset = [0]
+
+    def detect(data):
+        energy.append(audioop.rms(data, SAMPLE_WIDTH))
+        offset[0] += len(data)
+        ring.extend(data)
+        ring.get()
+        return detector.RunDetection(data)
+
+    def finished():
+        if isinstance(source, audiobus.AudioBusReader) and not source.writer_alive():
+            logger.warning("audio bus of source %s stopped", source_id)
+            return True
+        return (stop.is_set() or not listening.is_set() or
+                getattr(source, 'eof', False))
+
+    loop = hotword_loop.DetectionLoop(source, detect, frame, IDLE_CHECK)
+    try:
+        while not stop.is_set():
+            if not listening.is_set():
+                if not isinstance(source, audiobus.AudioBusReader):
+                    source.pause()
+                paused.release()
+                while not listening.wait(IDLE_CHECK):
+                    if stop.is_set():
+                        return
+                if isinstance(source, audiobus.AudioBusReader):
+                    source.seek(source.written)
+                else:
+                    source.resume()
+                detector.Reset()
+                energy.clear()
+                ring.clear()
+                continue
+            ans = loop.run(finished)
+            if ans is None:
+                if not listening.is_set():
+                    continue
+                break
+            detections.put(Detection(source_id, ans, sum(energy) / len(energy),
+                                     time.time(), offset[0],
+                                     _preroll_reference(source, ring, preroll_ms, preroll_file)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+
+
+class DetectorPool(object):
+    """
+    :param sources: source specs, their position is the source id unless
+                    `ids` names them.
+    :param factory: picklable callable building a detector with the
+                    RunDetection() of SnowboyDetect, called in the worker.
+    :param window_ms: arbitration window.
+    :param preroll_ms: audio before a detection kept for the recognizer.
+    :param preroll_file: prefix of the files the pre-roll is written to,
+                         one per source.
+    """
+
+    def __init__(self, sources, factory, window_ms=300, ids=None,
+                 preroll_ms=0, preroll_file=None):
+        self.sources = list(sources)
+        self.ids = list(ids or [str(i) for i in range(len(self.sources))])
+        self.factory = factory
+        self.preroll_ms = preroll_ms
+        self.preroll_file = preroll_file
+        self.arbiter = Arbiter(window_ms, len(self.sources))
+        self._queue = multiprocessing.Queue()
+        self._stop = multiprocessing.Event()
+        self._listening = multiprocessing.Event()
+        # released by every worker that paused its source
+        self._paused = multiprocessing.Semaphore(0)
+        self._workers = []
+
+    def start(self, start_at=None):
+        """Start a worker per source; wav sources all start at `start_at`"""
+        self._stop.clear()
+        self._listening.set()
+        for source_id, spec in zip(self.ids, self.sources):
+            preroll = None
+            if self.preroll_file:
+                preroll = '%s.%s' % (self.preroll_file, source_id)
+            p = multiprocessing.Process(target=_worker, name='hotword-%s' % source_id,
+                                        args=(source_id, spec, self.factory,
+                                              self._queue, self._stop,
+                                              self._listening, self._paused,
+                                              start_at, self.preroll_ms, preroll))
+            p.daemon = True
+            p.start()
+            self._workers.append(p)
+
+    def pause(self, timeout=2.0):
+        """
+        Stop listening and wait until the workers released their devices;
+        the processes and their models stay loaded for resume().
+        """
+        self._listening.clear()
+        deadline = time.time() + timeout
+        for p in self._workers:
+            if p.is_alive():
+                self._paused.acquire(True, max(0, deadline - time.time()))
+
+    def resume(self):
+        """Listen again after pause(), dropping detections from before"""
+        while self._paused.acquire(False):
+            pass
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._listening.set()
+
+    @property
+    def paused(self):
+        return bool(self._workers) and not self._listening.is_set()
+
+    def alive(self):
+        return any(p.is_alive() for p in self._workers)
+
+    def all_alive(self):
+        return bool(self._workers) and all(p.is_alive() for p in self._workers)
+
+    def detections(self):
+        """
+        Yield the winning detections until stop() or until every worker
+        is gone and nothing is pending.
+        """
+        arbiter = self.arbiter
+        while not self._stop.is_set():
+            timeout = arbiter.timeout(time.time())
+            if timeout is None:
+                if not self.alive() and self._queue.empty():
+                    return
+                timeout = IDLE_CHECK
+            try:
+                arbiter.offer(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                pass
+            winner = arbiter.decide(time.time())
+            if winner is not None:
+                yield winner
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        for p in self._workers:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._workers = []
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# memory_media.py --- play audio held in memory with VLC
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# VLC opens "fd://N" like any other MRL, so audio that only exists in
+# memory is handed to it through a pipe: a small writer thread pushes the
+# bytes into the write end while VLC reads the other one. Data can be
+# appended with write() while VLC is already playing, which lets the
+# player start before the whole payload has arrived.
+
+import os
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# largest single os.write(), keeps the writer responsive to close()
+WRITE_SIZE = 16384
+
+
+class MemoryMedia(object):
+    """
+    A pipe VLC can read `data` from.
+
+    :param data: bytes or memoryview to play. When given, the media is
+                 finished right away, otherwise call write() and finish().
+    """
+
+    def __init__(self, data=None):
+        self._read_fd, self._write_fd = os.pipe()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        if data is not None:
+            self.write(data)
+            self.finish()
+
+    @property
+    def mrl(self):
+        return 'fd://%d' % self._read_fd
+
+    def write(self, data):
+        """Queue more bytes for the player"""
+        if len(data):
+            self._queue.put(data)
+
+    def finish(self):
+        """No more data will be written, VLC sees end of file after it"""
+        self._queue.put(None)
+
+    def _run(self):
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
+                view = memoryview(data)
+                while len(view) and not self._closed:
+                    n = os.write(self._write_fd, view[:WRITE_SIZE])
+                    view = view[n:]
+        except OSError:
+            # the player closed its end early (stopped or skipped)
+            pass
+        finally:
+            os.close(self._write_fd)
+
+    def close(self):
+        """Release the pipe once the player is done with it"""
+        if self._closed:
+            return
+        self._closed = True
+        self.finish()
+        os.close(self._read_fd)
@@ -33,8 +33,21 @@ from os.path import exists
 from array import array
 from struct import unpack, pack
 
+import audio_dsp
+import audio_scheduler
+import audiobus
+import avs_http
+import avs_multipart
+import avs_token
+import earcon
+import memory_media
+import playback_reporter
+import station_index
 import tunein
+import vad_endpoint
+import vlc_player
 import webrtcvad
+import workpool
 
 coding = 'utf8'
 
@@ -50,6 +63,19 @@ THRESHOLD = 4000
 CHUNK_SIZE = 1024
 MAX_NUM_SLIENT = 20
 
+# upload audio to AVS while it is being recorded instead of going
+# through recording.wav
+STREAMING_RECOGNIZE = True
+AVS_URL = os.environ.get('AVS_URL', 'https://access-alexa-na.amazon.com')
+# bytes read at a time from AVS responses
+RESPONSE_CHUNK_SIZE = 4096
+# keep-alive connections shared by all AVS calls, timeouts in seconds
+AVS_POOL_SIZE = 4
+AVS_CONNECT_TIMEOUT = 5
+AVS_READ_TIMEOUT = 30
+# renew the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 300
+
 servers = ["127.0.0.1:11211"]
 mc = Client(servers, debug=1)
 path = os.path.realpath(__file__).rstrip(os.path.basename(__file__))
@@ -63,7 +89,18 @@ position = 0
 audioplaying = False
 button_pressed = False
 start = time.time()
-tunein_parser = tunein.TuneIn(5000)
+# TuneIn lookups are kept on disk too, so a restart starts warm; next to
+# the plugin (ignored by git) unless $MMDAGENT_TUNEIN_CACHE names a file
+TUNEIN_CACHE_FILE = os.environ.get('MMDAGENT_TUNEIN_CACHE',
+                                   os.path.join(path, "tunein_cache.db"))
+# stations seen in TuneIn results, searched locally before Search.ashx;
+# next to the plugin (ignored by git) unless $MMDAGENT_TUNEIN_INDEX names
+# a file
+TUNEIN_INDEX_FILE = os.environ.get('MMDAGENT_TUNEIN_INDEX',
+                                   os.path.join(path, "tunein_stations.db"))
+tunein_parser = tunein.TuneIn(5000, cache=tunein.make_cache(TUNEIN_CACHE_FILE),
+                              index=station_index.StationIndex(TUNEIN_INDEX_FILE))
+avs = avs_http.AVSSession(AVS_URL, AVS_POOL_SIZE, AVS_CONNECT_TIMEOUT, AVS_READ_TIMEOUT)
 vad = webrtcvad.Vad(2)
 currVolume = 100
 
@@ -71,36 +108,79 @@ currVolume = 100
 VAD_SAMPLERATE = 16000
 VAD_FRAME_MS = 30
 VAD_PERIOD = (VAD_SAMPLERATE / 1000) * VAD_FRAME_MS
-VAD_SILENCE_TIMEOUT = 1000
+# trailing non-speech in ms that ends an utterance (end-of-speech latency)
+VAD_SILENCE_TIMEOUT = 600
+# live frames never counted as speech, at least as many as the ding lasts
 VAD_THROWAWAY_FRAMES = 10
+# 'vad' or 'amplitude' (the THRESHOLD / MAX_NUM_SLIENT test)
+ENDPOINTER = 'vad'
 MAX_RECORDING_LENGTH = 6
+# the sources mmdagent_snowboy.py listens to (see hotword_pool.py), the
+# source in SNOWBOY_EVENT_DETECT is an index into them and is recorded
+# from. wav: sources and no source record from the default device
+HOTWORD_SOURCES = [spec for spec in
+                   os.environ.get('MMDAGENT_HOTWORD_SOURCES', '').split(',') if spec]
 MAX_VOLUME = 100
 MIN_VOLUME = 30
 
 TOP_DIR = os.path.dirname(os.path.abspath(__file__))
 DETECT_DING = os.path.join(TOP_DIR, "resources/ding.wav")
 DETECT_DONG = os.path.join(TOP_DIR, "resources/dong.wav")
+DETECT_BEEP = os.path.join(TOP_DIR, "beep.wav")
+
+# one VLC instance and a few reusable players for the whole process
+VLC_ARGS = ('--aout=alsa', '--alsa-audio-device=plughw:0,0')  # , '--alsa-audio-device=mono', '--file-logging', '--logfile=vlc-log.txt')
+VLC_POOL_SIZE = 2
+player_service = vlc_player.PlayerService(VLC_ARGS, VLC_POOL_SIZE)
+# ding, dong and beep are decoded once and played on a PortAudio stream
+# that is only open while they play, VLC's plughw device can not be
+# shared. Every sound then waits for PortAudio to open the device, and
+# is not played at all while VLC holds it. With both on a shareable
+# device (dmix/pulse) EARCON_KEEP_OPEN leaves the stream open and the
+# ding starts within one output buffer.
+EARCONS = (DETECT_DING, DETECT_DONG, DETECT_BEEP)
+EARCON_DEVICE = None
+EARCON_KEEP_OPEN = False
+# threads resolving queued AudioPlayer streams and fetching next items,
+# and calls allowed to wait for one of them
+AUDIO_WORKERS = 2
+AUDIO_WORK_QUEUE = 16
+# ask for the next AudioPlayer item this long before the current one
+# ends, 0 to ask when it has ended
+NEXT_ITEM_LEAD_MS = 8000
+# AudioPlayer events waiting to be sent, seconds before the first retry
+PLAYBACK_EVENT_QUEUE = 64
+PLAYBACK_EVENT_RETRY = 0.5
 
 interrupted = False
 def interrupt_callback():
     global interrupted
     return interrupted
 
+def refresh_access_token():
+    "Exchange the refresh token for a new access token, returns (token, expires_in)"
+    payload = {"client_id": Client_ID, "client_secret": Client_Secret, "refresh_token": refresh_token,
+               "grant_type": "refresh_token",}
+    url = "https://api.amazon.com/auth/o2/token"
+    r = avs.post(url, data=payload)
+    r.raise_for_status()
+    resp = json.loads(r.text)
+    return resp['access_token'], resp.get('expires_in', 3600)
+
+# memcached is only a tier shared with other processes, the token lives here
+token_manager = avs_token.TokenManager(refresh_access_token, mc, margin=TOKEN_REFRESH_MARGIN)
+
+def source_spec(source):
+    "hotword_pool spec of the source with id `source`, or None"
+    try:
+        return HOTWORD_SOURCES[int(source)]
+    except (TypeError, ValueError, IndexError):
+        return None
+
 def gettoken():
-    token = mc.get("access_token")
-    refresh = refresh_token
-    if token:
-        return token
-    elif refresh:
-        payload = {"client_id": Client_ID, "client_secret": Client_Secret, "refresh_token": refresh,
-                   "grant_type": "refresh_token",}
-        url = "https://api.amazon.com/auth/o2/token"
-        r = requests.post(url, data=payload)
-        resp = json.loads(r.text)
-        mc.set("access_token", resp['access_token'], 3570)
-        return resp['access_token']
-    else:
+    if not refresh_token:
         return False
+    return token_manager.get()
 
 class Alexa:
 
@@ -108,56 +188,142 @@ class Alexa:
         self.__running = True
         self._model = 'snowboy.umdl'
         self._pin = pyaudio.PyAudio() 
+        self._earcons = earcon.EarconPlayer(EARCONS, self._pin, EARCON_DEVICE,
+                                            keep_open=EARCON_KEEP_OPEN)
+        # the ding plays while capture runs, the endpointer must not take
+        # it for speech
+        ding_frames = -(-self._earcons.duration_ms(DETECT_DING) // VAD_FRAME_MS)
+        self._throwaway_frames = max(VAD_THROWAWAY_FRAMES, ding_frames)
+        # audio parts of AVS responses by Content-ID, until they are played
+        self._content = {}
+        # speak threads started before the response was fully downloaded,
+        # with the media they play, by Content-ID
+        self._speaking = {}
+        # AudioPlayer streams, played one at a time in directive order
+        self._player = None
+        self._pool = workpool.WorkerPool(AUDIO_WORKERS, AUDIO_WORK_QUEUE, 'audio')
+        self._scheduler = audio_scheduler.AudioScheduler(
+            self.play_item, self.stop_audio, self.resolve_stream,
+            self.playlist_idle, self._pool, self.playback_remaining,
+            NEXT_ITEM_LEAD_MS, self.drop_item)
+        self._reporter = playback_reporter.PlaybackReporter(
+            self.alexa_playback_progress_report_request, self.playback_offset,
+            PLAYBACK_EVENT_QUEUE, PLAYBACK_EVENT_RETRY)
         
     def __clear(self):
         self.__running = False
 
     def is_silent(self, L):
         "Returns `True` if below the 'silent' threshold"
-        return max(L) < THRESHOLD
+        return audio_dsp.is_silent(L, THRESHOLD)
 
     def normalize(self, L):
         "Average the volume out"
-        MAXIMUM = 16384
-        times = float(MAXIMUM)/max(abs(i) for i in L)
-
-        LRtn = array('h')
-        for i in L:
-            LRtn.append(int(i*times))
-        return LRtn
+        return audio_dsp.normalize(L)
 
     def trim(self, L):
         "Trim the blank spots at the start and end"
-        # Trim to the left
-        L = self._trim(L)
-
-        # Trim to the right
-        L.reverse()
-        L = self._trim(L)
-        L.reverse()
-        return L
-
-    def _trim(self,L):
-        snd_started = False
-        LRtn = array('h')
-
-        for i in L:
-            if not snd_started and abs(i)>THRESHOLD:
-                snd_started = True
-                LRtn.append(i)
-
-            elif snd_started:
-                LRtn.append(i)
-        return LRtn
+        return audio_dsp.trim(L, THRESHOLD)
 
     def add_silence(self, L, seconds):
         "Add silence to the start and end of `L` of length `seconds` (float)"
-        LRtn = array('h', [0 for i in xrange(int(seconds*RATE))])
-        LRtn.extend(L)
-        LRtn.extend([0 for i in xrange(int(seconds*RATE))])
-        return LRtn
-
-    def record(self, p):
+        return audio_dsp.add_silence(L, seconds, RATE)
+
+    def new_endpointer(self):
+        if ENDPOINTER == 'vad':
+            return vad_endpoint.VadEndpointer(vad, rate=VAD_SAMPLERATE,
+                                              frame_ms=VAD_FRAME_MS,
+                                              silence_timeout=VAD_SILENCE_TIMEOUT,
+                                              throwaway_frames=self._throwaway_frames,
+                                              threshold=THRESHOLD)
+        return vad_endpoint.AmplitudeEndpointer(RATE, CHUNK_SIZE, THRESHOLD,
+                                                MAX_NUM_SLIENT)
+
+    def record_stream(self, p, preroll=None, source=None):
+        """
+        Record a word or words from the microphone and yield the
+        raw little endian PCM data chunk by chunk as it is read.
+
+        The generator stops as soon as the endpointer detects the end
+        of the utterance or MAX_RECORDING_LENGTH is reached, so it can
+        be consumed directly by a chunked upload.
+
+        `preroll` is the reference sent with SNOWBOY_EVENT_DETECT: with
+        "bus:<offset>" capture starts at that audio bus offset, with
+        "file:<path>" the raw PCM in that file is sent first. The pre-roll
+        holds the hotword and goes to AVS only, the endpointer and
+        MAX_RECORDING_LENGTH start with the live audio.
+
+        `source` is the id of the hotword source that heard the hotword,
+        its device or audio bus is recorded from; the pre-roll reference
+        is one of that source.
+        """
+        endpointer = self.new_endpointer()
+        frames = endpointer.frame_samples
+        max_frames = int(float(RATE)/frames * MAX_RECORDING_LENGTH)
+
+        kind, _, arg = (source_spec(source) or '').partition(':')
+        device_index = None
+        if kind == 'bus':
+            bus_path = audiobus.live_path(arg)
+        elif kind == 'device' and arg:
+            bus_path = None
+            device_index = int(arg)
+        else:
+            bus_path = audiobus.configured_path()
+        head = b''
+        if bus_path:
+            offset = None
+            if preroll and preroll.startswith('bus:'):
+                offset = int(preroll[4:])
+            stream = audiobus.BusInputStream(bus_path, offset)
+            # what was captured before we got here is the pre-roll
+            preroll_bytes = max(0, stream.reader.available())
+        else:
+            if preroll and preroll.startswith('file:') and exists(preroll[5:]):
+                with open(preroll[5:], 'rb') as f:
+                    head = f.read()
+            # input only: the ding plays on the earcon stream meanwhile
+            # and nothing is ever written to an output side
+            stream = p.open(format=FORMAT, channels=1, rate=RATE, input=True,
+                            input_device_index=device_index, frames_per_buffer=frames)
+            preroll_bytes = len(head) - len(head) % endpointer.frame_bytes
+
+        def frames_read():
+            step = endpointer.frame_bytes
+            for i in range(0, len(head) - step + 1, step):
+                yield head[i:i + step]
+            while True:
+                data = stream.read(frames)
+                if len(data) < step:
+                    # only the audio bus reads short, when its capture
+                    # daemon stopped: end the recording with what we have
+                    self.emit_message("RECORD_ERROR", "audio bus stopped")
+                    return
+                yield data
+
+        live_frames = 0
+        try:
+            for data in frames_read():
+                yield data
+                if preroll_bytes > 0:
+                    preroll_bytes -= len(data)
+                    continue
+
+                if endpointer.feed(data):
+                    self.emit_message("RECORD_END")
+                    break
+                live_frames += 1
+                if live_frames >= max_frames:
+                    break
+        finally:
+            stream.stop_stream()
+            stream.close()
+            # speech length and trailing non-speech captured, in ms
+            self.emit_message("ENDPOINT", "%d,%d" % (endpointer.speech_ms,
+                                                     endpointer.trailing_ms))
+
+    def record(self, p, preroll=None, source=None):
         """
         Record a word or words from the microphone and 
         return the data as an array of signed shorts.
@@ -167,51 +333,18 @@ class Alexa:
         blank sound to make sure VLC et al can play 
         it without getting chopped off.
         """
-        num_silent = 0
-        snd_started = False
-
-        LRtn = array('h')
-
-        stream = p.open(format=FORMAT, channels=1, rate=RATE, input=True, output=True, frames_per_buffer=CHUNK_SIZE)
-        #while 1:
-        for i in range(0, int(RATE/CHUNK_SIZE * MAX_RECORDING_LENGTH)):
-            data = stream.read(CHUNK_SIZE)
-            L = unpack('<' + ('h'*(len(data)/2)), data) # little endian, signed short
-            L = array('h', L)
-            LRtn.extend(L)
-
-            #stdout.write('\r' + str(max(L)) + '     ' + str(num_silent) + '   ')
-            #stdout.flush()
-
-            silent = self.is_silent(L)
-            #print silent, num_silent, L[:10]
-            if not silent:
-                num_silent = 0
-
-            if silent and snd_started:
-                num_silent += 1
-            elif not silent and not snd_started:
-                snd_started = True
-                #stdout.write(str('\r\t\t\trecording     '))
-                #stdout.flush()
-
-            if snd_started and num_silent > MAX_NUM_SLIENT:
-                self.emit_message("RECORD_END")
-                break
-
-        stream.stop_stream()
-        stream.close()
+        LRtn = b''.join(self.record_stream(p, preroll, source))
 
         #LRtn = normalize(LRtn)
         LRtn = self.trim(LRtn)
         LRtn = self.add_silence(LRtn, 0.5)
         return LRtn
 
-    def record_to_wave(self, path, p):
+    def record_to_wave(self, path, p, preroll=None, source=None):
         "Records from the microphone and outputs the resulting data to `path`"
-        data = self.record(p)
+        data = self.record(p, preroll, source)
         sample_width = p.get_sample_size(FORMAT)        
-        data = pack('<' + ('h'*len(data)), *data)
+        data = audio_dsp.to_bytes(data)
 
         wf = wave.open(path, 'wb')
         wf.setnchannels(1)
@@ -224,7 +357,7 @@ class Alexa:
         "Records from the microphone and outputs the resulting data to `path`"
         data = self.record(p)
         sample_width = p.get_sample_size(FORMAT)        
-        data = pack('<' + ('h'*len(data)), *data)
+        data = audio_dsp.to_bytes(data)
         bf = open('data.txt','wb')
         bf.write(data)
         bf.close()
@@ -264,11 +397,8 @@ class Alexa:
             print(('ALEXA_EVENT_%s' % type).encode(coding))
         sys.stdout.flush()
 
-    def alexa_speech_recognizer(self):
-        # https://developer.amazon.com/public/solutions/alexa/alexa-voice-service/rest/speechrecognizer-requests
-        url = 'https://access-alexa-na.amazon.com/v1/avs/speechrecognizer/recognize'
-        headers = {'Authorization': 'Bearer %s' % gettoken()}
-        d = {
+    def recognize_metadata(self):
+        return {
             "messageHeader": {
                 "deviceContext": [
                     {
@@ -285,46 +415,65 @@ class Alexa:
             "messageBody": {
                 "profile": "alexa-close-talk",
                 "locale": "en-us",
-                "format": "audio/L16; rate=16000; channels=1"
+                "format": avs_multipart.RECOGNIZE_AUDIO_TYPE
             }
         }
+
+    def alexa_speech_recognizer(self):
+        # https://developer.amazon.com/public/solutions/alexa/alexa-voice-service/rest/speechrecognizer-requests
+        url = '/v1/avs/speechrecognizer/recognize'
+        headers = {'Authorization': 'Bearer %s' % gettoken()}
+        d = self.recognize_metadata()
         with open(path + WAVE_OUTPUT_FILENAME) as inf:
             files = [
                 ('file', ('request', json.dumps(d), 'application/json; charset=UTF-8')),
-                ('file', ('audio', inf, 'audio/L16; rate=16000; channels=1'))
+                ('file', ('audio', inf, avs_multipart.RECOGNIZE_AUDIO_TYPE))
             ]
-            r = requests.post(url, headers=headers, files=files)
+            r = avs.post(url, headers=headers, files=files, stream=True)
+        self.process_response(r)
+
+    def alexa_speech_recognizer_stream(self, preroll=None, source=None):
+        "Send the microphone audio to AVS while it is being recorded"
+        url = '/v1/avs/speechrecognizer/recognize'
+        boundary = avs_multipart.new_boundary()
+        headers = {'Authorization': 'Bearer %s' % gettoken(),
+                   'Content-Type': avs_multipart.recognize_content_type(boundary)}
+        # a generator body makes requests use chunked transfer encoding, the
+        # request is finished as soon as record_stream() hits the end of speech
+        body = avs_multipart.recognize_body(boundary, self.recognize_metadata(),
+                                            self.record_stream(self._pin, preroll, source))
+        r = avs.post(url, headers=headers, data=body, stream=True)
         self.process_response(r)
 
 
     def alexa_getnextitem(self,nav_token):
         # https://developer.amazon.com/public/solutions/alexa/alexa-voice-service/rest/audioplayer-getnextitem-request
-        time.sleep(0.5)
-        if audioplaying == False:
-            url = 'https://access-alexa-na.amazon.com/v1/avs/audioplayer/getNextItem'
-            headers = {'Authorization': 'Bearer %s' % gettoken(), 'content-type': 'application/json; charset=UTF-8'}
-            d = {
-                "messageHeader": {},
-                "messageBody": {
-                    "navigationToken": nav_token
-                }
+        # called by the scheduler, usually while the current item still plays
+        url = '/v1/avs/audioplayer/getNextItem'
+        headers = {'Authorization': 'Bearer %s' % gettoken(), 'content-type': 'application/json; charset=UTF-8'}
+        d = {
+            "messageHeader": {},
+            "messageBody": {
+                "navigationToken": nav_token
             }
-            r = requests.post(url, headers=headers, data=json.dumps(d))
-            self.process_response(r)
+        }
+        r = avs.post(url, headers=headers, data=json.dumps(d), stream=True)
+        self.process_response(r)
 
 
-    def alexa_playback_progress_report_request(self,requestType, playerActivity, streamid):
+    def alexa_playback_progress_report_request(self,requestType, playerActivity, streamid, offset=0):
         # https://developer.amazon.com/public/solutions/alexa/alexa-voice-service/rest/audioplayer-events-requests
         # streamId                  Specifies the identifier for the current stream.
         # offsetInMilliseconds      Specifies the current position in the track, in milliseconds.
         # playerActivity            IDLE, PAUSED, or PLAYING
-        headers = {'Authorization': 'Bearer %s' % self.gettoken()}
+        # called by the playback reporter, returns False to have it retried
+        headers = {'Authorization': 'Bearer %s' % gettoken()}
         d = {
             "messageHeader": {},
             "messageBody": {
                 "playbackState": {
                     "streamId": streamid,
-                    "offsetInMilliseconds": 0,
+                    "offsetInMilliseconds": offset,
                     "playerActivity": playerActivity.upper()
                 }
             }
@@ -332,31 +481,44 @@ class Alexa:
 
         if requestType.upper() == "ERROR":
             # The Playback Error method sends a notification to AVS that the audio player has experienced an issue during playback.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackError"
+            url = '/v1/avs/audioplayer/playbackError'
         elif requestType.upper() == "FINISHED":
             # The Playback Finished method sends a notification to AVS that the audio player has completed playback.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackFinished"
+            url = '/v1/avs/audioplayer/playbackFinished'
         elif requestType.upper() == "IDLE":
             # The Playback Idle method sends a notification to AVS that the audio player has reached the end of the playlist.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackIdle"
+            url = '/v1/avs/audioplayer/playbackIdle'
         elif requestType.upper() == "INTERRUPTED":
             # The Playback Interrupted method sends a notification to AVS that the audio player has been interrupted.
             # Note: The audio player may have been interrupted by a previous stop Directive.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackInterrupted"
+            url = '/v1/avs/audioplayer/playbackInterrupted'
         elif requestType.upper() == "PROGRESS_REPORT":
             # The Playback Progress Report method sends a notification to AVS with the current state of the audio player.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackProgressReport"
+            url = '/v1/avs/audioplayer/playbackProgressReport'
         elif requestType.upper() == "STARTED":
             # The Playback Started method sends a notification to AVS that the audio player has started playing.
-            url = "https://access-alexa-na.amazon.com/v1/avs/audioplayer/playbackStarted"
+            url = '/v1/avs/audioplayer/playbackStarted'
 
-        r = requests.post(url, headers=headers, data=json.dumps(d))
+        r = avs.post(url, headers=headers, data=json.dumps(d))
+        r.close()
         if r.status_code != 204:
-            print("{}(alexa_playback_progress_report_request Response){} {}".format(bcolors.WARNING, bcolors.ENDC, r))
-        else:
-            if debug: print(
-                "{}Playback Progress Report was {}Successful!{}".format(bcolors.OKBLUE, bcolors.OKGREEN, bcolors.ENDC))
+            self.emit_message("PLAYBACK_REPORT_ERROR", "%s|%s" % (requestType.upper(), r.status_code))
+            return False
+        return True
+
+
+    def first_speak_cid(self, j):
+        "Content-ID of the audio of the first speak directive in `j`"
+        for directive in j['messageBody'].get('directives', []):
+            if directive['namespace'] == 'SpeechSynthesizer' and directive['name'] == 'speak':
+                return directive['payload']['audioContent'][len("cid:"):]
+        return None
 
+    def discard_content(self, cid):
+        "Free the audio part `cid` of a response that will not be played"
+        media = self._content.pop(cid, None)
+        if isinstance(media, memory_media.MemoryMedia):
+            media.close()
 
     def process_response(self,r):
         global nav_token, streamurl, streamid, currVolume, isMute
@@ -364,126 +526,256 @@ class Alexa:
         streamurl = ""
         streamid = ""
         if r.status_code == 200:
-            data = "Content-Type: " + r.headers['content-type'] + '\r\n\r\n' + r.content
-            msg = email.message_from_string(data)
-            for payload in msg.get_payload():
-                if payload.get_content_type() == "application/json":
-                    j = json.loads(payload.get_payload())
-                    self.emit_message("JSON",json.dumps(j))
-                elif payload.get_content_type() == "audio/mpeg":
-                    filename = path + "tmpcontent/" + payload.get('Content-ID').strip("<>") + ".mp3"
-                    with open(filename, 'wb') as f:
-                        f.write(payload.get_payload())
-                else:
-                    self.emit_message("NEW_CONTENT_TYPE",payload.get_content_type())
-            # Now process the response
-            if 'directives' in j['messageBody']:
-                for directive in j['messageBody']['directives']:
-                    if directive['namespace'] == 'SpeechSynthesizer':
-                        if directive['name'] == 'speak':
-                            self.play_audio(path + "tmpcontent/" + directive['payload']['audioContent'].lstrip("cid:") + ".mp3")
-                        for directive in j['messageBody']['directives']:  # if Alexa expects a response
-                            if directive[
-                                'namespace'] == 'SpeechRecognizer':  # this is included in the same string as above if a response was expected
-                                if directive['name'] == 'listen':
-                                    self.play_audio(path + 'beep.wav', 0, 100)
-                                    timeout = directive['payload']['timeoutIntervalInMillis'] / 116
-                                    # listen until the timeout from Alexa
-                                    self.silence_listener(timeout)
-                                    # now process the response
-                                    self.alexa_speech_recognizer()
-                    elif directive['namespace'] == 'AudioPlayer':
-                        # do audio stuff - still need to honor the playBehavior
-                        if directive['name'] == 'play':
-                            nav_token = directive['payload']['navigationToken']
-                            for stream in directive['payload']['audioItem']['streams']:
-                                if stream['progressReportRequired']:
-                                    streamid = stream['streamId']
-                                    playBehavior = directive['payload']['playBehavior']
-                                if stream['streamUrl'].startswith("cid:"):
-                                    content = path + "tmpcontent/" + stream['streamUrl'].lstrip("cid:") + ".mp3"
-                                else:
-                                    content = stream['streamUrl']
-                                pThread = threading.Thread(target=play_audio,
-                                                           args=(content, stream['offsetInMilliseconds']))
-                                pThread.start()
-                    elif directive['namespace'] == "Speaker":
-                        # speaker control such as volume
-                        if directive['name'] == 'SetVolume':
-                            vol_token = directive['payload']['volume']
-                            type_token = directive['payload']['adjustmentType']
-                            if (type_token == 'relative'):
-                                currVolume = currVolume + int(vol_token)
-                            else:
-                                currVolume = int(vol_token)
-
-                            if (currVolume > MAX_VOLUME):
-                                currVolume = MAX_VOLUME
-                            elif (currVolume < MIN_VOLUME):
-                                currVolume = MIN_VOLUME
-
-                            self.emit_message("NEW_VOLUME",str(currVolume))
-
-            elif 'audioItem' in j['messageBody']:  # Additional Audio Iten
-                nav_token = j['messageBody']['navigationToken']
-                for stream in j['messageBody']['audioItem']['streams']:
-                    if stream['progressReportRequired']:
-                        streamid = stream['streamId']
-                    if stream['streamUrl'].startswith("cid:"):
-                        content = path + "tmpcontent/" + stream['streamUrl'].lstrip("cid:") + ".mp3"
-                    else:
-                        content = stream['streamUrl']
-                    pThread = threading.Thread(target=play_audio, args=(content, stream['offsetInMilliseconds']))
-                    pThread.start()
-
-            return
+            cids = []
+            try:
+                self._process_parts(r, cids)
+            finally:
+                # hand the connection back to the pool even when a
+                # directive or the download failed halfway
+                r.close()
+                # a speak started early that was never joined: end its
+                # pipe so VLC sees EOF and the thread gives its player back
+                for cid in cids:
+                    speaking = self._speaking.pop(cid, None)
+                    if speaking:
+                        media = speaking[1]
+                        media.finish()
+                        media.close()
+                # audio of speak directives that were not played, e.g.
+                # after a failed listen; queued AudioPlayer items free
+                # theirs when they play or are dropped (see drop_item)
+                items = self._scheduler.queued() + [self._scheduler.current]
+                queued = set(item.url[len("cid:"):] for item in items
+                             if item and item.url.startswith("cid:"))
+                for cid in cids:
+                    if cid not in queued:
+                        self.discard_content(cid)
         elif r.status_code == 204:
             self.emit_message("NULL_RESPONSE")
+            r.close()
         else:
             self.emit_message("PROCESS_RESPONSE_ERROR",str(r.status_code))
-            r.connection.close()
-
+            # drop this connection only, not the whole shared pool
+            r.close()
 
-    def play_audio(self,file=DETECT_DING, offset=0, overRideVolume=0):
+    def _process_parts(self, r, cids):
+        "Parse and run a 200 response, noting the Content-IDs of its audio in `cids`"
+        global nav_token, streamurl, streamid, currVolume, isMute
+        j = None
+        speak_cid = None
+        part_type = part_cid = media = None
+        part_data = []
+        boundary = avs_multipart.boundary_from_content_type(r.headers['content-type'])
+        for event, value in avs_multipart.iter_multipart(r.iter_content(RESPONSE_CHUNK_SIZE), boundary):
+            if event == 'begin':
+                part_type = value.get('content-type', '').split(';')[0].strip()
+                part_cid = value.get('content-id', '').strip("<>")
+                part_data = []
+                media = None
+                if part_type == "audio/mpeg":
+                    cids.append(part_cid)
+                if part_type == "audio/mpeg" and part_cid == speak_cid:
+                    # start speaking while the rest of the response is downloading
+                    media = memory_media.MemoryMedia()
+                    self._content[part_cid] = media
+                    sThread = threading.Thread(target=self.play_audio, args=("cid:" + part_cid,))
+                    sThread.start()
+                    self._speaking[part_cid] = (sThread, media)
+            elif event == 'data':
+                if media:
+                    media.write(value)
+                else:
+                    part_data.append(value)
+            elif event == 'end':
+                if part_type == "application/json":
+                    j = json.loads(b''.join(part_data).decode('utf-8'))
+                    self.emit_message("JSON",json.dumps(j))
+                    speak_cid = self.first_speak_cid(j)
+                elif part_type == "audio/mpeg":
+                    if media:
+                        media.finish()
+                    else:
+                        self._content[part_cid] = b''.join(part_data)
+                else:
+                    self.emit_message("NEW_CONTENT_TYPE",part_type)
+        if j is None:
+            self.emit_message("PROCESS_RESPONSE_ERROR","no directives")
+            return
+        # Now process the response
+        if 'directives' in j['messageBody']:
+            for directive in j['messageBody']['directives']:
+                if directive['namespace'] == 'SpeechSynthesizer':
+                    if directive['name'] == 'speak':
+                        cid = directive['payload']['audioContent'][len("cid:"):]
+                        speaking = self._speaking.pop(cid, None)
+                        if speaking:
+                            # already started by the streaming parser
+                            speaking[0].join()
+                        else:
+                            self.play_audio(directive['payload']['audioContent'])
+                    for directive in j['messageBody']['directives']:  # if Alexa expects a response
+                        if directive[
+                            'namespace'] == 'SpeechRecognizer':  # this is included in the same string as above if a response was expected
+                            if directive['name'] == 'listen':
+                                self.play_audio(DETECT_BEEP, 0, 100)
+                                timeout = directive['payload']['timeoutIntervalInMillis'] / 116
+                                # listen until the timeout from Alexa
+                                self.silence_listener(timeout)
+                                # now process the response
+                                self.alexa_speech_recognizer()
+                elif directive['namespace'] == 'AudioPlayer':
+                    if directive['name'] == 'play':
+                        payload = directive['payload']
+                        nav_token = payload['navigationToken']
+                        items = [audio_scheduler.AudioItem.from_stream(stream, nav_token)
+                                 for stream in payload['audioItem']['streams']]
+                        self._scheduler.submit(items, payload.get('playBehavior',
+                                                                  audio_scheduler.REPLACE_ALL))
+                elif directive['namespace'] == "Speaker":
+                    # speaker control such as volume
+                    if directive['name'] == 'SetVolume':
+                        vol_token = directive['payload']['volume']
+                        type_token = directive['payload']['adjustmentType']
+                        if (type_token == 'relative'):
+                            currVolume = currVolume + int(vol_token)
+                        else:
+                            currVolume = int(vol_token)
+
+                        if (currVolume > MAX_VOLUME):
+                            currVolume = MAX_VOLUME
+                        elif (currVolume < MIN_VOLUME):
+                            currVolume = MIN_VOLUME
+
+                        self.emit_message("NEW_VOLUME",str(currVolume))
+
+        elif 'audioItem' in j['messageBody']:  # Additional Audio Iten
+            nav_token = j['messageBody']['navigationToken']
+            items = [audio_scheduler.AudioItem.from_stream(stream, nav_token)
+                     for stream in j['messageBody']['audioItem']['streams']]
+            self._scheduler.submit(items, audio_scheduler.ENQUEUE)
+
+
+    def play_audio(self,file=DETECT_DING, offset=0, overRideVolume=0, timeout=None, item=None):
+        """
+        Play `file` and block until it ends, or until `timeout` seconds
+        pass. Returns True if it played to the end. `item` is the
+        AudioPlayer item being played: its events are reported to AVS and
+        stop_audio() stops it.
+        """
         global currVolume
         if (file.find('radiotime.com') != -1):
-            file = tuneinplaylist(file)
+            file = self.tuneinplaylist(file)
         global nav_token, p, audioplaying
         self.emit_message("PLAY_AUDIO",file)
-        i = vlc.Instance('--aout=alsa')  # , '--alsa-audio-device=mono', '--file-logging', '--logfile=vlc-log.txt')
-        i = vlc.Instance('--aout=alsa', '--alsa-audio-device=plughw:0,0')
-        m = i.media_new(file)
-        p = i.media_player_new()
-        p.set_media(m)
-        mm = m.event_manager()
-        mm.event_attach(vlc.EventType.MediaStateChanged, self.state_callback, p)
-        audioplaying = True
-
         if (overRideVolume == 0):
-            p.audio_set_volume(currVolume)
+            volume = currVolume
         else:
-            p.audio_set_volume(overRideVolume)
+            volume = overRideVolume
+        if self._earcons.has(file):
+            playback = self._earcons.play(file, volume)
+            if not playback.wait(timeout):
+                self._earcons.stop()
+                return False
+            return not playback.failed
+        media = None
+        if file.startswith("cid:"):
+            # response audio is played from memory, see process_response
+            media = self._content.pop(file[len("cid:"):], b'')
+            if not isinstance(media, memory_media.MemoryMedia):
+                media = memory_media.MemoryMedia(media)
+            file = media.mrl
+
+        # set by state_callback when the player stops, ends or fails
+        done = threading.Event()
+        audioplaying = True
+        player = player_service.play(file, volume, self.state_callback, done, item,
+                                     start_ms=offset)
+        p = player.player
+        if item:
+            self._player = player
+            # a REPLACE_ALL or stop that came while the player started
+            # could not reach it
+            if self._scheduler.stale(item):
+                player.stop()
+        if not done.wait(timeout):
+            player.stop()
+        if item:
+            self._player = None
+        ended = player.player.get_state() == 6
+        player_service.release(player)
+        if media:
+            media.close()
+        return ended
+
+    def play_item(self, item, url):
+        "Play a queued AudioPlayer item, called by the scheduler thread"
+        global streamid, nav_token
+        streamid = item.stream_id if item.report_required else ""
+        nav_token = item.nav_token
+        return self.play_audio(url, item.offset, item=item)
+
+    def stop_audio(self):
+        """
+        Stop the AudioPlayer item that is playing, if any. The player
+        keeps its position from before the stop for PlaybackInterrupted.
+        """
+        player = self._player
+        if player is not None:
+            player.stop()
+
+    def playback_offset(self):
+        "Position of the AudioPlayer item that is playing, in ms"
+        player = self._player
+        if player is None:
+            return 0
+        return player.offset()
+
+    def playback_remaining(self):
+        "ms left in the AudioPlayer item that is playing, None if unknown"
+        player = self._player
+        if player is None:
+            return None
+        length = player.player.get_length()
+        if length <= 0:
+            return None
+        return length - player.offset()
+
+    def resolve_stream(self, url):
+        """
+        Stream URL VLC can play for the URL of an AudioPlayer item, with
+        its media prepared for the play() that follows
+        """
+        if url.find('radiotime.com') != -1:
+            url = self.tuneinplaylist(url)
+        if url and not url.startswith("cid:"):
+            player_service.preload(url, keep=False)
+        return url
 
-        p.play()
-        while audioplaying:
-            continue
+    def drop_item(self, item):
+        "A queued AudioPlayer item was replaced before it played"
+        if item.url.startswith("cid:"):
+            self.discard_content(item.url[len("cid:"):])
+
+    def playlist_idle(self, item):
+        "The queue ran dry after `item`, ask AVS what comes next"
+        if item.nav_token:
+            self.alexa_getnextitem(item.nav_token)
 
 
     def tuneinplaylist(self,url):
+        "The fastest answering stream below the TuneIn URL `url`"
         global tunein_parser
         self.emit_message("TUNEIN_URL",url)
-        req = requests.get(url)
-        lines = req.content.split('\n')
-
-        nurl = tunein_parser.parse_stream_url(lines[0])
+        nurl = tunein_parser.resolve_streams(url)
         if (len(nurl) != 0):
             return nurl[0]
 
         return ""
 
 
-    def state_callback(self,event, player):
-        global nav_token, audioplaying, streamurl, streamid
+    def state_callback(self,event, pooled, done=None, item=None):
+        global audioplaying
+        player = pooled.player
         state = player.get_state()
         # 0: 'NothingSpecial'
         # 1: 'Opening'
@@ -494,42 +786,44 @@ class Alexa:
         # 6: 'Ended'
         # 7: 'Error'
         self.emit_message("PLAYER_STATE",state)
+        # AudioPlayer events are only sent for items that ask for them
+        stream = ""
+        if item is not None and item.report_required:
+            stream = item.stream_id
+        # VLC's own time is gone by the time it stopped, ended or failed
+        offset = pooled.offset()
+        if state == 6 and player.get_length() > 0:
+            offset = player.get_length()
         if state == 3:  # Playing
-            if streamid != "":
-                rThread = threading.Thread(target=alexa_playback_progress_report_request,
-                                           args=("STARTED", "PLAYING", streamid))
-                rThread.start()
+            if item is not None:
+                self._scheduler.playing(item)
+            if stream:
+                self._reporter.report("STARTED", "PLAYING", stream, offset)
+                report = item.progress_report
+                self._reporter.track(stream, report.get('progressReportDelayInMilliseconds', 0),
+                                     report.get('progressReportIntervalInMilliseconds', 0))
         elif state == 5:  # Stopped
             audioplaying = False
-            if streamid != "":
-                rThread = threading.Thread(target=alexa_playback_progress_report_request,
-                                           args=("INTERRUPTED", "IDLE", streamid))
-                rThread.start()
-            streamurl = ""
-            streamid = ""
-            nav_token = ""
+            if done:
+                done.set()
+            if stream:
+                self._reporter.untrack(stream)
+                self._reporter.report("INTERRUPTED", "IDLE", stream, offset)
         elif state == 6:  # Ended
             audioplaying = False
-            if streamid != "":
-                rThread = threading.Thread(target=alexa_playback_progress_report_request,
-                                           args=("FINISHED", "IDLE", streamid))
-                rThread.start()
-                streamid = ""
-            if streamurl != "":
-                pThread = threading.Thread(target=play_audio, args=(streamurl,))
-                streamurl = ""
-                pThread.start()
-            elif nav_token != "":
-                gThread = threading.Thread(target=alexa_getnextitem, args=(nav_token,))
-                gThread.start()
+            if done:
+                done.set()
+            if stream:
+                self._reporter.untrack(stream)
+                self._reporter.report("FINISHED", "IDLE", stream, offset)
+            # the next item comes from the scheduler, see playlist_idle
         elif state == 7:
             audioplaying = False
-            if streamid != "":
-                rThread = threading.Thread(target=alexa_playback_progress_report_request, args=("ERROR", "IDLE", streamid))
-                rThread.start()
-            streamurl = ""
-            streamid = ""
-            nav_token = ""
+            if done:
+                done.set()
+            if stream:
+                self._reporter.untrack(stream)
+                self._reporter.report("ERROR", "IDLE", stream, offset)
 
 
     def silence_listener(self):
@@ -538,17 +832,31 @@ class Alexa:
         self.record_to_wave(path+WAVE_OUTPUT_FILENAME,self._pin)
         self.emit_message("RECORD_END")
         
-    def start(self):
-        self.play_audio(DETECT_DING)
-        self.record_to_wave(path+WAVE_OUTPUT_FILENAME,self._pin)
-        self.alexa_speech_recognizer()
+    def start(self, preroll=None, source=None):
+        # the ding plays while capture is already running
+        self.emit_message("PLAY_AUDIO",DETECT_DING)
+        self._earcons.play(DETECT_DING, currVolume)
+        if STREAMING_RECOGNIZE:
+            self.alexa_speech_recognizer_stream(preroll, source)
+        else:
+            self.record_to_wave(path+WAVE_OUTPUT_FILENAME,self._pin,preroll,source)
+            self.alexa_speech_recognizer()
         if self._model:
             print(('SNOWBOY_START|%s' % (self._model)).encode(coding))
         else:
             print(('SNOWBOY_START|snowboy.umdl').encode(coding))
         sys.stdout.flush()
         
+    def reporter_stats(self):
+        return self._reporter.stats()
+
+    def earcon_stats(self):
+        return self._earcons.latency_report()
+
     def terminate(self):
+        self._scheduler.clear()
+        self._reporter.stop()
+        self._earcons.close()
         self._pin.terminate()
         
 class MainLoop(glib.MainLoop):
@@ -557,6 +865,8 @@ class MainLoop(glib.MainLoop):
         super(MainLoop, self).__init__()
         self.__clear()
         self.__alexa = Alexa()
+        if refresh_token:
+            token_manager.start()
         self._model="snowboy.umdl"
 
     def __clear(self):
@@ -568,7 +878,19 @@ class MainLoop(glib.MainLoop):
             self.__alexa.start()
         elif len(args) >= 1 and args[0] == 'SNOWBOY_EVENT_DETECT':
             self.__alexa.emit_message("START")
-            self.__alexa.start()
+            if len(args) >= 4:
+                self.__alexa.start(args[2], args[3])
+            elif len(args) >= 3:
+                self.__alexa.start(args[2])
+            else:
+                self.__alexa.start()
+        elif len(args) >= 1 and args[0] == 'ALEXA_STATS':
+            self.__alexa.emit_message("STATS", json.dumps({'avs': avs.stats(),
+                                                           'player': player_service.stats(),
+                                                           'reporter': self.__alexa.reporter_stats(),
+                                                           'tunein': tunein_parser.cache_stats(),
+                                                           'stations': tunein_parser.index_stats(),
+                                                           'earcon': self.__alexa.earcon_stats()}))
         elif len(args) >= 1 and args[0] == 'ALEXA_STOP':
             if self.__alexa:
                 self.__alexa.terminate()
@@ -5,56 +5,84 @@
 # Copyright (c) 2016, Jianming Liu
 # All rights reserved.
 
-import collections
+import audiobus
+import bytering
+import earcon
+import hotword_loop
+import hotword_pool
+import logging
 import pyaudio
 import snowboydetect
 import time
 import wave
 import os
 import signal
-import pygame
 import sys
+import threading
 import glib
 
 coding = 'utf8'
+logger = logging.getLogger(__name__)
 TOP_DIR = os.path.dirname(os.path.abspath(__file__))
 
 RESOURCE_FILE = os.path.join(TOP_DIR, "resources/common.res")
 DETECT_DING = os.path.join(TOP_DIR, "resources/ding.wav")
 DETECT_DONG = os.path.join(TOP_DIR, "resources/dong.wav")
 
-class RingBuffer(object):
-    """Ring buffer to hold audio from PortAudio"""
-    def __init__(self, size = 4096):
-        self._buf = collections.deque(maxlen=size)
-
-    def extend(self, data):
-        """Adds data to the end of buffer"""
-        self._buf.extend(data)
-
-    def get(self):
-        """Retrieves data from the beginning of buffer and clears it"""
-        tmp = ''.join(self._buf)
-        self._buf.clear()
-        return tmp
-
+# audio before the detection point handed to the recognizer, in ms
+PREROLL_MS = 500
+if os.path.isdir('/dev/shm'):
+    PREROLL_FILE = '/dev/shm/mmdagent_preroll.raw'
+else:
+    PREROLL_FILE = os.path.join(TOP_DIR, "preroll.raw")
+
+# several microphones, e.g. "device:1,device:2" or "wav:a.wav,wav:b.wav",
+# each listened to by its own process (see hotword_pool.py)
+HOTWORD_SOURCES = [spec for spec in
+                   os.environ.get('MMDAGENT_HOTWORD_SOURCES', '').split(',') if spec]
+# detections of one utterance by several sources within this many ms
+# give one DETECT, for the loudest source
+ARBITRATION_MS = 300
 interrupted = False
 def interrupt_callback():
     global interrupted
     return interrupted
 
-def play_audio_file(fname=DETECT_DING):
+# ding and dong are decoded once. Their output stream is opened for each
+# sound and closed after it, so the device is free for recording and VLC;
+# a sound then starts once PortAudio opened the device. On a shareable
+# device (dmix/pulse) EARCON_KEEP_OPEN keeps the stream open and a sound
+# starts within one output buffer.
+EARCON_KEEP_OPEN = False
+earcons = None
+
+def shared_earcons():
+    """The process wide EarconPlayer, created on first use"""
+    global earcons
+    if earcons is None:
+        earcons = earcon.EarconPlayer((DETECT_DING, DETECT_DONG),
+                                      keep_open=EARCON_KEEP_OPEN)
+    return earcons
+
+def play_audio_file(fname=DETECT_DING, timeout=None):
     """Simple callback function to play a wave file. By default it plays
     a Ding sound.
 
+    The file is decoded on its first use only and played by
+    shared_earcons(), see EARCON_KEEP_OPEN for when it starts.
+
     :param str fname: wave file name
+    :param float timeout: stop playback after this many seconds
     :return: None
     """
-    pygame.mixer.init()
-    pygame.mixer.music.load(fname)
-    pygame.mixer.music.play()
-    while pygame.mixer.music.get_busy() == True:
-        continue
+    player = shared_earcons()
+    if not player.has(fname):
+        player.load(fname)
+    playback = player.play(fname)
+    if not playback.wait(timeout):
+        player.stop()
+    elif playback.failed:
+        logger.warning("%s was not played", fname)
 
 class HotwordDetector(object):
     """
@@ -68,16 +96,17 @@ class HotwordDetector(object):
                               decoder. If an empty list is provided, then the
                               default sensitivity in the model will be used.
     :param audio_gain: multiply input volume by this factor.
+    :param audio_bus: path of an audiobus.py ring buffer to read from instead
+                      of opening a PyAudio stream.
+    :param preroll_ms: audio before the detection point, in ms, that the
+                       recognizer should start from.
     """
     def __init__(self, decoder_model,
                  resource=RESOURCE_FILE,
                  sensitivity=[],
-                 audio_gain=1):
-        def audio_callback(in_data, frame_count, time_info, status):
-            self.ring_buffer.extend(in_data)
-            play_data = chr(0) * len(in_data)
-            return play_data, pyaudio.paContinue
-
+                 audio_gain=1,
+                 audio_bus=None,
+                 preroll_ms=PREROLL_MS):
         self.decoder_model = decoder_model
         tm = type(decoder_model)
         ts = type(sensitivity)
@@ -102,44 +131,110 @@ class HotwordDetector(object):
         if len(sensitivity) != 0:
             self.detector.SetSensitivity(sensitivity_str);
 
-        self.ring_buffer = RingBuffer(
-            self.detector.NumChannels() * self.detector.SampleRate() * 5)
+        self.preroll_ms = preroll_ms
+        self.ring_buffer = bytering.ByteRing(
+            self.detector.NumChannels() * self.detector.SampleRate() * 5,
+            self.detector.NumChannels() * self.detector.SampleRate() *
+            self.detector.BitsPerSample() / 8 * preroll_ms / 1000)
+        self.frame_bytes = hotword_loop.frame_bytes(
+            self.detector.SampleRate(), self.detector.NumChannels(),
+            self.detector.BitsPerSample() / 8)
+        self.loop = None
+        self.paused = False
+        self.stream_in = None
+        self.audio = None
+        self.audio_bus = audio_bus
+        self.bus_reader = None
+        if audio_bus:
+            self.bus_reader = audiobus.AudioBusReader(audio_bus)
+            assert self.bus_reader.rate == self.detector.SampleRate(), \
+                "audio bus rate (%d) does not match the model (%d)" % (
+                    self.bus_reader.rate, self.detector.SampleRate())
+            return
+
         self.audio = pyaudio.PyAudio()
+        self.stream_in = self._open_stream()
+
+    def _use_device(self):
+        """
+        Leave an audio bus whose capture daemon is gone and listen to the
+        microphone with PyAudio instead.
+        """
+        logger.warning("audio bus %s stopped, opening the microphone", self.audio_bus)
+        self.bus_reader.close()
+        self.bus_reader = None
+        self.audio_bus = None
+        self.ring_buffer.clear()
+        self.audio = pyaudio.PyAudio()
+        self.stream_in = self._open_stream()
+
+    def _close_stream(self):
+        self.stream_in.stop_stream()
+        self.stream_in.close()
+        self.stream_in = None
 
-        self.stream_in = self.audio.open(
+    def _audio_callback(self, in_data, frame_count, time_info, status):
+        # input only stream, there is no output buffer to fill
+        self.ring_buffer.extend(in_data)
+        return None, pyaudio.paContinue
+
+    def _open_stream(self):
+        return self.audio.open(
                                         input=True,
-                                        output=True,
                                         format=self.audio.get_format_from_width(self.detector.BitsPerSample() / 8),
                                         channels=self.detector.NumChannels(),
                                         rate=self.detector.SampleRate(),
                                         frames_per_buffer=2048,
                                         #input_device_index=1,
                                         #output_device_index=0,
-                                        stream_callback=audio_callback)
+                                        stream_callback=self._audio_callback)
 
-    def emit_message(self, message):
+    def emit_message(self, message, extra=None):
         
-        print(('SNOWBOY_EVENT_%s|%s' % (message, self.decoder_model)).encode(coding))
+        if extra:
+            print(('SNOWBOY_EVENT_%s|%s|%s' % (message, self.decoder_model, extra)).encode(coding))
+        else:
+            print(('SNOWBOY_EVENT_%s|%s' % (message, self.decoder_model)).encode(coding))
         sys.stdout.flush()
 
+    def preroll_reference(self):
+        """
+        Tell the recognizer where the pre-roll before the detection point
+        is: "bus:<offset>" when reading from an audio bus, where the
+        recognizer can read everything from that offset on, otherwise
+        "file:<path>" of the raw PCM kept by the ring buffer.
+        """
+        if self.bus_reader:
+            start = self.bus_reader.position - self.bus_reader.ms_to_bytes(self.preroll_ms)
+            return 'bus:%d' % max(start, 0)
+        if self.preroll_ms:
+            with open(PREROLL_FILE, 'wb') as f:
+                f.write(self.ring_buffer.preroll())
+            return 'file:%s' % PREROLL_FILE
+        return None
+
     def start(self, detected_callback=play_audio_file,
               interrupt_check=lambda: False,
-              sleep_time=0.03):
+              sleep_time=0.5):
 
         """
-        Start the voice detector. For every `sleep_time` second it checks the
-        audio buffer for triggering keywords. If detected, then call
+        Start the voice detector. Every hotword_loop.FRAME_MS of audio is
+        checked for triggering keywords as soon as the audio callback has
+        delivered it. If detected, then call
         corresponding function in `detected_callback`, which can be a single
         function (single model) or a list of callback functions (multiple
-        models). Every loop it also calls `interrupt_check` -- if it returns
-        True, then breaks from the loop and return.
+        models). After every frame it also calls `interrupt_check` -- if it
+        returns True, then breaks from the loop and return.
 
         :param detected_callback: a function or list of functions. The number of
                                   items must match the number of models in
                                   `decoder_model`.
         :param interrupt_check: a function that returns True if the main loop
                                 needs to stop.
-        :param float sleep_time: how much time in second every loop waits.
+        :param float sleep_time: how long in seconds a read of the audio bus
+                                 waits before `interrupt_check` is called
+                                 without audio. The PyAudio stream wakes
+                                 the loop itself.
         :return: None
         """
         tc = type(detected_callback)
@@ -152,22 +247,68 @@ class HotwordDetector(object):
             "Error: hotwords in your models (%d) do not match the number of " \
             "callbacks (%d)" % (self.num_hotwords, len(detected_callback))
 
+        self.resume()
         # self.check_kill_process("main.py")
-        while True:
-            #this keeps running
-            data = self.ring_buffer.get()
-
-            if len(data) == 0:
-                time.sleep(sleep_time)
-                continue
-
-            ans = self.detector.RunDetection(data)
-            if ans == -1:
-                logger.warning("Error initializing streams or reading audio data")
-            elif ans > 0:
-                self.emit_message("DETECT")
-                self.terminate()
-                break
+        if self.bus_reader:
+            bus_gone = []
+
+            def check():
+                if not self.bus_reader.writer_alive():
+                    bus_gone.append(True)
+                    return True
+                return interrupt_check()
+
+            self.loop = hotword_loop.DetectionLoop(
+                self.bus_reader, self.detector.RunDetection, self.frame_bytes,
+                sleep_time)
+            ans = self.loop.run(check)
+            if not bus_gone:
+                self._detected(ans)
+                return
+            self._use_device()
+        # Condition.wait() with a timeout polls on Python 2, so the
+        # ring is only ever woken by the callback or stop()
+        self.loop = hotword_loop.DetectionLoop(
+            self.ring_buffer, self.detector.RunDetection, self.frame_bytes)
+        self._detected(self.loop.run(interrupt_check))
+
+    def _detected(self, ans):
+        if ans is not None:
+            self.emit_message("DETECT", self.preroll_reference())
+            self.pause()
+
+    def pause(self):
+        """
+        Stop listening, keeping the model and PyAudio loaded. Without an
+        audio bus mmdagent_alexa.py records from the microphone next, so
+        the stream is closed to free the device; reading from a bus
+        leaves the device to its capture daemon. start() resumes.
+        :return: None
+        """
+        if self.paused:
+            return
+        self.paused = True
+        if self.loop:
+            self.loop.stop()
+        if self.bus_reader:
+            return
+        self._close_stream()
+
+    def resume(self):
+        """
+        Listen again after pause(): reset the detector and drop the audio
+        from before.
+        :return: None
+        """
+        if not self.paused:
+            return
+        self.detector.Reset()
+        self.ring_buffer.clear()
+        if self.bus_reader:
+            self.bus_reader.seek(self.bus_reader.written)
+        else:
+            self.stream_in = self._open_stream()
+        self.paused = False
 
     def check_kill_process(self, pstring):
         for line in os.popen("ps ax | grep " + pstring + " | grep -v grep"):
@@ -180,9 +321,87 @@ class HotwordDetector(object):
         Terminate audio stream. Users cannot call start() again to detect.
         :return: None
         """
-        self.stream_in.stop_stream()
-        self.stream_in.close()
-        self.audio.terminate()
+        if self.loop:
+            self.loop.stop()
+        if self.bus_reader:
+            self.bus_reader.close()
+            return
+        if self.stream_in:
+            self._close_stream()
+        if self.audio:
+            self.audio.terminate()
+
+class MultiSourceDetector(HotwordDetector):
+    """
+    HotwordDetector listening to several audio sources, one worker
+    process and SnowboyDetect each. DETECT carries the id of the source
+    that won the arbitration after the pre-roll reference:
+    SNOWBOY_EVENT_DETECT|model|preroll|source. mmdagent_alexa.py reads
+    the same MMDAGENT_HOTWORD_SOURCES and records from that source.
+
+    :param decoder_model: decoder model file path, a string or a list of strings
+    :param sources: hotword_pool source specs, the source id is the index.
+    :param resource: resource file path.
+    :param sensitivity: decoder sensitivity, a float.
+    :param audio_gain: multiply input volume by this factor.
+    :param window_ms: arbitration window.
+    :param preroll_ms: audio before the detection point, in ms, that the
+                       recognizer should start from.
+    """
+    def __init__(self, decoder_model, sources,
+                 resource=RESOURCE_FILE,
+                 sensitivity=None,
+                 audio_gain=1,
+                 window_ms=ARBITRATION_MS,
+                 preroll_ms=PREROLL_MS):
+        self.decoder_model = decoder_model
+        self.audio_bus = None
+        factory = hotword_pool.SnowboyFactory(decoder_model, resource,
+                                              sensitivity, audio_gain)
+        self.pool = hotword_pool.DetectorPool(sources, factory, window_ms,
+                                              preroll_ms=preroll_ms,
+                                              preroll_file=PREROLL_FILE)
+
+    def start(self, detected_callback=play_audio_file,
+              interrupt_check=lambda: False,
+              sleep_time=0.5):
+        """
+        Start a worker per source, or resume the paused ones, and wait for
+        the first arbitrated detection, then pause the workers.
+        """
+        if self.pool.paused and self.pool.all_alive():
+            self.resume()
+        else:
+            # first start, or a worker is gone with its source
+            self.pool.stop()
+            self.pool.start()
+        for detection in self.pool.detections():
+            self.emit_message("DETECT", '%s|%s' % (detection.preroll or '',
+                                                   detection.source))
+            break
+        self.pause()
+
+    def pause(self):
+        """
+        Stop the workers listening and release their devices; the worker
+        processes keep their models for the next start().
+        :return: None
+        """
+        self.pool.pause()
+
+    def resume(self):
+        """
+        Listen again with the paused workers.
+        :return: None
+        """
+        self.pool.resume()
+
+    def terminate(self):
+        """
+        Stop the workers and release their sources.
+        :return: None
+        """
+        self.pool.stop()
 
 class MainLoop(glib.MainLoop):
 
@@ -197,16 +416,22 @@ class MainLoop(glib.MainLoop):
         #print(('SNOWBOY_DEBUG|%s' % (args[0])).encode(coding))
         #sys.stdout.flush()
         if len(args) >= 1 and args[0] == 'SNOWBOY_START':
-            self.__clear()
             #print args[1]
-            if args[1]:
-                self.__snowboy = HotwordDetector(args[1], sensitivity=0.5)
-            else:
-                self.__snowboy = HotwordDetector("snowboy.umdl", sensitivity=0.5)
+            audio_bus = audiobus.configured_path()
+            model = args[1] or "snowboy.umdl"
+            # the paused detector of the last session resumes when it
+            # listens for the same model on the same input
+            if self.__snowboy and (self.__snowboy.decoder_model, self.__snowboy.audio_bus) != (model, audio_bus):
+                self.__snowboy.terminate()
+                self.__clear()
+            if self.__snowboy is None:
+                if HOTWORD_SOURCES:
+                    self.__snowboy = MultiSourceDetector(model, HOTWORD_SOURCES, sensitivity=0.5)
+                else:
+                    self.__snowboy = HotwordDetector(model, sensitivity=0.5, audio_bus=audio_bus)
             self.__snowboy.emit_message("START")
             self.__snowboy.start(detected_callback=play_audio_file,
-               interrupt_check=interrupt_callback,
-               sleep_time=0.03)
+               interrupt_check=interrupt_callback)
         elif len(args) >= 1 and args[0] == 'SNOWBOY_STOP':
             #print "STOP signal"
             #to be fixed, not working at the moment
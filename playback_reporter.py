@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# playback_reporter.py --- AudioPlayer events sent from a single worker
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Every VLC state change used to start a thread for its AudioPlayer
+# event. PlaybackReporter has one worker thread and a bounded queue:
+# report() only enqueues, events are sent in order over the shared
+# keep-alive session, failed sends are retried with exponential backoff,
+# and events that do not fit the queue are dropped and counted rather
+# than blocking the VLC event thread. The same worker emits the periodic
+# PROGRESS_REPORT events of the stream being tracked, with the offset
+# read from the player when the report is due.
+
+import logging
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(__name__)
+
+_WAKEUP = object()
+
+
+class PlaybackReporter(object):
+    """
+    :param send: send(request_type, player_activity, stream_id, offset_ms)
+                 posts one event, returning True on success; False or an
+                 exception means retry.
+    :param position: callable returning the current playback offset in ms,
+                     used for the progress reports.
+    :param maxsize: events waiting to be sent before new ones are dropped.
+    :param float retry: seconds before the first retry, doubled up to
+                        `max_retry`.
+    :param attempts: sends per event before it is given up.
+    """
+
+    def __init__(self, send, position=lambda: 0, maxsize=64, retry=0.5,
+                 max_retry=8.0, attempts=4):
+        self._send = send
+        self._position = position
+        self._queue = queue.Queue(maxsize)
+        self.retry = retry
+        self.max_retry = max_retry
+        self.attempts = attempts
+        self._lock = threading.Lock()
+        self._progress = None
+        self._stop = threading.Event()
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self._thread = threading.Thread(target=self._run, name='playback-reporter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def report(self, request_type, player_activity, stream_id, offset=0):
+        """Queue one event, never blocks"""
+        try:
+            self._queue.put_nowait((request_type, player_activity, stream_id, int(offset)))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning('playback event queue full, dropped %s' % request_type)
+
+    def track(self, stream_id, delay_ms=0, interval_ms=0):
+        """
+        Send PROGRESS_REPORT for `stream_id` `delay_ms` after now and then
+        every `interval_ms`. Either being 0 disables that part.
+        """
+        now = time.time()
+        with self._lock:
+            if delay_ms:
+                first = now + delay_ms / 1000.0
+            elif interval_ms:
+                first = now + interval_ms / 1000.0
+            else:
+                self._progress = None
+                return
+            self._progress = [stream_id, first, interval_ms / 1000.0]
+        self._wakeup()
+
+    def untrack(self, stream_id=None):
+        """Stop the progress reports, of `stream_id` only if given"""
+        with self._lock:
+            if self._progress and stream_id in (None, self._progress[0]):
+                self._progress = None
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._queue.put_nowait(_WAKEUP)
+        except queue.Full:
+            pass
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup()
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent, 'failed': self.failed,
+                    'dropped': self.dropped, 'retries': self.retries,
+                    'queued': self._queue.qsize()}
+
+    def _due_progress(self):
+        "The tracked stream id if a progress report is due, and the wait until the next"
+        with self._lock:
+            if self._progress is None:
+                return None, None
+            stream_id, due, interval = self._progress
+            now = time.time()
+            if now < due:
+                return None, due - now
+            if interval:
+                self._progress[1] = max(due + interval, now)
+            else:
+                self._progress = None
+            return stream_id, interval or None
+
+    def _run(self):
+        while not self._stop.is_set():
+            stream_id, wait = self._due_progress()
+            if stream_id is not None:
+                self._deliver('PROGRESS_REPORT', 'PLAYING', stream_id, self._position())
+                continue
+            try:
+                event = self._queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+            if event is not _WAKEUP:
+                self._deliver(*event)
+
+    def _deliver(self, request_type, player_activity, stream_id, offset):
+        delay = self.retry
+        for attempt in range(self.attempts):
+            if attempt:
+                with self._lock:
+                    self.retries += 1
+                if self._stop.wait(delay):
+                    break
+                delay = min(delay * 2, self.max_retry)
+            try:
+                if self._send(request_type, player_activity, stream_id, offset):
+                    with self._lock:
+                        self.sent += 1
+                    return True
+            except Exception as e:
+                logger.info('%s for %s failed: %s' % (request_type, stream_id, e))
+        with self._lock:
+            self.failed += 1
+        return False
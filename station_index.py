@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+# station_index.py --- local searchable index of TuneIn stations
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Every station TuneIn returns from a browse, describe or search call is
+# added to a StationIndex. Names, slogans and genres are split into
+# lowercase tokens, and search() finds the stations having, for every
+# word of the query, a token starting with it:
+#
+#   index = StationIndex('tunein_stations.db')
+#   index.add_many(stations)
+#   index.search('smooth ja')   # 'Smooth Jazz 24', ...
+#
+# Matches in the name rank above matches in the slogan or genre. With a
+# path the stations are kept in an SQLite file and loaded back when the
+# index is created, so stations heard of before a restart are found
+# without asking TuneIn again.
+
+import bisect
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    "Lowercase words of `text`"
+    if not text:
+        return []
+    return _TOKEN.findall(text.lower())
+
+
+def station_name(station):
+    return station.get('text') or station.get('name') or ''
+
+
+def station_fields(station):
+    "(name, other searchable text) of a station outline or listing"
+    other = ' '.join(station.get(key) or '' for key in
+                     ('subtext', 'slogan', 'genre_name', 'genre'))
+    return station_name(station), other
+
+
+class StationIndex(object):
+    """
+    :param path: SQLite file keeping the stations, in memory only if None.
+    :param max_stations: stations kept, those updated longest ago are
+                         dropped first.
+    """
+
+    def __init__(self, path=None, max_stations=20000):
+        self.path = path
+        self.max_stations = max_stations
+        self._lock = threading.Lock()
+        self._stations = {}
+        self._updated = {}
+        # guide_id -> the lowercase words of the name
+        self._names = {}
+        # token -> {guide_id: 2 if the token is in the name, 1 otherwise}
+        self._postings = {}
+        self._tokens = []
+        self._sorted = True
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if path:
+            try:
+                self._open(path)
+            except sqlite3.Error as e:
+                logger.warning('station index %s unavailable: %s' % (path, e))
+                self._db = None
+
+    def _open(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS stations ('
+                         'guide_id TEXT PRIMARY KEY, data TEXT, updated REAL)')
+        self._db.commit()
+        rows = self._db.execute('SELECT guide_id, data, updated FROM stations '
+                                'ORDER BY updated').fetchall()
+        with self._lock:
+            for guide_id, data, updated in rows:
+                try:
+                    station = json.loads(data)
+                except ValueError:
+                    continue
+                self._insert(guide_id, station, updated)
+        logger.debug('loaded %d stations from %s' % (len(rows), path))
+
+    def _insert(self, guide_id, station, updated):
+        if guide_id in self._stations:
+            self._remove(guide_id)
+        self._stations[guide_id] = station
+        self._updated[guide_id] = updated
+        name, other = station_fields(station)
+        words = tokenize(name)
+        self._names[guide_id] = ' '.join(words)
+        weights = dict((token, 1) for token in tokenize(other))
+        weights.update((token, 2) for token in words)
+        for token, weight in weights.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+                self._sorted = False
+            postings[guide_id] = weight
+
+    def _remove(self, guide_id):
+        station = self._stations.pop(guide_id)
+        del self._updated[guide_id]
+        del self._names[guide_id]
+        for token in set(tokenize(' '.join(station_fields(station)))):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(guide_id, None)
+                if not postings:
+                    del self._postings[token]
+                    self._sorted = False
+
+    def add(self, station):
+        self.add_many([station])
+
+    def add_many(self, stations):
+        """Add or update stations, those without a guide_id are ignored"""
+        now = time.time()
+        changed = []
+        with self._lock:
+            for station in stations:
+                guide_id = station and station.get('guide_id')
+                if not guide_id:
+                    continue
+                if self._stations.get(guide_id) != station:
+                    changed.append((guide_id, station))
+                self._insert(guide_id, station, now)
+            dropped = self._evict()
+        if self._db is not None and (changed or dropped):
+            self._store(changed, dropped, now)
+
+    def _evict(self):
+        excess = len(self._stations) - self.max_stations
+        if excess <= 0:
+            return []
+        dropped = sorted(self._updated, key=self._updated.get)[:excess]
+        for guide_id in dropped:
+            self._remove(guide_id)
+        return dropped
+
+    def _store(self, changed, dropped, now):
+        try:
+            with self._lock:
+                self._db.executemany('INSERT OR REPLACE INTO stations VALUES (?, ?, ?)',
+                                     [(guide_id, json.dumps(station), now)
+                                      for guide_id, station in changed])
+                self._db.executemany('DELETE FROM stations WHERE guide_id = ?',
+                                     [(guide_id,) for guide_id in dropped])
+                self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning('station index update failed: %s' % e)
+
+    def get(self, guide_id, default=None):
+        with self._lock:
+            return self._stations.get(guide_id, default)
+
+    def __contains__(self, guide_id):
+        with self._lock:
+            return guide_id in self._stations
+
+    def __len__(self):
+        return len(self._stations)
+
+    def _prefixed(self, prefix):
+        "guide_id -> weight of the stations with a token starting with `prefix`"
+        if not self._sorted:
+            self._tokens = sorted(self._postings)
+            self._sorted = True
+        tokens = self._tokens
+        matches = {}
+        i = bisect.bisect_left(tokens, prefix)
+        while i < len(tokens) and tokens[i].startswith(prefix):
+            postings = self._postings.get(tokens[i], {})
+            exact = tokens[i] == prefix
+            for guide_id, weight in postings.items():
+                # a whole word counts more than the start of one
+                weight = 2 * weight if exact else weight
+                if weight > matches.get(guide_id, 0):
+                    matches[guide_id] = weight
+            i += 1
+        return matches
+
+    def search(self, query, limit=50):
+        """
+        Stations with a token starting with every word of `query`, best
+        matches first.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self._lock:
+            scores = None
+            for word in words:
+                matches = self._prefixed(word)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = dict((guide_id, score + matches[guide_id])
+                                  for guide_id, score in scores.items()
+                                  if guide_id in matches)
+                if not scores:
+                    break
+            if not scores:
+                self.misses += 1
+                return []
+            self.hits += 1
+            phrase = ' '.join(words)
+
+            def rank(guide_id):
+                name = self._names[guide_id]
+                return (name != phrase, -scores[guide_id], len(name), name)
+
+            best = sorted(scores, key=rank)[:limit]
+            return [self._stations[guide_id] for guide_id in best]
+
+    def clear(self):
+        with self._lock:
+            self._stations.clear()
+            self._updated.clear()
+            self._names.clear()
+            self._postings.clear()
+            self._tokens = []
+            self._sorted = True
+            if self._db is not None:
+                try:
+                    self._db.execute('DELETE FROM stations')
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning('station index clear failed: %s' % e)
+
+    def stats(self):
+        with self._lock:
+            return {'stations': len(self._stations), 'tokens': len(self._postings),
+                    'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -1,7 +1,6 @@
 from __future__ import unicode_literals
 
-import ConfigParser as configparser
-
+import itertools
 import logging
 import re
 import time
@@ -12,10 +11,14 @@ from contextlib import closing
 
 import requests
 
+import cacheutil
+import station_index
+import workpool
+
 try:
-    import cStringIO as StringIO
+    import Queue as queue
 except ImportError:
-    import StringIO as StringIO
+    import queue
 try:
     import xml.etree.cElementTree as elementtree
 except ImportError:
@@ -29,73 +32,101 @@ class PlaylistError(Exception):
     pass
 
 
-class cache(object):
-    # TODO: merge this to util library (copied from mopidy-spotify)
+# defaults of the lookup cache of a TuneIn instance
+CACHE_ENTRIES = 512
+CACHE_BYTES = 4 * 1024 * 1024
+CACHE_TTL = 3600
+# failed lookups are retried after this many seconds
+CACHE_NEGATIVE_TTL = 30
+# caps of the optional on-disk tier, which keeps entries a day
+DISK_CACHE_ENTRIES = 5000
+DISK_CACHE_BYTES = 16 * 1024 * 1024
+DISK_CACHE_TTL = 86400
+# playlists inside playlists followed by resolve_streams, the threads
+# fetching and probing them, and seconds a probe waits for the first byte
+RESOLVE_DEPTH = 4
+RESOLVE_WORKERS = 6
+PROBE_TIMEOUT = 2.0
+# once a stream answered, seconds the others of its level get to answer
+PROBE_GRACE = 0.15
+# requests describe_many and browse_many keep in flight at a time
+BULK_CONCURRENCY = 6
+PLAYLIST_EXTENSIONS = ('.asx', '.wax', '.m3u', '.pls')
+# playlists are read up to this size, and the download stops as soon as
+# this many entries were parsed
+PLAYLIST_MAX_BYTES = 256 * 1024
+PLAYLIST_MAX_ENTRIES = 32
+
+
+def make_cache(path=None):
+    """
+    The lookup cache for TuneIn: in memory only, or backed by the SQLite
+    file `path` so lookups survive a restart.
+    """
+    memory = cacheutil.LRUCache(CACHE_ENTRIES, CACHE_BYTES,
+                                CACHE_TTL, CACHE_NEGATIVE_TTL)
+    if not path:
+        return memory
+    try:
+        disk = cacheutil.SQLiteCache(path, DISK_CACHE_ENTRIES, DISK_CACHE_BYTES,
+                                     DISK_CACHE_TTL, CACHE_NEGATIVE_TTL)
+    except Exception as e:
+        logger.warning('TuneIn disk cache %s unavailable: %s' % (path, e))
+        return memory
+    return cacheutil.TieredCache(memory, disk)
 
-    def __init__(self, ctl=0, ttl=3600):
-        self.cache = {}
-        self.ctl = ctl
-        self.ttl = ttl
-        self._call_count = 0
 
-    def __call__(self, func):
-        def _memoized(*args):
-            now = time.time()
-            try:
-                value, last_update = self.cache[args]
-                age = now - last_update
-                if (self._call_count > self.ctl or age > self.ttl):
-                    self._call_count = 0
-                    raise AttributeError
-                if self.ctl:
-                    self._call_count += 1
-                return value
+def _text_lines(data):
+    for line in data:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'ignore')
+        yield line.strip()
 
-            except (KeyError, AttributeError):
-                value = func(*args)
-                if value:
-                    self.cache[args] = (value, now)
-                return value
 
-            except TypeError:
-                return func(*args)
+def parse_m3u(data):
+    # Copied from mopidy.audio.playlists
+    # Mopidy version expects a header but it's not always present
+    for line in _text_lines(data):
+        if line and not line.startswith('#'):
+            yield line
 
-        def clear():
-            self.cache.clear()
 
-        _memoized.clear = clear
-        return _memoized
+def _ini_lines(data):
+    "(lowercase section, lowercase key, value) of the key=value lines of an ini file"
+    section = None
+    for line in _text_lines(data):
+        if line.startswith('['):
+            section = line[1:].split(']', 1)[0].strip().lower()
+        elif section is not None and '=' in line and not line.startswith(';'):
+            key, value = line.split('=', 1)
+            yield section, key.strip().lower(), value.strip()
 
 
-def parse_m3u(data):
-    # Copied from mopidy.audio.playlists
-    # Mopidy version expects a header but it's not always present
-    for line in data.readlines():
-        if not line.startswith('#') and line.strip():
-            yield line.strip()
+_PLS_KEY = re.compile(r'(file|length)(\d+)$')
 
 
 def parse_pls(data):
-    # Copied from mopidy.audio.playlists
-    try:
-        cp = configparser.RawConfigParser()
-        cp.readfp(data)
-    except configparser.Error:
-        return
-
-    for section in cp.sections():
-        if section.lower() != 'playlist':
+    # Reads line by line instead of building a RawConfigParser. FileN and
+    # LengthN of an entry may come in any order, so entries wait until
+    # both are known, or the end of input, and are yielded in the order
+    # they started.
+    entries = OrderedDict()
+    for section, key, value in _ini_lines(data):
+        match = _PLS_KEY.match(key)
+        if section != 'playlist' or not match:
             continue
-        for i in xrange(cp.getint(section, 'numberofentries')):
-            try:
-                # TODO: Remove this horrible hack to avoid adverts
-                if cp.has_option(section, 'length%d' % (i+1)):
-                    if cp.get(section, 'length%d' % (i+1)) == '-1':
-                        yield cp.get(section, 'file%d' % (i+1))
-                else:
-                    yield cp.get(section, 'file%d' % (i+1))
-            except configparser.NoOptionError:
-                return
+        entries.setdefault(match.group(2), {})[match.group(1)] = value
+        while entries:
+            index, entry = next(iter(entries.items()))
+            if 'file' not in entry or 'length' not in entry:
+                break
+            del entries[index]
+            # TODO: Remove this horrible hack to avoid adverts
+            if entry['length'] == '-1':
+                yield entry['file']
+    for entry in entries.values():
+        if entry.get('file') and entry.get('length') in (None, '-1'):
+            yield entry['file']
 
 
 def fix_asf_uri(uri):
@@ -103,42 +134,146 @@ def fix_asf_uri(uri):
 
 
 def parse_old_asx(data):
-    try:
-        cp = configparser.RawConfigParser()
-        cp.readfp(data)
-    except configparser.Error:
-        return
-    for section in cp.sections():
-        if section.lower() != 'reference':
-            continue
-        for option in cp.options(section):
-            if option.lower().startswith('ref'):
-                uri = cp.get(section, option).lower()
-                yield fix_asf_uri(uri)
+    for section, key, value in _ini_lines(data):
+        if section == 'reference' and key.startswith('ref'):
+            yield fix_asf_uri(value.lower())
 
 
 def parse_new_asx(data):
-    # Copied from mopidy.audio.playlists
+    # Copied from mopidy.audio.playlists, made incremental: references are
+    # yielded as their element ends and finished entries are dropped.
+    root = None
+    # cElementTree only takes native strings as event names
+    events = (str('start'), str('end'))
     try:
-        for event, element in elementtree.iterparse(data):
-            element.tag = element.tag.lower()  # normalize
-    except elementtree.ParseError:
+        for event, element in elementtree.iterparse(data, events=events):
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            tag = element.tag.lower()  # normalize
+            if tag in ('ref', 'entry'):
+                href = element.get('href') or element.get('HREF')
+                if href and href.strip():
+                    yield fix_asf_uri(href.strip())
+            if tag == 'entry' and root is not None:
+                root.clear()
+    except (elementtree.ParseError, SyntaxError):
         return
 
-    for ref in element.findall('entry/ref[@href]'):
-        yield fix_asf_uri(ref.get('href', '').strip())
 
-    for entry in element.findall('entry[@href]'):
-        yield fix_asf_uri(entry.get('href', '').strip())
+class _Rewound(object):
+    "A file whose first bytes were already read, put back in front"
+
+    def __init__(self, head, data):
+        self._head = head
+        self._data = data
+
+    def read(self, size=-1):
+        head = self._head
+        if size is None or size < 0:
+            self._head = head[:0]
+            return head + self._data.read()
+        if head:
+            self._head = head[size:]
+            return head[:size]
+        return self._data.read(size)
+
+    def __iter__(self):
+        head, self._head = self._head, self._head[:0]
+        if head:
+            for line in (head + self._data.readline()).splitlines(True):
+                yield line
+        for line in self._data:
+            yield line
 
 
 def parse_asx(data):
-    if 'asx' in data.getvalue()[0:50].lower():
+    head = data.read(50)
+    data = _Rewound(head, data)
+    if b'asx' in head.lower():
         return parse_new_asx(data)
     else:
         return parse_old_asx(data)
 
 
+class PlaylistBody(object):
+    """
+    File-like view of the body of a streamed requests response for the
+    playlist parsers: read(), readline() and iteration by line, fetching
+    chunks only as they are asked for. At most `limit` bytes are read,
+    a body cut short loses its last, incomplete line.
+    """
+
+    def __init__(self, response, limit=PLAYLIST_MAX_BYTES, chunk_size=8192):
+        self._chunks = response.iter_content(chunk_size)
+        self._buf = b''
+        self._left = limit
+        self._eof = False
+        self.received = 0
+
+    def _fill(self):
+        "Append the next chunk to the buffer, False at the end of the body"
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            self.received += len(chunk)
+            if len(chunk) > self._left:
+                logger.info('Playlist larger than %d bytes, truncated' %
+                            (self.received - len(chunk) + self._left))
+                buf = self._buf + chunk[:self._left]
+                self._buf = buf[:buf.rfind(b'\n') + 1]
+                self._eof = True
+                return True
+            self._left -= len(chunk)
+            self._buf += chunk
+            return True
+        self._eof = True
+        return False
+
+    def empty(self):
+        "True when the body has no bytes at all"
+        return not self._buf and not self._fill()
+
+    def read(self, size=-1):
+        while (size is None or size < 0 or len(self._buf) < size) and self._fill():
+            pass
+        if size is None or size < 0:
+            size = len(self._buf)
+        data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+    def readline(self):
+        while b'\n' not in self._buf and self._fill():
+            pass
+        end = self._buf.find(b'\n') + 1 or len(self._buf)
+        line, self._buf = self._buf[:end], self._buf[end:]
+        return line
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+def read_playlist(body, parser, url=None, max_entries=PLAYLIST_MAX_ENTRIES):
+    """
+    The first `max_entries` URLs `parser` finds in the PlaylistBody
+    `body`, other than `url`, all of them with None. The body is parsed while it downloads and
+    no more of it is read than those URLs take.
+    """
+    try:
+        return list(itertools.islice(
+            (u for u in parser(body) if u and u != url), max_entries))
+    except Exception as e:
+        logger.error('TuneIn playlist parsing failed %s' % e)
+        return []
+
+
 # This is all broken: mopidy/mopidy#225
 # from gi.repository import TotemPlParser
 # def totem_plparser(uri):
@@ -162,6 +297,8 @@ def find_playlist_parser(extension, content_type):
                      '.pls': parse_pls}
     content_type_map = {'video/x-ms-asf': parse_asx,
                         'application/x-mpegurl': parse_m3u,
+                        'audio/x-mpegurl': parse_m3u,
+                        'audio/mpegurl': parse_m3u,
                         'audio/x-scpls': parse_pls}
 
     parser = extension_map.get(extension, None)
@@ -169,23 +306,42 @@ def find_playlist_parser(extension, content_type):
         # Annoying case where the url gave us no hints so try and work it out
         # from the header's content-type instead.
         # This might turn out to be server-specific...
-        parser = content_type_map.get(content_type.lower(), None)
+        content_type = content_type.split(';')[0].strip().lower()
+        parser = content_type_map.get(content_type, None)
+        if not parser and content_type == 'text/plain':
+            # Tune.ashx answers with a bare list of URLs
+            parser = parse_m3u
     return parser
 
 
 class TuneIn(object):
     """Wrapper for the TuneIn API."""
 
-    def __init__(self, timeout, session=None):
-        self._base_uri = 'http://opml.radiotime.com/%s'
+    def __init__(self, timeout, session=None, cache=None, index=None,
+                 base_uri='http://opml.radiotime.com/%s'):
+        self._base_uri = base_uri
         self._session = session or requests.Session()
         self._timeout = timeout / 1000.0
-        self._stations = {}
+        # every station seen, searched before asking Search.ashx
+        if index is None:
+            index = station_index.StationIndex()
+        self._stations = index
+        self._pool = workpool.WorkerPool(max(RESOLVE_WORKERS, BULK_CONCURRENCY),
+                                         0, 'tunein')
+        # shared by _tunein and _get_playlist_urls, keyed by method and arguments
+        if cache is None:
+            cache = make_cache()
+        self._cache = cache
 
     def reload(self):
         self._stations.clear()
-        self._tunein.clear()
-        self._get_playlist.clear()
+        self._cache.clear()
+
+    def cache_stats(self):
+        return self._cache.stats()
+
+    def index_stats(self):
+        return self._stations.stats()
 
     def _flatten(self, data):
         results = []
@@ -198,6 +354,7 @@ class TuneIn(object):
 
     def _filter_results(self, data, section_name=None, map_func=None):
         results = []
+        stations = []
 
         def grab_item(item):
             if 'guide_id' not in item:
@@ -209,7 +366,7 @@ class TuneIn(object):
                 return
             else:
                 station = item
-            self._stations[station['guide_id']] = station
+            stations.append(station)
             results.append(station)
 
         for item in data:
@@ -220,6 +377,7 @@ class TuneIn(object):
                         grab_item(child)
             else:
                 grab_item(item)
+        self._stations.add_many(stations)
         return results
 
     def categories(self, category=''):
@@ -274,6 +432,23 @@ class TuneIn(object):
     def shows(self, guide_id):
         return self._browse('Show', guide_id)
 
+    def browse_many(self, guide_ids, section_name='Station',
+                    limit=BULK_CONCURRENCY):
+        """
+        The `section_name` section of every guide id, in order, fetched
+        `limit` at a time. A failed browse gives [].
+        """
+        def browse(guide_id):
+            try:
+                return self._browse(section_name, guide_id)
+            except Exception as e:
+                logger.info('Browsing %s failed: %s' % (guide_id, e))
+                return []
+
+        unique = list(OrderedDict.fromkeys(guide_ids))
+        results = dict(zip(unique, self._pool.map(browse, unique, limit)))
+        return [results[guide_id] for guide_id in guide_ids]
+
     def episodes(self, guide_id):
         args = '&c=pbrowse&id=' + guide_id
         results = self._tunein('Tune.ashx', args)
@@ -287,6 +462,7 @@ class TuneIn(object):
                 'type': 'audio',
                 'image': listing.get('logo', ''),
                 'subtext': listing.get('slogan', ''),
+                'genre_name': listing.get('genre_name', ''),
                 'URL': self._base_uri % url_args}
 
     def _station_info(self, station_id):
@@ -304,24 +480,140 @@ class TuneIn(object):
             logger.debug('Got %s', url)
             return [url]  # Catch these easy ones
         results = []
-        playlist, content_type = self._get_playlist(url)
-        if playlist:
-            parser = find_playlist_parser(extension, content_type)
-            if parser:
-                playlist_data = StringIO.StringIO(playlist)
-                try:
-                    results = [u for u in parser(playlist_data)
-                               if u and u != url]
-                except Exception as e:
-                    logger.error('TuneIn playlist parsing failed %s' % e)
-                if not results:
-                    logger.debug('Parsing failure, '
-                                 'malformed playlist: %s' % playlist)
+        urls, content_type = self._get_playlist_urls(url)
+        if urls is not None:
+            results = urls
+            if not results:
+                logger.debug('Parsing failure, '
+                             'malformed playlist: %s' % url)
         elif content_type:
             results = [url]
         logger.debug('Got %s', results)
         return list(OrderedDict.fromkeys(results))
 
+    def resolve_streams(self, url, depth=RESOLVE_DEPTH, probe=True):
+        """
+        Follow nested playlists below `url`, up to `depth` levels, and
+        return the stream URLs found, fastest first by time to the first
+        byte. `url` itself goes through the cached parse_stream_url. The
+        entries of the levels below are fetched in parallel; URLs that
+        give no hint of being a playlist are opened once, which tells a
+        stream from a playlist and times the stream. Once a stream
+        answered, the rest of the level gets PROBE_GRACE seconds; what is
+        still outstanding then is kept at the end, unranked. Streams that
+        failed are dropped unless nothing else is left.
+        """
+        timed = {}
+        untimed = []
+        late = []
+        failed = []
+        seen = set([url])
+        level = [url]
+        top = True
+        while level and depth > 0:
+            depth -= 1
+            following = []
+            if top:
+                results = [(url, (None, self.parse_stream_url(url)))]
+                top = False
+            else:
+                results = self._as_completed(level, self._expand)
+            for parent, result in results:
+                if result is None:
+                    # too slow to wait for
+                    late.append(parent)
+                    continue
+                ttfb, children = result
+                if children == [parent]:
+                    if ttfb is not None:
+                        timed[parent] = ttfb
+                    else:
+                        untimed.append(parent)
+                    continue
+                if not children:
+                    failed.append(parent)
+                for child in children:
+                    if '://' in child and child not in seen:
+                        seen.add(child)
+                        following.append(child)
+            level = following
+        # out of depth, hand over what is left as it is
+        untimed.extend(level)
+        if probe and untimed:
+            probing, untimed = untimed, []
+            for u, result in self._as_completed(probing, self._timed_probe):
+                if result is None:
+                    late.append(u)
+                elif result[0] is not None:
+                    timed[u] = result[0]
+                else:
+                    untimed.append(u)
+        ranked = sorted(timed, key=timed.get) + untimed + late
+        return list(OrderedDict.fromkeys(ranked)) or failed[:1]
+
+    def _as_completed(self, level, func):
+        """
+        Run func on every URL of `level` in the pool and yield
+        (url, (ttfb, ...)) as they finish, or (url, None) for the ones
+        outstanding PROBE_GRACE after the first stream answered.
+        """
+        done = queue.Queue()
+        for u in level:
+            self._pool.submit(lambda u=u: done.put((u, func(u))))
+        deadline = None
+        for i in range(len(level)):
+            timeout = self._timeout + PROBE_TIMEOUT
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                u, result = done.get(timeout=timeout)
+            except queue.Empty:
+                break
+            yield u, result
+            level = [x for x in level if x != u]
+            if deadline is None and result[0] is not None:
+                deadline = time.time() + PROBE_GRACE
+        for u in level:
+            yield u, None
+
+    def _expand(self, url):
+        "(seconds to first byte or None, entries of url, [url] for a stream)"
+        extension = urlparse.urlparse(url).path[-4:].lower()
+        if extension in PLAYLIST_EXTENSIONS or extension in ('.mp3', '.wma'):
+            return None, self.parse_stream_url(url)
+        content_type, ttfb = self._probe(url)
+        if content_type is None:
+            return None, []
+        if find_playlist_parser('', content_type) is None:
+            return ttfb, [url]
+        return None, self.parse_stream_url(url)
+
+    def _probe(self, url):
+        "(content type, seconds until the first byte) of url, (None, None) on failure"
+        start = time.time()
+        try:
+            with closing(self._session.get(url, timeout=PROBE_TIMEOUT,
+                                           stream=True)) as r:
+                r.raise_for_status()
+                content_type = r.headers.get('content-type', 'audio/mpeg')
+                if find_playlist_parser('', content_type) is not None:
+                    return content_type, None
+                if content_type.startswith('text/html'):
+                    raise PlaylistError('not a stream: %s' % content_type)
+                for chunk in r.iter_content(1):
+                    if chunk:
+                        return content_type, time.time() - start
+        except Exception as e:
+            logger.debug('Probing %s failed: %s' % (url, e))
+        return None, None
+
+    def _timed_probe(self, url):
+        return self.probe_stream(url), [url]
+
+    def probe_stream(self, url):
+        "Seconds until the first byte of `url` arrives, None if it does not"
+        return self._probe(url)[1]
+
     def tune(self, station):
         logger.debug('Tuning station id %s' % station['guide_id'])
         args = '&id=' + station['guide_id']
@@ -334,31 +626,52 @@ class TuneIn(object):
         return list(OrderedDict.fromkeys(stream_uris))
 
     def station(self, station_id):
-        if station_id in self._stations:
-            station = self._stations[station_id]
-        else:
+        station = self._stations.get(station_id)
+        if station is None:
+            # _station_info adds it to the index
             station = self._station_info(station_id)
-            self._stations['station_id'] = station
         return station
 
-    def search(self, query):
+    def describe_many(self, station_ids, limit=BULK_CONCURRENCY):
+        """
+        station() of every id, in order, None where it failed. Stations
+        missing from the index are described `limit` at a time.
+        """
+        def describe(station_id):
+            try:
+                return self._station_info(station_id)
+            except Exception as e:
+                logger.info('Describing %s failed: %s' % (station_id, e))
+
+        missing = [station_id for station_id in OrderedDict.fromkeys(station_ids)
+                   if station_id not in self._stations]
+        described = dict(zip(missing, self._pool.map(describe, missing, limit)))
+        return [described.get(station_id) or self._stations.get(station_id)
+                for station_id in station_ids]
+
+    def search(self, query, local=True):
         # "Search.ashx?query=" + query + filterVal
         if not query:
             logger.debug('Empty search query')
             return []
+        if local:
+            results = self._stations.search(query)
+            if results:
+                logger.debug('Found "%s" in the station index' % query)
+                return results
         logger.debug('Searching TuneIn for "%s"' % query)
         args = '&query=' + query
         search_results = self._tunein('Search.ashx', args)
         results = []
         for item in self._flatten(search_results):
-            if item.get('type', '') == 'audio':
+            if item.get('type', '') == 'audio' and 'guide_id' in item:
                 # Only return stations
-                self._stations[item['guide_id']] = item
                 results.append(item)
+        self._stations.add_many(results)
 
         return results
 
-    @cache()
+    @cacheutil.cached_method('_cache', failed=lambda body: not body)
     def _tunein(self, variant, args):
         uri = (self._base_uri % variant) + '?render=json' + args
         logger.debug('TuneIn request: %s', uri)
@@ -370,9 +683,15 @@ class TuneIn(object):
             logger.info('TuneIn API request for %s failed: %s' % (variant, e))
         return {}
 
-    @cache()
-    def _get_playlist(self, uri):
-        data, content_type = None, None
+    @cacheutil.cached_method('_cache', failed=lambda result: result == (None, None))
+    def _get_playlist_urls(self, uri):
+        """
+        (URLs, content type) of the playlist at `uri`, the URLs being None
+        when it is a stream or no parser knows the playlist. The body is
+        parsed as it downloads and the connection closed once
+        PLAYLIST_MAX_ENTRIES URLs are found.
+        """
+        urls, content_type = None, None
         try:
             # Defer downloading the body until know it's not a stream
             with closing(self._session.get(uri,
@@ -381,8 +700,12 @@ class TuneIn(object):
                 r.raise_for_status()
                 content_type = r.headers.get('content-type', 'audio/mpeg')
                 logger.debug('%s has content-type: %s' % (uri, content_type))
-                if content_type != 'audio/mpeg':
-                    data = r.content.decode('utf-8', errors='ignore')
+                body = PlaylistBody(r)
+                if content_type != 'audio/mpeg' and not body.empty():
+                    extension = urlparse.urlparse(uri).path[-4:]
+                    parser = find_playlist_parser(extension, content_type)
+                    if parser:
+                        urls = read_playlist(body, parser, uri)
         except Exception as e:
             logger.info('TuneIn playlist request for %s failed: %s' % (uri, e))
-        return (data, content_type)
+        return (urls, content_type)
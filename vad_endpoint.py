@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+# vad_endpoint.py --- end of utterance detection for recorded speech
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# An endpointer is fed the recorded audio one frame at a time and returns
+# True from feed() once the utterance is over. VadEndpointer classifies
+# 10/20/30 ms frames with webrtcvad and ends the utterance after
+# `silence_timeout` ms of non-speech following speech. AmplitudeEndpointer
+# is the older peak amplitude test kept for comparison and as fallback
+# when webrtcvad is not installed.
+
+import audio_dsp
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+SAMPLE_WIDTH = 2
+
+
+class AmplitudeEndpointer(object):
+    """Ends the utterance after `max_silent` chunks below `threshold`"""
+
+    def __init__(self, rate=16000, frame_samples=1024, threshold=4000,
+                 max_silent=20):
+        self.rate = rate
+        self.frame_samples = frame_samples
+        self.threshold = threshold
+        self.max_silent = max_silent
+        self.reset()
+
+    @property
+    def frame_bytes(self):
+        return self.frame_samples * SAMPLE_WIDTH
+
+    @property
+    def frame_ms(self):
+        return 1000.0 * self.frame_samples / self.rate
+
+    def reset(self):
+        self.frames = 0
+        self.speech_started = False
+        self.last_speech_frame = None
+        self.ended = False
+        self._num_silent = 0
+
+    def is_speech(self, frame):
+        return not audio_dsp.is_silent(frame, self.threshold)
+
+    def feed(self, frame):
+        """Process one frame and return True once the utterance has ended"""
+        self.frames += 1
+        if self.is_speech(frame):
+            self._num_silent = 0
+            self.speech_started = True
+            self.last_speech_frame = self.frames
+        elif self.speech_started:
+            self._num_silent += 1
+        if self.speech_started and self._num_silent > self.max_silent:
+            self.ended = True
+        return self.ended
+
+    @property
+    def trailing_ms(self):
+        """Audio recorded after the last speech frame, in milliseconds"""
+        if self.last_speech_frame is None:
+            return 0
+        return int((self.frames - self.last_speech_frame) * self.frame_ms)
+
+    @property
+    def speech_ms(self):
+        """Audio recorded up to the last speech frame, in milliseconds"""
+        if self.last_speech_frame is None:
+            return 0
+        return int(self.last_speech_frame * self.frame_ms)
+
+
+class VadEndpointer(AmplitudeEndpointer):
+    """
+    WebRTC VAD endpointer.
+
+    :param vad: a webrtcvad.Vad instance, created with `aggressiveness`
+                when omitted.
+    :param frame_ms: frame length, webrtcvad accepts 10, 20 or 30 ms.
+    :param silence_timeout: non-speech in ms after which the utterance
+                            ends. This is the end-of-speech latency.
+    :param throwaway_frames: frames at the start that are never counted as
+                             speech, they usually hold the tail of the ding.
+    :param min_speech_frames: consecutive speech frames needed before the
+                              utterance is considered started.
+    """
+
+    def __init__(self, vad=None, aggressiveness=2, rate=16000, frame_ms=30,
+                 silence_timeout=600, throwaway_frames=10,
+                 min_speech_frames=3, threshold=4000):
+        if vad is None and webrtcvad is not None:
+            vad = webrtcvad.Vad(aggressiveness)
+        self.vad = vad
+        self.silence_frames = max(1, int(silence_timeout / frame_ms))
+        self.throwaway_frames = throwaway_frames
+        self.min_speech_frames = min_speech_frames
+        AmplitudeEndpointer.__init__(self, rate, rate * frame_ms // 1000,
+                                     threshold, self.silence_frames)
+
+    def reset(self):
+        AmplitudeEndpointer.reset(self)
+        self._voiced_run = 0
+
+    def is_speech(self, frame):
+        if self.vad is None:
+            return AmplitudeEndpointer.is_speech(self, frame)
+        return self.vad.is_speech(frame, self.rate)
+
+    def feed(self, frame):
+        """Process one frame and return True once the utterance has ended"""
+        self.frames += 1
+        if self.frames <= self.throwaway_frames:
+            return False
+        if self.is_speech(frame):
+            self._voiced_run += 1
+            self._num_silent = 0
+            if self._voiced_run >= self.min_speech_frames:
+                self.speech_started = True
+            if self.speech_started:
+                self.last_speech_frame = self.frames
+        else:
+            self._voiced_run = 0
+            if self.speech_started:
+                self._num_silent += 1
+        if self.speech_started and self._num_silent >= self.silence_frames:
+            self.ended = True
+        return self.ended
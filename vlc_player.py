@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+# vlc_player.py --- long-lived VLC instance with a pool of players
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# Creating a vlc.Instance costs tens of milliseconds and the objects were
+# never released, so memory grew with every turn. PlayerService keeps one
+# instance and a few media players for the life of the process. Players
+# are borrowed with play() and handed back with release(); media for
+# sounds that are played over and over (ding, dong, beep) are created once
+# with preload(). preload(mrl, keep=False) prepares the media of the next
+# queued AudioPlayer item while the current one plays, and the play() of
+# that item takes it. Player events are attached once per player and
+# routed to the callback of whoever currently holds it.
+#
+# VLC reports a time of 0 or -1 once a player has stopped, ended or
+# failed, which is when AudioPlayer events need the offset. Every player
+# keeps the last position it reported while playing in `position`, see
+# offset().
+
+import collections
+import threading
+import time
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import vlc
+
+PLAYER_EVENTS = ('MediaPlayerPlaying', 'MediaPlayerStopped',
+                 'MediaPlayerEndReached', 'MediaPlayerEncounteredError')
+# media prepared for upcoming plays that are kept, the oldest is
+# released when a newer one comes
+MAX_PREPARED = 2
+
+
+class LatencyStats(object):
+    """Count, average, maximum and last of a series of durations"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, elapsed):
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+            self.last = elapsed
+            self.max = max(self.max, elapsed)
+
+    def as_dict(self):
+        with self._lock:
+            return {'count': self.count,
+                    'avg_ms': 1000 * self.total / self.count if self.count else 0,
+                    'max_ms': 1000 * self.max,
+                    'last_ms': 1000 * self.last}
+
+
+class PooledPlayer(object):
+    """A media player of the pool and the media it is currently playing"""
+
+    def __init__(self, service, player):
+        self.service = service
+        self.player = player
+        self.media = None
+        self.preloaded = False
+        self.started = None
+        self.position = 0
+        self._callback = None
+        self._args = ()
+        em = player.event_manager()
+        for name in PLAYER_EVENTS:
+            em.event_attach(getattr(vlc.EventType, name), self._on_event)
+        em.event_attach(vlc.EventType.MediaPlayerTimeChanged, self._on_time)
+
+    def _on_time(self, event):
+        if event.u.new_time > 0:
+            self.position = event.u.new_time
+
+    def _on_event(self, event):
+        if event.type == vlc.EventType.MediaPlayerPlaying and self.started:
+            self.service.start_latency.add(time.time() - self.started)
+            self.started = None
+        callback = self._callback
+        if callback:
+            callback(event, self, *self._args)
+
+    def offset(self):
+        """
+        Position in ms, the last one seen while playing once the player
+        stopped, ended or failed
+        """
+        now = self.player.get_time()
+        if now > 0:
+            self.position = now
+        return self.position
+
+    def stop(self):
+        self.offset()
+        self.player.stop()
+
+
+class PlayerService(object):
+    """
+    :param instance_args: arguments of the shared vlc.Instance.
+    :param pool_size: players created up front.
+    :param max_players: players allowed to play at the same time, play()
+                        blocks when all of them are busy.
+    """
+
+    def __init__(self, instance_args=(), pool_size=2, max_players=4):
+        self.instance = vlc.Instance(*instance_args)
+        self.max_players = max(max_players, pool_size)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._media = {}
+        self._prepared = collections.OrderedDict()
+        self.prepared_hits = 0
+        self.setup_latency = LatencyStats()
+        self.start_latency = LatencyStats()
+        for i in range(pool_size):
+            self._idle.put(self._new_player())
+
+    def _new_player(self):
+        with self._lock:
+            self._created += 1
+        return PooledPlayer(self, self.instance.media_player_new())
+
+    def preload(self, mrl, keep=True):
+        """
+        Create and parse the media for `mrl` ahead of its play(). With
+        `keep` every later play reuses it; otherwise only the next play()
+        of `mrl` takes it, and it is parsed in the background.
+        """
+        with self._lock:
+            media = self._media.get(mrl) if keep else self._prepared.get(mrl)
+        if media is not None:
+            return media
+        media = self.instance.media_new(mrl)
+        if keep:
+            media.parse()
+            with self._lock:
+                media = self._media.setdefault(mrl, media)
+            return media
+        media.parse_async()
+        evicted = []
+        with self._lock:
+            self._prepared[mrl] = media
+            while len(self._prepared) > MAX_PREPARED:
+                evicted.append(self._prepared.popitem(last=False)[1])
+        for old in evicted:
+            old.release()
+        return media
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.max_players
+        if grow:
+            return self._new_player()
+        return self._idle.get()
+
+    def play(self, mrl, volume=100, callback=None, *args, **kwargs):
+        """
+        Start playing `mrl` on a pooled player and return it. `callback` is
+        called as callback(event, pooled_player, *args) for the playing,
+        stopped, end reached and error events until release(). The
+        keyword `start_ms` starts playback that far into the media.
+        """
+        start_ms = kwargs.get('start_ms', 0)
+        t0 = time.time()
+        pooled = self._acquire()
+        with self._lock:
+            prepared = self._prepared.pop(mrl, None)
+            media = self._media.get(mrl)
+        if prepared is not None:
+            self.prepared_hits += 1
+            media = None
+        elif media is not None and start_ms:
+            # options would stick to the shared preloaded media
+            media = None
+        pooled.preloaded = media is not None
+        if media is None:
+            media = prepared or self.instance.media_new(mrl)
+            if start_ms:
+                media.add_option(':start-time=%.3f' % (start_ms / 1000.0))
+        pooled.media = media
+        pooled.position = start_ms
+        pooled._callback = callback
+        pooled._args = args
+        pooled.player.set_media(media)
+        pooled.player.audio_set_volume(volume)
+        pooled.started = time.time()
+        pooled.player.play()
+        self.setup_latency.add(time.time() - t0)
+        return pooled
+
+    def release(self, pooled):
+        """Stop the player if needed and put it back into the pool"""
+        pooled._callback = None
+        pooled._args = ()
+        pooled.started = None
+        pooled.player.stop()
+        if pooled.media is not None and not pooled.preloaded:
+            pooled.media.release()
+        pooled.media = None
+        self._idle.put(pooled)
+
+    def stats(self):
+        return {'players': self._created,
+                'prepared_hits': self.prepared_hits,
+                'setup': self.setup_latency.as_dict(),
+                'start': self.start_latency.as_dict()}
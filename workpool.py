@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# workpool.py --- small fixed size thread pool with a bounded queue
+# Copyright (c) 2016, Jianming Liu
+# All rights reserved.
+
+# Commentary:
+
+# The plugins run on Python 2 without concurrent.futures, and used to
+# start a new thread for every background call. WorkerPool keeps a fixed
+# number of daemon threads; submit() returns a Future and blocks while
+# `maxsize` calls are already waiting, so a burst of work can not grow
+# the process without bound.
+
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+logger = logging.getLogger(__name__)
+
+
+class Future(object):
+    """Result of a call submitted to a WorkerPool"""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def result(self, timeout=None):
+        """Return the result, or raise the exception of the call"""
+        if not self._done.wait(timeout):
+            raise queue.Empty('call did not finish in %s seconds' % timeout)
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class WorkerPool(object):
+    """
+    :param size: worker threads.
+    :param maxsize: calls waiting for a worker before submit() blocks,
+                    0 for no limit.
+    :param name: prefix of the thread names.
+    """
+
+    def __init__(self, size=2, maxsize=16, name='worker'):
+        self._queue = queue.Queue(maxsize)
+        self._threads = []
+        for i in range(size):
+            t = threading.Thread(target=self._run, name='%s-%d' % (name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def map(self, fn, items, limit=None):
+        """
+        Call fn on every item in the pool, results are in item order. With
+        `limit` at most that many of the calls are queued or running at a
+        time, so one map does not take every worker.
+        """
+        if not limit:
+            futures = [self.submit(fn, item) for item in items]
+            return [f.result() for f in futures]
+        slots = threading.Semaphore(limit)
+
+        def call(item):
+            try:
+                return fn(item)
+            finally:
+                slots.release()
+
+        futures = []
+        for item in items:
+            slots.acquire()
+            futures.append(self.submit(call, item))
+        return [f.result() for f in futures]
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            future, fn, args, kwargs = task
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                logger.warning('%s failed: %s' % (getattr(fn, '__name__', fn), e))
+                future.set_exception(e)
+
+    def shutdown(self, wait=True):
+        for t in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()